@@ -0,0 +1,113 @@
+"""
+Wall time and peak memory of the WaybackCDX entry points against the offline replay server, no network.
+
+    python benchmarks/bench_cdx.py --rows 10000 260000 2000000 --label before
+    (make a change)
+    python benchmarks/bench_cdx.py --rows 10000 260000 2000000 --label after
+
+Every run appends to the results file (benchmarks/bench_cdx.jsonl by default, gitignored), and the table at the end lines up
+every label in there so the runs can be compared.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from waybackscan.cdx import WaybackCDX
+from waybackscan.replay import ReplayTransport, synthetic_rows
+
+URL = 'www.nytimes.com'
+START = datetime.datetime(2010, 1, 1)
+END = datetime.datetime(2022, 1, 1)
+
+
+def cases(closest):
+    rng = np.random.default_rng(1)
+    targets = [START + datetime.timedelta(seconds=int(s))
+               for s in rng.integers(0, int((END - START).total_seconds()), closest)]
+    return {
+        'download_all': lambda c: c.download_all(URL),
+        'download_period': lambda c: c.download_period(URL, datetime.datetime(2013, 1, 1),
+                                                       datetime.datetime(2019, 1, 1)),
+        f'get_closest x{closest}': lambda c: [c.get_closest(URL, t) for t in targets],
+        'get_intervals': lambda c: c.get_intervals(URL, hrs=1, period_start=START, period_end=END),
+        'get_at_time': lambda c: c.get_at_time(URL, at=(datetime.time(9), datetime.time(17)),
+                                               period_start=START, period_end=END),
+        'coverage': lambda c: c.coverage(URL, resolution='day'),
+    }
+
+
+def run(case, transport, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        cdxer = WaybackCDX(transport=transport)
+        t0 = time.perf_counter()
+        case(cdxer)
+        best = min(best, time.perf_counter() - t0)
+    # Separate run for memory, tracemalloc slows everything down.
+    tracemalloc.start()
+    case(WaybackCDX(transport=transport))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak / 2**20
+
+
+def git_label():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 260_000, 2_000_000])
+    parser.add_argument('--cases', nargs='+', default=None, help='only run cases starting with these')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='bytes/s, default unlimited')
+    parser.add_argument('--closest', type=int, default=20, help='how many get_closest calls to time')
+    parser.add_argument('--repeat', type=int, default=3, help='keep the best of this many runs')
+    parser.add_argument('--label', type=str, default=None, help='defaults to the git commit')
+    parser.add_argument('--results', type=str,
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_cdx.jsonl'))
+    args = parser.parse_args()
+    label = args.label or git_label()
+
+    records = []
+    for rows in args.rows:
+        transport = ReplayTransport({URL: synthetic_rows(rows, START, END, URL)}, latency=args.latency,
+                                    bandwidth=args.bandwidth)
+        for name, case in cases(args.closest).items():
+            if args.cases and not any(name.startswith(c) for c in args.cases):
+                continue
+            requests_before = transport.requests
+            seconds, peak = run(case, transport, args.repeat)
+            record = {'label': label, 'case': name, 'rows': rows, 'seconds': seconds, 'peak_mb': peak,
+                      'requests': (transport.requests - requests_before) // (args.repeat + 1),
+                      'latency': args.latency, 'bandwidth': args.bandwidth, 'python': platform.python_version(),
+                      'pandas': pd.__version__, 'when': datetime.datetime.now().isoformat(timespec='seconds')}
+            records.append(record)
+            print(f'{name:22}{rows:>9}{seconds:>9.3f}s{peak:>9.1f}MB{record["requests"]:>6} requests')
+
+    with open(args.results, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+    results = pd.read_json(args.results, lines=True) if os.path.getsize(args.results) else pd.DataFrame()
+    if results['label'].nunique() > 1:
+        # latest run per label, labels in the order they were first recorded
+        results = results.drop_duplicates(subset=['label', 'case', 'rows'], keep='last')
+        table = results.pivot_table(index=['case', 'rows'], columns='label', values='seconds', sort=False)
+        print(table[list(dict.fromkeys(results['label']))].round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Compression ratio and (de)compression speed of zstd with a dictionary per layout era against plain zstd.
+
+Each era's dictionary is trained on its earlier pages and measured on its later ones, the way the store uses
+them (trained on what's stored, used for what comes in after). The "first era" row uses the first era's
+dictionary for everything, to show what a stale one costs once the layout changes.
+
+    python benchmarks/bench_dictionary.py                              # made up front pages, two layouts
+    python benchmarks/bench_dictionary.py --raw /data/nytimes/raw --eras 20180808
+    python benchmarks/bench_dictionary.py --store ~/.local/share/waybackscan/snapshots -u www.cnn.com
+"""
+import argparse
+import glob
+import os
+import pickle
+import time
+
+import numpy as np
+import zstandard
+
+from waybackscan.store import DICT_SIZE, SnapshotStore
+
+
+def synthetic_pages(pages, seed=0, eras=2):
+    """
+    Front pages a few hours apart, each era with its own nav/css/script boilerplate, and stories that stay on
+    the page for a while, like the real ones. Returns [(timestamp, html bytes)] and the era boundaries.
+    """
+    rng = np.random.default_rng(seed)
+    letters = list('abcdefghijklmnopqrstuvwxyz')
+    words = np.array([''.join(rng.choice(letters, rng.integers(2, 10))) for _ in range(8000)])
+
+    def text(n):
+        return ' '.join(rng.choice(words, n))
+
+    def layout():
+        classes = [f'{rng.choice(words)}-{rng.choice(words)}' for _ in range(300)]
+        css = ''.join(f'.{c}{{margin:{rng.integers(0, 40)}px;color:#{rng.integers(0, 2**24):06x};'
+                      f'font:{rng.integers(10, 30)}px {rng.choice(words)}}}' for c in classes)
+        script = ';'.join(f'window.{rng.choice(words)}={{"{rng.choice(words)}":"{text(3)}",'
+                          f'"id":{rng.integers(0, 10**9)}}}' for _ in range(400))
+        nav = ''.join(f'<li class="{rng.choice(classes)}"><a href="/section/{w}">{w.title()}</a></li>'
+                      for w in rng.choice(words, 120))
+        footer = ''.join(f'<a href="/{w}">{text(4)}</a>' for w in rng.choice(words, 200))
+        return classes, (f'<!DOCTYPE html><html><head><style>{css}</style><script>{script}</script></head>'
+                         f'<body><nav><ul>{nav}</ul></nav><main>'), f'</main><footer>{footer}</footer></body></html>'
+
+    def story(classes):
+        slug = '-'.join(rng.choice(words, 6))
+        return (f'<article class="{rng.choice(classes)}"><h2><a href="/2020/01/01/{rng.choice(words)}/{slug}.html">'
+                f'{text(10)}</a></h2><p class="{rng.choice(classes)}">{text(40)}</p>'
+                f'<span class="byline">By {text(2).title()}</span></article>')
+
+    per_era = -(-pages // eras)
+    out, boundaries = [], []
+    stamp = np.datetime64('2015-01-01T00:00:00')
+    for era in range(eras):
+        classes, head, tail = layout()
+        stories = [story(classes) for _ in range(60)]
+        boundaries.append(str(stamp).replace('-', '').replace(':', '').replace('T', ''))
+        for _ in range(min(per_era, pages - len(out))):
+            # a few stories swap out between captures
+            for i in rng.choice(len(stories), rng.integers(1, 8), replace=False):
+                stories[i] = story(classes)
+            html = head + ''.join(stories) + f'<!-- {rng.integers(0, 2**62):x} -->' + tail
+            out.append((str(stamp).replace('-', '').replace(':', '').replace('T', ''), html.encode()))
+            stamp += np.timedelta64(3, 'h')
+    return out, boundaries[1:]
+
+
+def raw_pages(raw):
+    """The pages of a raw/ tree of <timestamp>.pkl pickles, distinct ones only."""
+    out = []
+    for path in sorted(glob.glob(os.path.join(raw, '*.pkl'))):
+        if os.path.islink(path):
+            continue
+        with open(path, 'rb') as f:
+            html = pickle.load(f)
+        out.append((os.path.basename(path)[:-len('.pkl')], html.encode('utf-8') if isinstance(html, str) else html))
+    return out
+
+
+def store_pages(root, url):
+    store = SnapshotStore(root)
+    seen, out = set(), []
+    for timestamp in store.timestamps(url):
+        digest = store.digest(url, timestamp)
+        if digest not in seen:
+            seen.add(digest)
+            out.append((timestamp, store.get_blob(digest, raw=True)))
+    return out
+
+
+def measure(pages, level, dictionary=None):
+    """(bytes, compressed bytes, compress seconds, decompress seconds) over pages, each compressed on its own."""
+    compressor = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+    start = time.perf_counter()
+    frames = [compressor.compress(page) for page in pages]
+    compress = time.perf_counter() - start
+    start = time.perf_counter()
+    for frame in frames:
+        decompressor.decompress(frame)
+    decompress = time.perf_counter() - start
+    return np.array([sum(map(len, pages)), sum(map(len, frames)), compress, decompress])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--raw', type=str, default=None, help="a raw/ directory of .pkl pages")
+    source.add_argument('--store', type=str, default=None, help="a snapshot store, with -u")
+    parser.add_argument('-u', '--url', type=str, default=None)
+    parser.add_argument('--pages', type=int, default=2000, help="how many made up pages")
+    parser.add_argument('--eras', type=str, nargs='*', default=None, help="14 digit timestamps each era starts at")
+    parser.add_argument('--train', type=float, default=0.3, help="share of each era's pages to train on")
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--level', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.raw:
+        pages, eras, what = raw_pages(args.raw), args.eras or [], args.raw
+    elif args.store:
+        if not args.url:
+            parser.error('--store needs -u')
+        pages, eras, what = store_pages(args.store, args.url), args.eras or [], f'{args.url} in {args.store}'
+    else:
+        pages, eras = synthetic_pages(args.pages)
+        eras, what = args.eras or eras, f'{args.pages} made up front pages'
+    pages.sort()
+
+    splits = []
+    for since, until in zip([''] + sorted(eras), sorted(eras) + [None]):
+        era = [page for stamp, page in pages if stamp >= since and (until is None or stamp < until)]
+        cut = max(int(len(era) * args.train), 10)
+        if len(era) > cut:
+            splits.append((era[:cut], era[cut:]))
+    if not splits:
+        parser.error('not enough pages to train on and test with')
+
+    trained, t_train = [], 0.0
+    for train, _ in splits:
+        rng = np.random.default_rng(0)
+        sample = [train[i] for i in sorted(rng.choice(len(train), min(args.samples, len(train)), replace=False))]
+        start = time.perf_counter()
+        trained.append(zstandard.train_dictionary(DICT_SIZE, sample, level=args.level))
+        t_train += time.perf_counter() - start
+
+    test = [page for _, later in splits for page in later]
+    rows = [('plain', measure(test, args.level)),
+            ('per era', sum(measure(later, args.level, d) for (_, later), d in zip(splits, trained)))]
+    if len(splits) > 1:
+        rows.append(('first era', measure(test, args.level, trained[0])))
+
+    print(f'{what}: {len(pages)} pages, {len(splits)} era(s), tested on {len(test)} pages '
+          f'({sum(map(len, test)) / len(test) / 1024:.0f}KB average), zstd level {args.level}')
+    print(f'trained {len(trained)} dictionaries of {DICT_SIZE // 1024}KB in {t_train:.1f}s')
+    print(f'{"":10}{"ratio":>8}{"compress":>14}{"decompress":>14}')
+    for name, (size, compressed, compress, decompress) in rows:
+        print(f'{name:10}{size / compressed:>8.2f}{size / compress / 2**20:>10.1f}MB/s'
+              f'{size / decompress / 2**20:>10.1f}MB/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare the old per-target loop in get_intervals against the sorted-array matcher on a synthetic CDX frame.
+
+    python benchmarks/bench_matching.py --rows 1000000 --hours 1
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from waybackscan.match import mark_targets
+from waybackscan.utils import intervals
+
+
+def synthetic_cdx(rows, start='2015-01-01', end='2022-01-01', seed=0):
+    rng = np.random.default_rng(seed)
+    lo = pd.Timestamp(start, tz='UTC').value
+    hi = pd.Timestamp(end, tz='UTC').value
+    stamps = np.sort(rng.integers(lo, hi, rows)) // 10**9 * 10**9
+    dts = pd.to_datetime(stamps, utc=True)
+    return pd.DataFrame({
+        'urlkey': 'com,example)/',
+        'timestamp': dts.strftime('%Y%m%d%H%M%S'),
+        'original': 'https://www.example.com/',
+        'mimetype': 'text/html',
+        'statuscode': '200',
+        'digest': 'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA',
+        'length': '12345',
+        'datetime': dts,
+    })
+
+
+def legacy(df, reference_times):
+    # This is the loop get_intervals used to run, kept here for comparison.
+    storage_collection = df['datetime'].copy(deep=True).sort_values()
+    target_times = set()
+    for t in list(reference_times):
+        storage_collection = storage_collection[storage_collection >= t]
+        try:
+            target_times.add(storage_collection.iloc[0])
+        except IndexError:
+            pass
+    new_df = df.copy(deep=True)
+    new_df['is_target'] = df['datetime'].isin(target_times)
+    return new_df.drop_duplicates(subset='timestamp', keep='first')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--hours', type=int, default=1)
+    parser.add_argument('--legacy-targets', type=int, default=200,
+                        help='The old loop is too slow for a full grid, time this many targets and extrapolate.')
+    args = parser.parse_args()
+
+    df = synthetic_cdx(args.rows)
+    refs = list(intervals(df.datetime.min().to_pydatetime(), df.datetime.max().to_pydatetime(), hrs=args.hours))
+
+    t0 = time.perf_counter()
+    new = mark_targets(df, refs)
+    t_new = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    old = legacy(df, refs[:args.legacy_targets])
+    t_old = (time.perf_counter() - t0) * len(refs) / args.legacy_targets
+
+    check = mark_targets(df, refs[:args.legacy_targets])
+    assert (check['is_target'].to_numpy() == old['is_target'].to_numpy()).all()
+
+    print(f'rows={len(df)} targets={len(refs)} matched={int(new.is_target.sum())}')
+    print(f'searchsorted: {t_new:.3f}s')
+    print(f'legacy loop:  {t_old:.1f}s (extrapolated from {args.legacy_targets} targets)')
+    print(f'speedup:      {t_old / t_new:.0f}x')
+
+
+if __name__ == '__main__':
+    main()
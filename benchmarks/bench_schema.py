@@ -0,0 +1,64 @@
+"""
+Memory and parse/filter time of the typed CDX frame against the old all-strings frame.
+
+    python benchmarks/bench_schema.py --rows 260000
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+from pytz import UTC
+import pandas as pd
+
+from waybackscan.schema import cdx_frame, CDX_FIELDS, WAYBACK_FORMAT
+
+
+def synthetic_rows(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    lo = pd.Timestamp('2010-01-01', tz='UTC').value // 10**9
+    hi = pd.Timestamp('2022-01-01', tz='UTC').value // 10**9
+    stamps = pd.to_datetime(np.sort(rng.integers(lo, hi, rows)), unit='s').strftime(WAYBACK_FORMAT)
+    codes = rng.choice(['200', '200', '200', '301', '404', '-'], rows)
+    mimes = rng.choice(['text/html', 'warc/revisit', 'unk'], rows)
+    digests = [f'{d:032X}'[:32] for d in rng.integers(0, 2**62, rows)]
+    lengths = rng.integers(1000, 200000, rows).astype(str)
+    return [['com,nytimes)/', s, 'https://www.nytimes.com/', m, c, d, n]
+            for s, m, c, d, n in zip(stamps, mimes, codes, digests, lengths)]
+
+
+def legacy_frame(rows, columns, filt=True):
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    df['datetime'] = df['timestamp'].apply(lambda s: datetime.datetime.strptime(s, WAYBACK_FORMAT).replace(tzinfo=UTC))
+    if filt:
+        df = df[df['statuscode'] == '200']
+    return df
+
+
+def timed(f, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = f(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=260_000)
+    args = parser.parse_args()
+    rows = synthetic_rows(args.rows)
+
+    old, t_old = timed(legacy_frame, rows, CDX_FIELDS, filt=False)
+    new, t_new = timed(cdx_frame, rows, CDX_FIELDS, filt=False)
+    _, f_old = timed(lambda: old[(old.statuscode == '200') & (old.datetime >= old.datetime.iloc[len(old) // 2])])
+    _, f_new = timed(lambda: new[(new.statuscode == 200) & (new.datetime >= new.datetime.iloc[len(new) // 2])])
+    m_old = old.memory_usage(deep=True).sum() / 2**20
+    m_new = new.memory_usage(deep=True).sum() / 2**20
+
+    print(f'rows={args.rows}')
+    print(f'{"":8}{"parse":>10}{"filter":>10}{"memory":>12}')
+    print(f'{"strings":8}{t_old:>9.2f}s{f_old * 1000:>8.1f}ms{m_old:>10.1f}MB')
+    print(f'{"typed":8}{t_new:>9.2f}s{f_new * 1000:>8.1f}ms{m_new:>10.1f}MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+How long the cli takes to start, and a check that it stays fast: exits 1 if importing waybackscan.cli goes
+over --max-import-ms or pulls in any of the heavy modules before a command needs them.
+
+    python benchmarks/bench_startup.py --runs 20 --max-import-ms 100
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ('pandas', 'numpy', 'dateparser', 'pytz', 'tzlocal', 'requests', 'pyarrow')
+
+
+def importtime(module, env):
+    """(total microseconds for `module`, every module it imported) out of `python -X importtime`."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], env=env,
+                         capture_output=True, text=True, check=True).stderr
+    total, imported = None, set()
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imported.add(name.strip())
+        if name.strip() == module:
+            total = int(cumulative)
+    return total, imported
+
+
+def wall(args, env, runs):
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], env=env, capture_output=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, default=100.0,
+                        help='fail if importing waybackscan.cli takes longer than this')
+    args = parser.parse_args()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))}
+
+    # Best of a few, the first one pays for a cold disk cache.
+    import_us, imported = min(importtime('waybackscan.cli', env) for _ in range(3))
+    heavy = sorted(name for name in imported if name.split('.')[0] in HEAVY)
+    bare = wall(['-c', 'pass'], env, args.runs)
+    help_ = wall(['-c', 'import sys; sys.argv = ["waybackscan", "--help"]; '
+                        'from waybackscan.cli import cli; cli()'], env, args.runs)
+    dates = wall(['-c', 'from waybackscan.cli import parse_date; '
+                        'parse_date("2022-01-01T09:00:00Z"); parse_date("20220101")'], env, args.runs)
+
+    print(f'import waybackscan.cli  {import_us / 1000:8.1f}ms')
+    print(f'python -c pass          {bare * 1000:8.1f}ms')
+    print(f'waybackscan --help      {help_ * 1000:8.1f}ms  ({(help_ - bare) * 1000:.1f}ms over bare python)')
+    print(f'iso/wayback dates       {dates * 1000:8.1f}ms')
+
+    failed = False
+    if import_us / 1000 > args.max_import_ms:
+        print(f'FAIL: import took over {args.max_import_ms}ms', file=sys.stderr)
+        failed = True
+    if heavy:
+        print(f'FAIL: importing the cli pulled in {", ".join(heavy)}', file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
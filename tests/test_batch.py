@@ -0,0 +1,66 @@
+import pytest
+
+from waybackscan.batch import check_job, load_jobs, run_jobs
+from waybackscan.cdx import WaybackCDX
+from waybackscan.replay import ReplayTransport, synthetic_rows
+
+TOML = '''
+[defaults]
+start = "Jan 1 2020"
+
+[[job]]
+publisher = "nytimes"
+at = ["9:00 AM", "5:00 PM"]
+
+[[job]]
+url = "www.example.com"
+colour = "blue"
+
+[[job]]
+interval = 6
+'''
+
+TSV = '''# a comment
+publisher\turl\tat\tinterval
+nytimes\t\t9:00 AM; 5:00 PM\t
+\twww.example.com\t\t6
+'''
+
+
+def test_load_toml_keeps_bad_jobs(tmp_path):
+    path = tmp_path / 'jobs.toml'
+    path.write_text(TOML)
+    jobs = load_jobs(str(path))
+    assert len(jobs) == 3 and all(job['start'] == 'Jan 1 2020' for job in jobs)
+    check_job(jobs[0])
+    with pytest.raises(ValueError, match='colour'):
+        check_job(jobs[1])
+    with pytest.raises(ValueError, match='publisher or a url'):
+        check_job(jobs[2])
+
+
+def test_load_tsv(tmp_path):
+    path = tmp_path / 'jobs.tsv'
+    path.write_text(TSV)
+    jobs = load_jobs(str(path))
+    assert jobs == [{'publisher': 'nytimes', 'at': ['9:00 AM', '5:00 PM']}, {'url': 'www.example.com', 'interval': '6'}]
+    for job in jobs:
+        check_job(job)
+
+
+def job(name, output):
+    return {'name': name, 'url': 'www.example.com', 'start': '20200101', 'end': '20200201',
+            'method': 'download_period', 'kwargs': {}, 'output': output, 'format': 'tsv'}
+
+
+def test_unwritable_output_only_fails_its_job(tmp_path):
+    (tmp_path / 'taken').write_text('a file where the directory should go')
+    cdxer = WaybackCDX(transport=ReplayTransport(
+        {'www.example.com': synthetic_rows(50, '2020-01-01', '2020-02-01', 'www.example.com')}))
+    done = []
+    results = run_jobs(cdxer, [job('bad', str(tmp_path / 'taken' / 'bad.tsv')),
+                               job('good', str(tmp_path / 'new' / 'good.tsv'))], on_done=done.append)
+    assert [r['status'] for r in results] == ['failed', 'ok']
+    assert 'Error' in results[0]['error']
+    assert results[1]['rows'] > 0 and (tmp_path / 'new' / 'good.tsv').exists()
+    assert len(done) == 2
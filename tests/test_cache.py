@@ -0,0 +1,117 @@
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from waybackscan.cache import CDXCache
+from waybackscan.cdx import WaybackCDX
+from waybackscan.replay import ReplayTransport, synthetic_rows
+
+URL = 'www.example.com'
+
+
+class Recording(ReplayTransport):
+    """Remembers the from/to of every CDX query."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def get(self, url, **kwargs):
+        query = {k: v[0] for k, v in parse_qs(urlparse(url).query).items()}
+        self.queries.append((query.get('url'), query.get('from'), query.get('to')))
+        return super().get(url, **kwargs)
+
+
+def setup(tmp_path, ttl=None, max_bytes=None, urls=(URL,)):
+    transport = Recording({url: synthetic_rows(2000, '2020-01-01', '2020-03-01', url, seed=i)
+                           for i, url in enumerate(urls)})
+    cache = CDXCache(str(tmp_path / 'cdx.sqlite'), ttl=ttl, max_bytes=max_bytes)
+    return WaybackCDX(cache=cache, transport=transport), transport
+
+
+def backdate(cache, seconds):
+    """Make it look like the cache last went to the server `seconds` ago."""
+    then = time.time() - seconds
+    with cache._conn:
+        cache._conn.execute('UPDATE coverage SET fetched_at = ?, hi = ?',
+                            (then, time.strftime('%Y%m%d%H%M%S', time.gmtime(then))))
+
+
+def utc(s):
+    return pd.Timestamp(s, tz='UTC')
+
+
+
+def test_partial_overlap_only_fetches_the_gaps(tmp_path):
+    cdxer, transport = setup(tmp_path)
+    uncached = WaybackCDX(transport=transport)
+    first = cdxer.download_period(URL, utc('2020-01-10'), utc('2020-01-20'))
+    assert transport.queries == [(URL, '20200110000000', '20200120000000')]
+    assert first.equals(uncached.download_period(URL, utc('2020-01-10'), utc('2020-01-20')))
+
+    transport.queries.clear()
+    newest = cdxer.cache.newest(URL)
+    wider = cdxer.download_period(URL, utc('2020-01-05'), utc('2020-01-25'))
+    # the part before what's cached, and from the newest cached capture on
+    assert transport.queries == [(URL, '20200105000000', '20200110000000'), (URL, newest, '20200125000000')]
+    assert cdxer.cache.coverage(URL)[:2] == ('20200105000000', '20200125000000')
+    transport.queries.clear()
+    assert wider.equals(uncached.download_period(URL, utc('2020-01-05'), utc('2020-01-25')))
+
+
+def test_same_call_again_makes_no_requests(tmp_path):
+    cdxer, transport = setup(tmp_path)
+    first = cdxer.download_period(URL, utc('2020-01-10'), utc('2020-02-10'), filt=False)
+    requests = transport.requests
+    again = cdxer.download_period(URL, utc('2020-01-10'), utc('2020-02-10'), filt=False)
+    inside = cdxer.download_period(URL, utc('2020-01-15'), utc('2020-01-16'), filt=False)
+    assert transport.requests == requests
+    assert again.equals(first)
+    expected = first[(first['timestamp'] >= 20200115000000) & (first['timestamp'] <= 20200116000000)]
+    pd.testing.assert_frame_equal(inside, expected.reset_index(drop=True), check_categorical=False)
+
+
+def test_ttl(tmp_path):
+    cdxer, transport = setup(tmp_path, ttl=3600)
+    cdxer.download_period(URL, utc('2020-01-10'), None)
+    backdate(cdxer.cache, 60)
+    requests = transport.requests
+    # open-ended, but fetched less than ttl ago
+    cdxer.download_period(URL, utc('2020-01-10'), None)
+    assert transport.requests == requests
+    backdate(cdxer.cache, 7200)
+    assert not cdxer.cache.is_fresh(URL)
+    transport.queries.clear()
+    cdxer.download_period(URL, utc('2020-01-10'), None)
+    # only asks for what's newer than the newest capture it has
+    assert transport.queries == [(URL, cdxer.cache.newest(URL), None)]
+    assert cdxer.cache.is_fresh(URL)
+
+    # without a ttl an open end always goes back to the server
+    cdxer, transport = setup(tmp_path / 'no-ttl')
+    cdxer.download_period(URL, utc('2020-01-10'), None)
+    backdate(cdxer.cache, 60)
+    requests = transport.requests
+    cdxer.download_period(URL, utc('2020-01-10'), None)
+    assert transport.requests == requests + 1
+
+
+def test_evicts_least_recently_used(tmp_path):
+    urls = ['www.a.com', 'www.b.com', 'www.c.com']
+    cdxer, transport = setup(tmp_path, urls=urls)
+    cdxer.download_period(urls[0], None, utc('2020-03-01'))
+    one_url = cdxer.cache.size()
+    cdxer.cache.max_bytes = int(one_url * 2.5)
+    cdxer.download_period(urls[1], None, utc('2020-03-01'))
+    # reading a marks it used, so b is the one to go
+    cdxer.download_period(urls[0], utc('2020-01-01'), utc('2020-03-01'))
+    cdxer.download_period(urls[2], None, utc('2020-03-01'))
+    assert cdxer.cache.urls() == ['www.a.com', 'www.c.com']
+    assert cdxer.cache.size() <= cdxer.cache.max_bytes
+    assert cdxer.cache.read('www.b.com') == []
+
+    # the url touched last stays even if it's bigger than the whole cache
+    cdxer.cache.max_bytes = 1
+    cdxer.download_period(urls[1], None, utc('2020-03-01'))
+    assert cdxer.cache.urls() == ['www.b.com']
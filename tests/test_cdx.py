@@ -0,0 +1,269 @@
+import datetime
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+import requests
+
+from waybackscan.cache import CDXCache
+from waybackscan.cdx import WaybackCDX, collapse_digits, shard_windows
+from waybackscan.match import select_captures
+from waybackscan.replay import ReplayTransport, synthetic_rows
+
+URL = 'www.example.com'
+
+
+def rows(*stamps):
+    return [['com,example)/', stamp, f'https://{URL}/', 'text/html', '200', f'D{stamp}', '1000'] for stamp in stamps]
+
+
+def cdx(*stamps):
+    return WaybackCDX(transport=ReplayTransport({URL: rows(*stamps)}))
+
+
+def utc(s):
+    return pd.Timestamp(s, tz='UTC')
+
+
+def same_rows(a, b):
+    # frames put together from pages don't share their categories, so compare what's in them
+    pd.testing.assert_frame_equal(a.reset_index(drop=True).astype(str), b.reset_index(drop=True).astype(str))
+
+
+def test_after_does_not_match_from_a_later_cluster():
+    cdxer = cdx('20200101000000', '20200103000000', '20200120000000')
+    got = cdxer.get_closest_many(URL, [utc('2020-01-01T12:00'), utc('2020-01-19')], direction='after')
+    assert list(got['datetime']) == [utc('2020-01-03'), utc('2020-01-20')]
+    assert list(got['lag_seconds']) == [36 * 3600, 24 * 3600]
+
+
+def test_nearest_outside_window():
+    cdxer = cdx('20200101000000', '20200110000000')
+    got = cdxer.get_closest_many(URL, [utc('2020-01-04'), utc('2020-01-09T12:00')])
+    assert list(got['datetime']) == [utc('2020-01-01'), utc('2020-01-10')]
+    assert list(got['lag_seconds']) == [-3 * 86400, 12 * 3600]
+
+
+def test_no_capture_after_target():
+    cdxer = cdx('20200101000000', '20200103000000')
+    got = cdxer.get_closest_many(URL, [utc('2020-01-02'), utc('2020-02-01')], direction='after')
+    assert got['datetime'].iloc[0] == utc('2020-01-03')
+    assert pd.isna(got['datetime'].iloc[1]) and pd.isna(got['lag_seconds'].iloc[1])
+    assert pd.isna(cdxer.get_closest(URL, utc('2020-02-01'))['datetime'])
+
+
+def test_unknown_url_and_no_targets():
+    cdxer = cdx('20200101000000')
+    assert cdxer.get_closest_many('www.example.org', [utc('2020-01-01')])['datetime'].isna().all()
+    assert len(cdxer.get_closest_many(URL, [])) == 0
+
+
+@pytest.mark.parametrize('direction', ['nearest', 'after'])
+def test_matches_one_query_per_target(direction):
+    stamps = [f'2020{m:02d}{d:02d}000000' for m in (1, 2, 5) for d in (1, 4, 9, 17, 28)]
+    cdxer = cdx(*stamps)
+    targets = [utc(t) for t in ('2019-12-25', '2020-01-05', '2020-01-16T13:00', '2020-03-15', '2020-05-28',
+                                '2020-06-10')]
+    got = cdxer.get_closest_many(URL, targets, direction=direction)
+    for target, (_, row) in zip(targets, got.iterrows()):
+        expected = cdxer._closest_request(URL, target, direction)
+        if len(expected):
+            assert row['datetime'] == expected['datetime'].iloc[0]
+        else:
+            assert pd.isna(row['datetime'])
+
+
+def test_pages_across_resume_keys():
+    cdxer = WaybackCDX(transport=ReplayTransport({URL: synthetic_rows(95, '2020-01-01', '2020-02-01', URL)}))
+    whole = cdxer.download_period(URL, None, None, filt=False)
+    pages = list(cdxer.iter_pages(URL, filt=False, page_size=20))
+    keys = [key for _, key in pages]
+    assert len(pages) == 5 and all(keys[:-1]) and keys[-1] is None and len(set(keys[:-1])) == 4
+    assert [len(page) for page, _ in pages] == [20, 20, 20, 20, 15]
+    paged = pd.concat([page for page, _ in pages], ignore_index=True)
+    assert not paged['timestamp'].duplicated().any()
+    same_rows(paged, whole)
+    # picking up after the second page gets exactly the rest
+    rest = pd.concat([page for page, _ in cdxer.iter_pages(URL, filt=False, page_size=20, resume_key=keys[1])],
+                     ignore_index=True)
+    same_rows(rest, whole.iloc[40:])
+    # and download_period stitches them back together itself
+    same_rows(cdxer.download_period(URL, None, None, filt=False, page_size=20), whole)
+
+
+class Slow(ReplayTransport):
+    """The first urls answer last, and www.broken.com not at all."""
+
+    def __init__(self, captures, delays):
+        super().__init__(captures)
+        self.delays = delays
+
+    def get(self, url, **kwargs):
+        query = {k: v[0] for k, v in parse_qs(urlparse(url).query).items()}
+        if query.get('url') == 'www.broken.com':
+            raise requests.exceptions.ConnectionError('down')
+        time.sleep(self.delays.get(query.get('url'), 0))
+        return super().get(url, **kwargs)
+
+
+def test_download_many_keeps_the_order_and_survives_failures(capsys):
+    urls = ['www.c.com', 'www.broken.com', 'www.a.com', 'www.b.com']
+    captures = {url: synthetic_rows(50, '2020-01-01', '2020-02-01', url, seed=i) for i, url in enumerate(urls)}
+    cdxer = WaybackCDX(transport=Slow(captures, {'www.c.com': 0.2, 'www.a.com': 0.1}), max_workers=4)
+    frames = cdxer.download_many(urls + ['www.a.com'])
+    assert list(frames) == ['www.c.com', 'www.a.com', 'www.b.com']
+    for url, df in frames.items():
+        same_rows(df, cdxer.download_period(url, None, None))
+    assert 'www.broken.com' in capsys.readouterr().err
+
+    long = cdxer.download_many(urls, long=True)
+    assert list(dict.fromkeys(long['url'])) == ['www.c.com', 'www.a.com', 'www.b.com']
+    assert len(long) == sum(len(df) for df in frames.values())
+    capsys.readouterr()
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        cdxer.download_many(urls, errors='raise')
+    assert capsys.readouterr().err == ''
+
+
+def test_download_many_with_nothing_left():
+    cdxer = WaybackCDX(transport=Slow({}, {}))
+    assert cdxer.download_many(['www.broken.com'], errors='ignore') == {}
+    assert len(cdxer.download_many(['www.broken.com'], long=True, errors='ignore')) == 0
+
+
+def test_shard_windows():
+    assert shard_windows('20200115120000', '20200402000000') == [
+        ('20200115120000', '20200131235959'), ('20200201000000', '20200229235959'),
+        ('20200301000000', '20200331235959'), ('20200401000000', '20200402000000')]
+    assert shard_windows('20191231000000', '20210101000000', 'year') == [
+        ('20191231000000', '20191231235959'), ('20200101000000', '20201231235959'),
+        ('20210101000000', '20210101000000')]
+    assert shard_windows('20200105000000', '20200110000000') == [('20200105000000', '20200110000000')]
+
+
+class Overlapping(ReplayTransport):
+    """Gives every query a day more than it asked for, so neighbouring shards overlap."""
+
+    def _select(self, query):
+        if 'to' in query:
+            to = datetime.datetime.strptime(query['to'], '%Y%m%d%H%M%S') + datetime.timedelta(days=1)
+            query = {**query, 'to': to.strftime('%Y%m%d%H%M%S')}
+        return super()._select(query)
+
+
+@pytest.mark.parametrize('transport', [ReplayTransport, Overlapping])
+def test_sharded_matches_unsharded(transport):
+    captures = synthetic_rows(400, '2020-01-01', '2020-06-01', URL).tolist()
+    # captures right on the month edges, and a row the server lists twice
+    captures += rows('20200201000000', '20200229235959', '20200301000000', '20200301000000')
+    cdxer = WaybackCDX(transport=transport({URL: captures}))
+    start, end = utc('2020-01-10'), utc('2020-05-20')
+    whole = cdxer.download_period(URL, start, end, filt=False)
+    if transport is Overlapping:
+        whole = whole[whole['datetime'] <= end]
+    for shards in ('month', 'year'):
+        same_rows(cdxer.download_period(URL, start, end, filt=False, shards=shards), whole)
+    assert (cdxer.download_period(URL, start, end, filt=False, shards='month')['timestamp']
+            == 20200301000000).sum() == 2
+
+
+class Growing(ReplayTransport):
+    """The archive taking new captures: before the nth CDX request, the stamps in `arrivals[n]` show up."""
+
+    def __init__(self, stamps, arrivals):
+        super().__init__({URL: rows(*stamps)})
+        self.stamps = list(stamps)
+        self.arrivals = arrivals
+        self.polls = 0
+
+    def get(self, url, **kwargs):
+        if '/cdx/' in url:
+            self.stamps += self.arrivals.get(self.polls, [])
+            self.add(URL, rows(*self.stamps))
+            self.polls += 1
+        return super().get(url, **kwargs)
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_follow_yields_each_new_capture_once(tmp_path, cached):
+    transport = Growing(['20200101000000', '20200105000000'], {1: ['20200106000000'], 3: ['20200107120000']})
+    cache = CDXCache(str(tmp_path / 'cdx.sqlite')) if cached else None
+    cdxer = WaybackCDX(transport=transport, cache=cache)
+    frames = list(cdxer.follow(URL, since='20200105000000', every=0, polls=5))
+    # Nothing on the first poll, the new one on the second, and the ones after don't see it again.
+    assert [df['timestamp'].tolist() for df in frames] == [[20200106000000], [20200107120000]]
+    assert transport.polls == 5
+
+
+def test_watch_hands_frames_to_the_callback():
+    transport = Growing(['20200105000000'], {1: ['20200106000000']})
+    seen = []
+    WaybackCDX(transport=transport).watch(URL, seen.append, since='20200105000000', every=0, polls=3)
+    assert [df['timestamp'].tolist() for df in seen] == [[20200106000000]]
+
+
+@pytest.mark.parametrize('times, digits', [
+    (pd.date_range('2020-01-01', periods=30, freq='D', tz='UTC'), 8),
+    (pd.date_range('2020-01-01 06:00', periods=30, freq='h', tz='UTC'), 10),
+    (pd.date_range('2020-01-01 06:15', periods=30, freq='15min', tz='UTC'), 12),
+    (pd.date_range('2020-01-01 06:15:30', periods=30, freq='D', tz='UTC'), 14),
+    # Midnight in New York isn't on a UTC day boundary.
+    (pd.date_range('2020-01-01', periods=30, freq='D', tz='America/New_York'), 10),
+    ([], 14),
+])
+def test_collapse_digits(times, digits):
+    assert collapse_digits(times) == digits
+
+
+def test_plan_params():
+    days = pd.date_range('2020-01-01', periods=10, freq='D', tz='UTC')
+    cdxer = cdx()
+    assert cdxer.plan(days, fields=['digest', 'timestamp']) == {
+        'filter': 'statuscode:200', 'collapse': 'timestamp:8', 'fl': 'timestamp,digest'}
+    assert cdxer.plan(days, filt=False) == {'collapse': 'timestamp:8'}
+    # Collapse only keeps the first of each bucket, which is no good for anything but 'after'.
+    assert cdxer.plan(days, policy='nearest') == {'filter': 'statuscode:200'}
+    assert cdxer.plan(days + pd.Timedelta(seconds=1)) == {'filter': 'statuscode:200'}
+
+
+class Queries(ReplayTransport):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    def get(self, url, **kwargs):
+        self.queries.append({k: v[0] for k, v in parse_qs(urlparse(url).query).items()})
+        return super().get(url, **kwargs)
+
+
+@pytest.mark.parametrize('freq, digits', [('D', 8), ('6h', 10), ('30min', 12)])
+def test_planned_query_matches_client_side(freq, digits):
+    transport = Queries({URL: synthetic_rows(3000, '2020-01-01', '2020-02-01', URL, seed=4)})
+    cdxer = WaybackCDX(transport=transport)
+    times = pd.date_range('2020-01-03', '2020-01-28', freq=freq, tz='UTC')
+
+    planned = cdxer.download_targets(URL, times, period_end='20200201000000')
+    query = transport.queries[-1]
+    assert query['filter'] == 'statuscode:200' and query['collapse'] == f'timestamp:{digits}'
+
+    # The same thing done here: everything in the window, 200s only, first capture of each bucket.
+    full = cdxer.download_targets(URL, times, period_end='20200201000000', filt=False, plan=False)
+    assert 'collapse' not in transport.queries[-1] and 'filter' not in transport.queries[-1]
+    ok = full[full['statuscode'] == 200]
+    local = ok[~(ok['timestamp'] // 10 ** (14 - digits)).duplicated()]
+    same_rows(planned, local)
+    assert len(planned) < len(ok)
+
+    want = select_captures(ok['datetime'], times)
+    got = select_captures(planned['datetime'], times)
+    assert got['datetime'].tolist() == want['datetime'].tolist()
+
+
+def test_planned_fields():
+    transport = Queries({URL: synthetic_rows(500, '2020-01-01', '2020-02-01', URL, seed=5)})
+    times = pd.date_range('2020-01-03', '2020-01-20', freq='D', tz='UTC')
+    df = WaybackCDX(transport=transport).download_targets(URL, times, fields=['digest'])
+    assert transport.queries[-1]['fl'] == 'timestamp,digest'
+    assert list(df.columns) == ['timestamp', 'digest', 'datetime']
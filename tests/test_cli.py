@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from waybackscan import cli
+
+NEW_YORK = ZoneInfo('America/New_York')
+
+
+@pytest.fixture(autouse=True)
+def new_york(monkeypatch):
+    monkeypatch.setattr(cli, 'local_zone', lambda: NEW_YORK)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('20200101', datetime(2020, 1, 1, tzinfo=NEW_YORK)),
+    ('2020', datetime(2020, 1, 1, tzinfo=NEW_YORK)),
+    ('20200701093000', datetime(2020, 7, 1, 9, 30, tzinfo=NEW_YORK)),
+    ('2020-01-01', datetime(2020, 1, 1, tzinfo=NEW_YORK)),
+    ('2020-01-01T00:00Z', datetime(2020, 1, 1, tzinfo=timezone.utc)),
+    ('2020-01-01T09:00:00-05:00', datetime(2020, 1, 1, 14, tzinfo=timezone.utc)),
+])
+def test_dates_without_a_zone_are_local(value, expected):
+    assert cli.parse_date(value) == expected
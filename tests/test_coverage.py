@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from waybackscan.coverage import RESOLUTIONS, capture_counts, capture_gaps, coverage
+
+
+def utc(*stamps):
+    return pd.to_datetime(list(stamps), utc=True, format='ISO8601')
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+def test_empty(resolution):
+    counts = capture_counts(utc(), resolution)
+    assert len(counts) == 0 and list(counts.columns) == ['start', 'captures']
+    assert len(capture_gaps(utc())) == 0
+
+
+@pytest.mark.parametrize('resolution', RESOLUTIONS)
+def test_empty_with_a_window_is_all_zeros(resolution):
+    counts = capture_counts(utc(), resolution, '2020-01-01', '2021-12-31')
+    assert len(counts) and (counts['captures'] == 0).all()
+    gaps = capture_gaps(utc(), start='2020-01-01', end='2021-12-31')
+    assert gaps['length'].tolist() == [pd.Timedelta(days=730)]
+
+
+@pytest.mark.parametrize('resolution, edge, before', [
+    ('hour', '2020-03-02 05:00', '2020-03-02 04:59:59'),
+    ('day', '2020-03-02', '2020-03-01 23:59:59'),
+    ('week', '2020-03-02', '2020-03-01 23:59:59'),  # a Monday
+    ('month', '2020-03-01', '2020-02-29 23:59:59'),
+    ('year', '2021-01-01', '2020-12-31 23:59:59'),
+])
+def test_capture_on_a_bin_edge_starts_the_bin(resolution, edge, before):
+    counts = capture_counts(utc(before, edge), resolution)
+    assert counts['captures'].tolist() == [1, 1]
+    assert counts['start'].iloc[1] == pd.Timestamp(edge, tz='UTC')
+
+
+@pytest.mark.parametrize('resolution, expected', [
+    ('day', [2, 0, 0, 1] + [0] * 11 + [1]),
+    ('week', [3, 0, 1]),  # 2020-06-01 is a Monday
+    ('month', [4]),
+])
+def test_empty_bins_are_kept(resolution, expected):
+    times = utc('2020-06-01 00:00', '2020-06-01 23:59:59', '2020-06-04 12:00', '2020-06-16 08:00')
+    counts = capture_counts(times, resolution)
+    assert counts['captures'].tolist() == expected
+    assert counts['captures'].sum() == len(times)
+    # Bins are contiguous, one per unit from the first capture's to the last one's.
+    if resolution == 'day':
+        assert (np.diff(counts['start'].to_numpy()) == np.timedelta64(1, 'D')).all()
+
+
+def test_window_ends_are_inclusive():
+    times = utc('2020-01-01', '2020-01-05 12:00', '2020-01-10')
+    counts = capture_counts(times, 'day', '2020-01-01', '2020-01-10')
+    assert len(counts) == 10
+    assert counts['captures'].tolist() == [1, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+    inside = capture_counts(times, 'day', '2020-01-02', '2020-01-09')
+    assert inside['captures'].tolist() == [0, 0, 0, 1, 0, 0, 0, 0]
+
+
+def test_gaps_longest_first():
+    times = utc('2020-01-01', '2020-01-03', '2020-01-03 12:00', '2020-01-08')
+    result = coverage(times, 'day', min_gap=pd.Timedelta(days=1), start='2019-12-31', end='2020-01-08')
+    assert result.gaps['length'].tolist() == [pd.Timedelta(days=4, hours=12), pd.Timedelta(days=2)]
+    assert result.gaps['start'].iloc[0] == pd.Timestamp('2020-01-03 12:00', tz='UTC')
+    # Exactly min_gap isn't a gap, the stretch before the first capture is one day long.
+    assert pd.Timestamp('2019-12-31', tz='UTC') not in result.gaps['start'].tolist()
+
+
+def test_unknown_resolution():
+    with pytest.raises(ValueError):
+        capture_counts(utc('2020-01-01'), 'fortnight')
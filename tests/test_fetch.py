@@ -0,0 +1,89 @@
+import pandas as pd
+import requests
+
+from waybackscan.fetch import Journal, fetch_snapshots
+from waybackscan.ratelimit import RateLimiter
+from waybackscan.replay import ReplayTransport
+
+URL = 'www.example.com'
+STAMPS = ['20200101000000', '20200102000000', '20200103000000', '20200104000000']
+
+
+def rows(url=URL):
+    return [['com,example)/', stamp, f'https://{url}/', 'text/html', '200', f'D{i // 2}', '1000']
+            for i, stamp in enumerate(STAMPS)]
+
+
+class Flaky(ReplayTransport):
+    """Drops every other snapshot request, with a limiter like the real transport's."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = RateLimiter(rate=1000, burst=1000)
+        self.snapshots = 0
+
+    def get(self, url, **kwargs):
+        if '/web/' in url:
+            self.snapshots += 1
+            if self.snapshots % 2:
+                raise requests.exceptions.ConnectionError('dropped')
+        return super().get(url, **kwargs)
+
+
+def targets():
+    return pd.DataFrame({'timestamp': [int(s) for s in STAMPS], 'is_target': True})
+
+
+def test_fetch_and_resume(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.sqlite'))
+    transport = ReplayTransport({URL: rows()})
+    counts = fetch_snapshots(URL, targets(), str(tmp_path / 'raw'), journal, transport=transport, out=None)
+    assert counts == {'ok': 4}
+    assert sorted(p.name for p in (tmp_path / 'raw').iterdir()) == [f'{s}.pkl' for s in STAMPS]
+    requests_made = transport.requests
+    assert fetch_snapshots(URL, targets(), str(tmp_path / 'raw'), journal, transport=transport, out=None) == \
+        {'ok': 4}
+    assert transport.requests == requests_made
+
+
+def test_retries_dropped_connections(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.sqlite'))
+    transport = Flaky({URL: rows()})
+    counts = fetch_snapshots(URL, targets(), str(tmp_path / 'raw'), journal, transport=transport, out=None)
+    assert counts == {'ok': 4}
+    assert transport.limiter.stats()['throttled'] >= 1
+
+
+def test_no_retry_for_missing_snapshots(tmp_path):
+    journal = Journal(str(tmp_path / 'journal.sqlite'))
+    # the replay answers snapshots of urls it has no captures for with a 404
+    transport = ReplayTransport({'www.example.org': rows('www.example.org')})
+    counts = fetch_snapshots(URL, targets(), str(tmp_path / 'raw'), journal, transport=transport, out=None)
+    assert counts == {'failed': 4}
+    assert {retries for _, _, retries, _ in journal.failures(URL)} == {1}
+
+
+class Loops(ReplayTransport):
+    """The first capture redirects forever."""
+
+    def get(self, url, **kwargs):
+        if f'/web/{STAMPS[0]}id_/' in url:
+            raise requests.exceptions.TooManyRedirects('loop')
+        return super().get(url, **kwargs)
+
+
+def test_warc_dates_a_fallback_by_the_capture_it_came_from(tmp_path):
+    from waybackscan.warc import WarcWriter, iter_records
+
+    journal = Journal(str(tmp_path / 'journal.sqlite'))
+    captures = [row[:5] + [f'D{i}', '1000'] for i, row in enumerate(rows())]
+    chosen = targets().assign(is_target=[True, False, True, False])
+    with WarcWriter(str(tmp_path / 'warc')) as writer:
+        counts = fetch_snapshots(URL, chosen, writer, journal, transport=Loops({URL: captures}), out=None)
+        assert counts == {'ok': 2}
+        assert writer.digest(URL, STAMPS[0]) == writer.digest(URL, STAMPS[1])
+    records = sorted((r.timestamp, r.type) for r in iter_records(writer.path) if r.type != 'warcinfo')
+    assert records == [(STAMPS[0], 'revisit'), (STAMPS[1], 'response'), (STAMPS[2], 'response')]
+    with WarcWriter(str(tmp_path / 'warc')) as writer:
+        assert fetch_snapshots(URL, chosen, writer, journal, transport=Loops({URL: captures}), out=None) == \
+            {'ok': 2}
@@ -0,0 +1,89 @@
+import datetime
+
+import pandas as pd
+import pytest
+import pytz
+
+from waybackscan.grid import cron_grid, daily_grid, interval_grid, schedule_grid
+
+NY = pytz.timezone('America/New_York')
+
+
+def utc(*stamps):
+    return pd.DatetimeIndex([pd.Timestamp(s, tz='UTC') for s in stamps])
+
+
+def at(hour, minute=0):
+    return datetime.time(hour, minute, tzinfo=NY)
+
+
+def test_daily_grid_spring_forward():
+    # 2022-03-13 the clocks in New York go from 2:00 EST straight to 3:00 EDT
+    grid = daily_grid(pd.Timestamp('2022-03-12', tz='UTC'), pd.Timestamp('2022-03-15', tz='UTC'), [at(9)])
+    assert grid.equals(utc('2022-03-12 14:00', '2022-03-13 13:00', '2022-03-14 13:00'))
+    # 2:30 doesn't exist that day and moves up to 3:00
+    grid = daily_grid(pd.Timestamp('2022-03-12', tz='UTC'), pd.Timestamp('2022-03-15', tz='UTC'), [at(2, 30)])
+    assert grid.equals(utc('2022-03-12 07:30', '2022-03-13 07:00', '2022-03-14 06:30'))
+
+
+def test_daily_grid_fall_back():
+    # 2022-11-06 1:00-2:00 happens twice, first in EDT then in EST
+    grid = daily_grid(pd.Timestamp('2022-11-05', tz='UTC'), pd.Timestamp('2022-11-08', tz='UTC'),
+                      [at(1, 30), at(9)])
+    assert grid.equals(utc('2022-11-05 05:30', '2022-11-05 13:00', '2022-11-06 05:30', '2022-11-06 14:00',
+                           '2022-11-07 06:30', '2022-11-07 14:00'))
+
+
+def test_daily_grid_mixed_zones_and_weekdays():
+    start, end = pd.Timestamp('2022-03-11', tz='UTC'), pd.Timestamp('2022-03-15', tz='UTC')
+    # Friday, then Monday, the weekend left out
+    grid = daily_grid(start, end, [at(9), datetime.time(14, tzinfo=pytz.UTC)], weekdays=(0, 4))
+    assert grid.equals(utc('2022-03-11 14:00', '2022-03-14 13:00', '2022-03-14 14:00'))
+    assert len(daily_grid(start, end, [])) == 0
+
+
+def test_interval_grid():
+    grid = interval_grid(pd.Timestamp('2022-01-01 03:25', tz='UTC'), pd.Timestamp('2022-01-02', tz='UTC'), hrs=6)
+    assert grid.equals(utc('2022-01-01 03:00', '2022-01-01 09:00', '2022-01-01 15:00', '2022-01-01 21:00'))
+
+
+def brute_force_cron(start, end, minutes, hours, doms, dows):
+    """cron's own rule: with both day fields restricted, either one will do."""
+    out = []
+    for day in pd.date_range(start, end, freq='D'):
+        dom_ok, dow_ok = doms is None or day.day in doms, dows is None or (day.dayofweek + 1) % 7 in dows
+        if (dom_ok or dow_ok) if doms is not None and dows is not None else (dom_ok and dow_ok):
+            out += [day + pd.Timedelta(hours=h, minutes=m) for h in hours for m in minutes]
+    return pd.DatetimeIndex([t for t in out if t <= end])
+
+
+@pytest.mark.parametrize('spec, doms, dows', [
+    ('0 12 13 * 5', {13}, {5}),
+    ('0 12 13 * *', {13}, None),
+    ('0 12 * * fri', None, {5}),
+    ('30 9,17 1-7 * mon', set(range(1, 8)), {1}),
+    ('0 0 */10 * 0', {1, 11, 21, 31}, {0}),
+    ('0 0 * * 7', None, {0}),
+    ('15 6 * * *', None, None),
+])
+def test_cron_day_of_month_or_day_of_week(spec, doms, dows):
+    start, end = pd.Timestamp('2022-01-01', tz='UTC'), pd.Timestamp('2022-12-31', tz='UTC')
+    minute, hour = spec.split()[:2]
+    hours = [int(h) for h in hour.split(',')]
+    expected = brute_force_cron(start, end, [int(minute)], hours, doms, dows)
+    assert cron_grid(start, end, spec, tz='UTC').equals(expected)
+
+
+def test_cron_months_and_bad_specs():
+    grid = cron_grid(pd.Timestamp('2022-01-01', tz='UTC'), pd.Timestamp('2023-01-01', tz='UTC'), '0 0 1 jan,jul *',
+                     tz='UTC')
+    assert grid.equals(utc('2022-01-01', '2022-07-01', '2023-01-01'))
+    for spec in ('0 0 * *', '60 0 * * *', '0 0 * * 0/0', '0 0 * foo *'):
+        with pytest.raises(ValueError):
+            cron_grid(pd.Timestamp('2022-01-01', tz='UTC'), pd.Timestamp('2022-01-02', tz='UTC'), spec, tz='UTC')
+
+
+def test_schedule_grid_rrule_across_dst():
+    grid = schedule_grid(pd.Timestamp('2022-03-12', tz='UTC'), pd.Timestamp('2022-03-15', tz='UTC'),
+                         'FREQ=DAILY;BYHOUR=9;BYMINUTE=0;BYSECOND=0', tz=NY)
+    assert grid.equals(utc('2022-03-12 14:00', '2022-03-13 13:00', '2022-03-14 13:00'))
@@ -0,0 +1,98 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from waybackscan.index import TIME_BITS, CaptureIndex, build_index
+from waybackscan.match import POLICIES
+from waybackscan.replay import synthetic_rows
+from waybackscan.schema import CDX_FIELDS, cdx_frame
+
+URLS = ['www.nytimes.com', 'www.bbc.com', 'www.foxnews.com']
+
+
+def captures():
+    return {url: cdx_frame(synthetic_rows(300, '2015-01-01', '2016-01-01', url, seed=i).tolist(), CDX_FIELDS,
+                           filt=False)
+            for i, url in enumerate(URLS)}
+
+
+def stamp(digits, code='200'):
+    return ['com,example)/', digits, 'https://www.example.com/', 'text/html', code, 'A' * 32, '1000']
+
+
+@pytest.mark.parametrize('direction', ['nearest', 'before', 'after'])
+def test_lookup_matches_policies(tmp_path, direction):
+    data = captures()
+    index = build_index(str(tmp_path / 'index'), data)
+    rng = np.random.default_rng(1)
+    # Some before the first capture and some after the last, so every side runs out somewhere.
+    lo, hi = pd.Timestamp('2014-12-01', tz='UTC').value, pd.Timestamp('2016-02-01', tz='UTC').value
+    times = pd.to_datetime(rng.integers(lo, hi, 400) // 10**9 * 10**9, utc=True)
+    urls = rng.choice(URLS, len(times))
+
+    got = index.lookup(list(urls), times, direction=direction)
+    for url in URLS:
+        frame = data[url]
+        ok = np.flatnonzero(frame['statuscode'].to_numpy() == 200)
+        mine = urls == url
+        want = POLICIES[direction](frame['datetime'].iloc[ok], times[mine])
+        rows = np.where(want['position'] >= 0, ok[want['position'].clip(lower=0)], -1)
+        assert got['row'].to_numpy()[mine].tolist() == rows.tolist()
+        np.testing.assert_array_equal(got['lag_seconds'].to_numpy()[mine], want['lag_seconds'].to_numpy())
+
+
+def test_unknown_url(tmp_path):
+    index = build_index(str(tmp_path / 'index'), captures())
+    times = pd.to_datetime(['2015-06-01', '2015-07-01'], utc=True)
+    for direction in ('nearest', 'before', 'after'):
+        out = index.lookup(['www.cnn.com', 'www.nytimes.com'], times, direction=direction)
+        assert out['row'].iloc[0] == -1 and pd.isna(out['datetime'].iloc[0])
+        assert out['row'].iloc[1] >= 0
+    assert 'www.cnn.com' not in index
+    assert (index.lookup('www.cnn.com', times)['row'] == -1).all()
+
+
+def test_pickles_as_its_path(tmp_path):
+    index = build_index(str(tmp_path / 'index'), captures())
+    assert isinstance(index.keys, np.memmap)
+    blob = pickle.dumps(index)
+    assert len(blob) < 1000
+    back = pickle.loads(blob)
+    assert isinstance(back.keys, np.memmap)
+    times = pd.to_datetime(['2015-03-01', '2015-09-01'], utc=True)
+    pd.testing.assert_frame_equal(back.lookup('www.bbc.com', times), index.lookup('www.bbc.com', times))
+    assert back.captures('www.bbc.com').equals(CaptureIndex(str(tmp_path / 'index')).captures('www.bbc.com'))
+
+
+def test_filt_keeps_rows_lined_up_with_the_cache(tmp_path):
+    rows = [stamp('20200101000000'), stamp('20200102000000', '301'), stamp('20200103000000')]
+    index = build_index(str(tmp_path / 'index'), {'www.example.com': rows})
+    out = index.lookup('www.example.com', pd.to_datetime(['2020-01-02'], utc=True), direction='after')
+    assert out['row'].tolist() == [2]
+    unfiltered = build_index(str(tmp_path / 'all'), {'www.example.com': rows}, filt=False)
+    assert unfiltered.lookup('www.example.com', pd.to_datetime(['2020-01-02'], utc=True))['row'].tolist() == [1]
+
+
+def test_times_at_the_edges_of_the_key(tmp_path):
+    # The last second pandas can hold, well inside 34 bits, right next to another url's first capture.
+    last = pd.Timestamp.max.floor('s').tz_localize('UTC')
+    assert last.value // 10**9 < 1 << TIME_BITS
+    index = build_index(str(tmp_path / 'index'), {
+        'www.example.com': [stamp('19700101000000'), stamp(last.strftime('%Y%m%d%H%M%S'))],
+        'www.other.com': [stamp('19700101000000')],
+    })
+    out = index.lookup('www.example.com', [last, pd.Timestamp('1969-12-31 23:59:59', tz='UTC')], direction='after')
+    assert out['row'].tolist() == [1, 0]
+    assert out['datetime'].iloc[0] == last
+    # Before 1970 there's nothing before, rather than whatever a negative key would have found.
+    out = index.lookup('www.example.com', [pd.Timestamp('1969-06-01', tz='UTC')], direction='before')
+    assert out['row'].tolist() == [-1]
+    out = index.lookup('www.other.com', [last], direction='after')
+    assert out['row'].tolist() == [-1]
+
+
+def test_rejects_times_it_cannot_hold(tmp_path):
+    with pytest.raises(ValueError):
+        build_index(str(tmp_path / 'index'), {'www.example.com': [stamp('19691231235959')]})
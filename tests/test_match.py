@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from waybackscan.match import POLICIES, mark_digest_runs, select_captures, to_epoch_ns
+from waybackscan.replay import synthetic_rows
+from waybackscan.schema import CDX_FIELDS, cdx_frame
+
+
+def brute_force(captures, ref, policy):
+    """The capture time each reference time should get under `policy`, None for none, one at a time."""
+    slots = sorted(set(ref))
+    out = []
+    for r in ref:
+        if policy == 'after':
+            pick = [c for c in captures if c >= r]
+            out.append(min(pick) if pick else None)
+        elif policy == 'before':
+            pick = [c for c in captures if c <= r]
+            out.append(max(pick) if pick else None)
+        elif policy == 'nearest':
+            # a tie goes to the later one
+            out.append(min(captures, key=lambda c: (abs(c - r), -c)) if captures else None)
+        else:
+            i = slots.index(r)
+            if i + 1 < len(slots):
+                end = slots[i + 1]
+            else:
+                end = r + (slots[-1] - slots[-2]) if len(slots) > 1 else float('inf')
+            pick = [c for c in captures if r <= c < end]
+            out.append(max(pick) if pick else None)
+    return out
+
+
+def seconds(values):
+    return pd.to_datetime(np.asarray(values, dtype='int64'), unit='s', utc=True)
+
+
+@pytest.mark.parametrize('policy', list(POLICIES))
+@pytest.mark.parametrize('seed', range(20))
+def test_select_captures_against_brute_force(policy, seed):
+    rng = np.random.default_rng(seed)
+    # unsorted, with repeats and exact hits, and reference times outside the captures on both sides
+    captures = rng.integers(1000, 2000, rng.integers(0, 40))
+    if seed % 3 == 0:
+        captures = np.sort(captures)
+    ref = np.r_[rng.integers(900, 2100, rng.integers(1, 30)), captures[:3]]
+    rng.shuffle(ref)
+    tolerance = [None, 0, 25, 400][seed % 4]
+
+    got = select_captures(pd.Series(seconds(captures)), seconds(ref), policy=policy, tolerance=tolerance)
+    expected = brute_force(captures.tolist(), ref.tolist(), policy)
+    if tolerance is not None:
+        expected = [c if c is not None and abs(c - r) <= tolerance else None for c, r in zip(expected, ref)]
+
+    assert list(got['target']) == list(seconds(ref))
+    for (_, row), want, r in zip(got.iterrows(), expected, ref):
+        if want is None:
+            assert row['position'] == -1 and pd.isna(row['lag_seconds'])
+        else:
+            assert captures[row['position']] == want
+            assert row['datetime'] == seconds([want])[0]
+            assert row['lag_seconds'] == want - r
+
+
+def test_select_captures_takes_a_timedelta():
+    captures = pd.Series(pd.to_datetime(['2020-01-01 00:00', '2020-01-01 12:00'], utc=True))
+    got = select_captures(captures, pd.to_datetime(['2020-01-01 01:00', '2020-01-01 05:00'], utc=True),
+                          policy='nearest', tolerance=pd.Timedelta(hours=2))
+    assert list(got['position']) == [0, -1]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError, match='policy'):
+        select_captures(pd.Series(seconds([1])), seconds([1]), policy='closest')
+
+
+def test_naive_times_are_utc():
+    assert to_epoch_ns([pd.Timestamp('2020-01-01')])[0] == to_epoch_ns([pd.Timestamp('2020-01-01', tz='UTC')])[0]
+
+
+def digest_frame(*rows):
+    """(timestamp, status, digest) triples, in the order given."""
+    return cdx_frame([['com,example)/', ts, 'https://www.example.com/', 'text/html', code, digest, '1000']
+                      for ts, code, digest in rows], CDX_FIELDS, filt=False)
+
+
+def test_digest_runs_across_non_200s():
+    df = mark_digest_runs(digest_frame(
+        ('20200101000000', '200', 'A'),
+        ('20200102000000', '200', 'A'),
+        ('20200103000000', '301', 'R'),
+        ('20200104000000', '200', 'A'),
+        ('20200105000000', '302', '-'),
+        ('20200106000000', '302', '-'),
+        ('20200107000000', '200', 'A'),
+    ))
+    # A redirect in between breaks the run, but the content is still the first A.
+    assert df['digest_run'].tolist() == [0, 0, 1, 2, 3, 4, 5]
+    assert df['content_timestamp'].tolist() == [20200101000000, 20200101000000, 20200103000000, 20200101000000,
+                                                20200105000000, 20200106000000, 20200101000000]
+
+
+def test_digest_runs_follow_time_not_row_order():
+    df = mark_digest_runs(digest_frame(
+        ('20200103000000', '200', 'B'),
+        ('20200101000000', '200', 'A'),
+        ('20200104000000', '404', 'B'),
+        ('20200102000000', '200', 'A'),
+    ))
+    assert df['digest_run'].tolist() == [1, 0, 1, 0]
+    assert df['content_timestamp'].tolist() == [20200103000000, 20200101000000, 20200103000000, 20200101000000]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_digest_runs_against_brute_force(seed):
+    rows = synthetic_rows(300, '2020-01-01', '2020-06-01', seed=seed, run=4).tolist()
+    rng = np.random.default_rng(seed)
+    for row in rows:
+        if row[4] != '200' and rng.random() < 0.5:
+            row[5] = '-'
+    df = mark_digest_runs(cdx_frame(rows, CDX_FIELDS, filt=False))
+
+    runs, content, first, prev = [], [], {}, None
+    for ts, digest in zip(df['timestamp'], df['digest'].astype(str)):
+        same = digest != '-' and digest == prev
+        runs.append(runs[-1] + (not same) if runs else 0)
+        content.append(ts if digest == '-' else first.setdefault(digest, ts))
+        prev = digest
+    assert df['digest_run'].tolist() == runs
+    assert df['content_timestamp'].tolist() == content
@@ -0,0 +1,100 @@
+import os
+import pickle
+
+import pytest
+
+from waybackscan.pack import HEADER, Pack, compact
+from waybackscan.store import content_digest
+
+URL = 'www.example.com'
+
+
+def page(i):
+    return f'<html><body><h1>page {i}</h1>{"<p>filler</p>" * (i % 5 + 1)}</body></html>'
+
+
+def stamp(i):
+    return f'202001{1 + i // 24:02d}{i % 24:02d}0000'
+
+
+@pytest.fixture(params=['none', 'zstd'])
+def compression(request):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+def test_put_get_link(tmp_path, compression):
+    with Pack(str(tmp_path / 'pack'), compression=compression) as pack:
+        digest = pack.put(URL, stamp(0), page(0))
+        assert digest == content_digest(page(0).encode())
+        pack.link(URL, stamp(1), digest)
+        pack.put(URL, stamp(2), page(2))
+        # readable before and after the flush
+        assert pack.get(URL, stamp(1)) == page(0)
+        pack.flush()
+        assert pack.get(URL, stamp(2)) == page(2)
+        with pytest.raises(KeyError):
+            pack.get(URL, stamp(3))
+        with pytest.raises(KeyError):
+            pack.link(URL, stamp(3), 'NOPE')
+    pack = Pack(str(tmp_path / 'pack'))
+    assert pack.timestamps(URL) == [stamp(0), stamp(1), stamp(2)]
+    assert [html for _, _, html in pack.items()] == [page(0), page(0), page(2)]
+    assert pack.stats()['pages'] == 2
+    assert pickle.loads(pickle.dumps(pack)).get(URL, stamp(2)) == page(2)
+    pack.close()
+
+
+def test_recovers_after_a_crash(tmp_path, compression):
+    path = str(tmp_path / 'pack')
+    pack = Pack(path, compression=compression, flush_every=1 << 30)
+    for i in range(10):
+        pack.put(URL, stamp(i), page(i))
+    pack.flush()
+    indexed = os.path.getsize(os.path.join(path, 'data.pack'))
+    # these are only in data.pack, the process "dies" before the index hears about them
+    for i in range(10, 20):
+        pack.put(URL, stamp(i), page(i))
+    pack.link(URL, stamp(20), content_digest(page(3).encode()))
+    pack._file.close()
+    whole = os.path.getsize(os.path.join(path, 'data.pack'))
+    # and a record cut off halfway through
+    with open(os.path.join(path, 'data.pack'), 'ab') as f:
+        f.write(HEADER.pack(b'WBPK', 0, 20200201000000, 1000, b'X' * 32, len(URL)) + URL.encode() + b'half a pa')
+    assert whole > indexed
+
+    pack = Pack(path)
+    assert os.path.getsize(os.path.join(path, 'data.pack')) == whole
+    assert pack.stats()['indexed_bytes'] == whole
+    assert len(pack) == 21
+    assert [pack.get(URL, stamp(i)) for i in range(20)] == [page(i) for i in range(20)]
+    assert pack.get(URL, stamp(20)) == page(3)
+    assert not pack.exists(URL, '20200201000000')
+    # and it carries on appending where the good data ends
+    pack.put(URL, stamp(21), page(21))
+    pack.close()
+    assert Pack(path).get(URL, stamp(21)) == page(21)
+
+
+def test_damaged_pack(tmp_path):
+    path = str(tmp_path / 'pack')
+    Pack(path, compression='none').close()
+    with open(os.path.join(path, 'data.pack'), 'ab') as f:
+        f.write(b'not a pack record at all, not even close' * 4)
+    with pytest.raises(ValueError, match='damaged'):
+        Pack(path)
+
+
+def test_compact(tmp_path, compression):
+    path = str(tmp_path / 'pack')
+    with Pack(path, compression=compression) as pack:
+        for i in range(10):
+            pack.put(URL, stamp(i), page(i % 3))
+        # a re-put capture leaves its old version behind in data.pack
+        pack.put(URL, stamp(0), page(7))
+    before, after = compact(path)
+    assert after < before
+    pack = Pack(path)
+    assert [pack.get(URL, stamp(i)) for i in range(10)] == [page(7)] + [page(i % 3) for i in range(1, 10)]
+    assert pack.stats()['pages'] == 4
@@ -0,0 +1,85 @@
+import pytest
+
+from waybackscan.ratelimit import RateLimiter
+
+HOST = 'web.archive.org'
+
+
+class Clock:
+    """A clock that only moves when told to, or when something sleeps on it."""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def limiter(**kwargs):
+    clock = Clock()
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+def test_throttle_is_multiplicative():
+    rl, _ = limiter(rate=8.0, decrease=0.5, min_rate=0.5)
+    rates = []
+    for _ in range(5):
+        rl.throttle(HOST)
+        rates.append(rl.stats()['rates'][HOST])
+    assert rates == [4.0, 2.0, 1.0, 0.5, 0.5]
+    assert rl.stats()['throttled'] == 5
+
+
+def test_success_is_additive_up_to_the_cap():
+    rl, _ = limiter(rate=1.0, increase=0.5, max_rate=2.5, slow=5.0)
+    rates = []
+    for _ in range(5):
+        rl.success(HOST, 0.1)
+        rates.append(rl.stats()['rates'][HOST])
+    assert rates == pytest.approx([1.5, 2.0, 2.5, 2.5, 2.5])
+
+
+def test_slow_success_does_not_speed_up():
+    rl, _ = limiter(rate=1.0, increase=0.5, slow=5.0)
+    rl.success(HOST, 6.0)
+    assert rl.stats()['rates'][HOST] == 1.0
+
+
+def test_acquire_blocks_once_the_bucket_is_empty():
+    rl, clock = limiter(rate=2.0, burst=3)
+    assert [rl.acquire(HOST) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert clock.slept == []
+    # Empty: the next token is half a second away at 2/s, and acquire sleeps for it.
+    assert rl.acquire(HOST) == pytest.approx(0.5)
+    assert clock.slept == [pytest.approx(0.5)]
+    assert rl.stats()['throttle_wait'] == pytest.approx(0.5)
+
+
+def test_bucket_refills_with_time():
+    rl, clock = limiter(rate=2.0, burst=2)
+    rl.acquire(HOST)
+    rl.acquire(HOST)
+    clock.now += 1.0
+    assert rl.acquire(HOST) == 0.0
+    assert rl.acquire(HOST) == 0.0
+    assert rl.acquire(HOST) > 0
+
+
+def test_hosts_have_their_own_buckets():
+    rl, clock = limiter(rate=1.0, burst=1)
+    assert rl.acquire(HOST) == 0.0
+    assert rl.acquire('archive.org') == 0.0
+    assert clock.slept == []
+
+
+def test_retry_after_holds_everyone_off():
+    rl, clock = limiter(rate=4.0, burst=4, decrease=0.5)
+    rl.throttle(HOST, retry_after=3)
+    # Rate is down to 2/s and the bucket is 6 tokens in debt, so the next request waits out the Retry-After.
+    assert rl.acquire(HOST) == pytest.approx(3.5)
+    assert sum(clock.slept) >= 3
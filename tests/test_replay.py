@@ -0,0 +1,52 @@
+import pytest
+
+from waybackscan.replay import ReplayTransport, record, synthetic_rows
+
+URL = 'www.nytimes.com'
+CDX = 'https://web.archive.org/cdx/search/cdx?output=json&url=' + URL
+QUERIES = [
+    CDX,
+    CDX + '&from=20150301&to=20160101',
+    CDX + '&filter=statuscode:200&collapse=digest',
+    CDX + '&collapse=timestamp:8&fl=timestamp,statuscode,digest',
+    CDX + '&limit=1&closest=20170615120000&sort=closest&from=20170615120000',
+    CDX + '&limit=50&showResumeKey=true',
+    'https://web.archive.org/web/20150302000000id_/https://www.nytimes.com/',
+]
+
+
+def test_record_then_replay_is_byte_identical(tmp_path):
+    source = ReplayTransport({URL: synthetic_rows(500, '2014-01-01', '2019-01-01', URL, seed=5)})
+    path = str(tmp_path / 'nytimes.json')
+    assert record(URL, path, transport=source) == 500
+
+    replay = ReplayTransport().load(URL, path)
+    for query in QUERIES:
+        want, got = source.get(query), replay.get(query)
+        assert got.status_code == want.status_code, query
+        assert got.content == want.content, query
+
+
+def test_resume_key_pages_replay_identically(tmp_path):
+    source = ReplayTransport({URL: synthetic_rows(120, '2014-01-01', '2019-01-01', URL, seed=6)})
+    path = str(tmp_path / 'nytimes.json')
+    record(URL, path, transport=source)
+    replay = ReplayTransport().load(URL, path)
+
+    query, pages = CDX + '&limit=25&showResumeKey=true', 0
+    while True:
+        want, got = source.get(query), replay.get(query)
+        assert got.content == want.content
+        pages += 1
+        rows = want.json()
+        if len(rows) < 2 or rows[-2]:
+            break
+        query = CDX + '&limit=25&showResumeKey=true&resumeKey=' + rows[-1][0]
+    assert pages > 1
+
+
+def test_load_rejects_other_fields(tmp_path):
+    path = tmp_path / 'partial.json'
+    path.write_text('[["timestamp", "original"], ["20200101000000", "https://www.nytimes.com/"]]')
+    with pytest.raises(ValueError):
+        ReplayTransport().load(URL, str(path))
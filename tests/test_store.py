@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+pytest.importorskip('zstandard')
+
+from waybackscan.store import SnapshotStore, content_digest
+
+URL = 'www.example.com'
+WORDS = [''.join(random.Random(i).choices('abcdefghijklmnopqrstuvwxyz', k=2 + i % 8)) for i in range(2000)]
+
+
+def page(i, layout=0):
+    rng = random.Random(i * 7919 + layout)
+    nav = ''.join(f'<li class="nav-{layout}-{j}"><a href="/s/{WORDS[j]}">{WORDS[j]}</a></li>' for j in range(80))
+    stories = ''.join(f'<article class="story-{layout}"><h2>{" ".join(rng.choices(WORDS, k=10))}</h2>'
+                      f'<p>{" ".join(rng.choices(WORDS, k=40))}</p></article>' for _ in range(20))
+    return f'<html><head><style>.layout-{layout}{{}}</style></head><body><nav>{nav}</nav>{stories}</body></html>'
+
+
+def fill(store, n=40, start=0, layout=0):
+    for i in range(start, start + n):
+        store.put(URL, f'2020{1 + i // 28:02d}{1 + i % 28:02d}000000', page(i, layout))
+
+
+def test_put_get_and_dedupe(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    digest = store.put(URL, '20200101000000', page(0))
+    assert digest == content_digest(page(0).encode())
+    assert store.put(URL, '20200102000000', page(0)) == digest
+    assert store.get(URL, '20200102000000') == page(0)
+    assert store.get_blob(digest, raw=True) == page(0).encode()
+    assert (URL, '20200101000000') in store and (URL, '20200103000000') not in store
+    with pytest.raises(KeyError):
+        store.get(URL, '20200103000000')
+    assert store.stats()['blobs'] == 1 and store.stats()['captures'] == 2
+
+
+def test_dictionary_round_trip(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    fill(store)
+    dict_id = store.train_dictionary(URL)
+    assert store.dictionary_for(URL, '20200101000000') == dict_id
+    # pages stored before training keep what they have until recompress
+    before, after = store.recompress(URL)
+    assert after < before
+    fill(store, 20, start=40)
+    store.close()
+
+    store = SnapshotStore(str(tmp_path))
+    assert store.dictionary_for(URL, '20210101000000') == dict_id
+    assert [store.get(URL, ts) for ts in store.timestamps(URL)] == [page(i) for i in range(60)]
+    assert store.recompress(URL) == (0, 0)
+
+
+def test_eras(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    fill(store)
+    fill(store, 40, start=56, layout=1)
+    first = store.train_dictionary(URL, until='20200301000000')
+    second = store.train_dictionary(URL, since='20200301000000')
+    assert store.dictionary_for(URL, '20200101000000') == first
+    assert store.dictionary_for(URL, '20200228000000') == first
+    assert store.dictionary_for(URL, '20200301000000') == second
+    assert store.dictionary_for('www.example.org', '20200101000000') is None
+    store.recompress(URL)
+    assert store.get(URL, '20200301000000') == page(56, 1)
+
+
+def test_retrain_replaces_the_era(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    fill(store, 60)
+    ids = {store.train_dictionary(URL, samples=samples) for samples in (20, 40, 60)}
+    latest = store.train_dictionary(URL, samples=30)
+    assert len(ids | {latest}) > 1
+    assert [row[0] for row in store.dictionaries(URL)] == [latest]
+    store.recompress(URL)
+    store.close()
+
+    store = SnapshotStore(str(tmp_path))
+    assert store.dictionary_for(URL, '20200101000000') == latest
+    assert store.stats()['dictionaries'] == 1
+    assert [store.get(URL, ts) for ts in store.timestamps(URL)] == [page(i) for i in range(60)]
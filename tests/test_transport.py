@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from waybackscan.ratelimit import RateLimiter
+from waybackscan.transport import Transport
+
+
+class Response:
+    def __init__(self, status=200, content=b'hello', headers=None):
+        self.status_code = status
+        self.content = content
+        self.headers = headers or {}
+
+
+class Session:
+    """Stands in for requests.Session: answers from `script` per host and tracks how many are in flight."""
+
+    def __init__(self, script=None, hold=0.0):
+        self.script = script or {}
+        self.hold = hold
+        self.calls = []
+        self.in_flight = {}
+        self.most = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        host = url.split('/')[2]
+        with self._lock:
+            self.calls.append((url, kwargs))
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            self.most[host] = max(self.most.get(host, 0), self.in_flight[host])
+            answers = self.script.get(host)
+            answer = answers.pop(0) if answers else Response()
+        time.sleep(self.hold)
+        with self._lock:
+            self.in_flight[host] -= 1
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    def close(self):
+        pass
+
+
+def transport(session, **kwargs):
+    t = Transport(limiter=RateLimiter(rate=1000, burst=1000, max_rate=1000), **kwargs)
+    t.session = session
+    return t
+
+
+def test_at_most_max_per_host_in_flight():
+    session = Session(hold=0.02)
+    t = transport(session, max_per_host=2)
+    threads = [threading.Thread(target=t.get, args=(f'https://{host}/{i}',))
+               for i in range(8) for host in ('a.org', 'b.org')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # each host gets its own two slots
+    assert session.most == {'a.org': 2, 'b.org': 2}
+    assert t.stats()['requests'] == 16
+
+
+def test_counters_and_timeout():
+    session = Session({'a.org': [Response(content=b'x' * 10), Response(content=b'y' * 5)]})
+    t = transport(session, timeout=(1, 2))
+    t.get('https://a.org/1')
+    t.get('https://a.org/2', stream=True)
+    stats = t.stats()
+    assert (stats['requests'], stats['errors'], stats['bytes']) == (2, 0, 10)
+    assert stats['seconds'] >= 0 and stats['throttled'] == 0
+    assert [kwargs['timeout'] for _, kwargs in session.calls] == [(1, 2), (1, 2)]
+
+
+def test_retries_throttles_and_dropped_connections():
+    session = Session({'a.org': [Response(429, headers={'Retry-After': 'soon'}), requests.exceptions.ConnectionError(),
+                                 Response(503), Response(200, b'ok')]})
+    t = transport(session, retries=3)
+    assert t.get('https://a.org/').content == b'ok'
+    stats = t.stats()
+    assert (stats['requests'], stats['errors'], stats['throttled']) == (4, 3, 3)
+    assert stats['rates']['a.org'] < 1000
+
+
+def test_gives_up_after_retries():
+    session = Session({'a.org': [Response(429)] * 3, 'b.org': [requests.exceptions.Timeout()] * 3})
+    t = transport(session, retries=2)
+    # the last throttled answer is handed back for the caller to deal with
+    assert t.get('https://a.org/').status_code == 429
+    with pytest.raises(requests.exceptions.Timeout):
+        t.get('https://b.org/')
+    # anything else isn't retried at all
+    session.script['c.org'] = [requests.exceptions.InvalidURL(), Response()]
+    with pytest.raises(requests.exceptions.InvalidURL):
+        t.get('https://c.org/')
+    assert t.stats()['errors'] == 7
@@ -0,0 +1,125 @@
+import gzip
+import os
+
+import pytest
+
+from waybackscan.cdx import WaybackCDX
+from waybackscan.warc import (WarcTransport, WarcWriter, index_warc, iter_records, read_cdx, read_record,
+                              sidecar_path, surt, warc_paths)
+
+URL = 'www.example.com'
+
+
+class Response:
+    """What the archive sends back for a snapshot, as far as the writer cares."""
+
+    def __init__(self, timestamp, body, status=200):
+        self.url = f'https://web.archive.org/web/{timestamp}id_/https://{URL}/'
+        self.status_code = status
+        self.reason = 'OK'
+        self.content = body
+        self.headers = {'Content-Type': 'text/html; charset=utf-8', 'Content-Encoding': 'gzip',
+                        'x-archive-orig-server': 'nginx', 'x-archive-orig-content-length': '123'}
+
+
+def write(directory):
+    with WarcWriter(str(directory)) as writer:
+        first = writer.put_response(URL, '20200101000000', Response('20200101000000', b'<html>one</html>'))
+        writer.link_many(URL, [('20200102000000', first)])
+        # same page again without saying so is still a revisit
+        assert writer.put_response(URL, '20200103000000', Response('20200103000000', b'<html>one</html>')) == first
+        writer.put(URL, '20200104000000', '<html>two</html>')
+        return writer.path, first
+
+
+def test_surt():
+    assert surt('https://www.breitbart.com/politics') == 'com,breitbart)/politics'
+    assert surt('www2.Example.com:8080/') == 'com,example)/'
+
+
+def test_write_and_read(tmp_path):
+    path, first = write(tmp_path)
+    assert warc_paths(str(tmp_path)) == [path]
+    records = list(iter_records(path))
+    assert [r.type for r in records] == ['warcinfo', 'response', 'revisit', 'revisit', 'response']
+    assert [r.timestamp for r in records[1:]] == ['20200101000000', '20200102000000', '20200103000000',
+                                                  '20200104000000']
+    response = records[1]
+    assert response.uri == f'https://{URL}/' and response.status == 200
+    assert response.payload == b'<html>one</html>'
+    # the site's own headers, not the archive's or the ones that no longer apply
+    assert ('server', 'nginx') in response.http_headers
+    assert not {name.lower() for name, _ in response.http_headers} & {'content-encoding', 'x-archive-orig-server'}
+    assert records[2].headers['WARC-Payload-Digest'] == f'sha1:{first}'
+    assert records[4].payload == b'<html>two</html>'
+
+    # the sidecar's offsets land on the records
+    cdx = read_cdx(sidecar_path(path))
+    assert [fields[1] for fields in cdx] == ['20200101000000', '20200102000000', '20200103000000', '20200104000000']
+    for fields, record in zip(cdx, records[1:]):
+        assert int(fields[9]) == record.offset
+        assert read_record(path, int(fields[9])).timestamp == fields[1]
+    # and indexing the file again gives the same sidecar
+    assert index_warc(path, str(tmp_path / 'again.cdx')) == 4
+    assert read_cdx(str(tmp_path / 'again.cdx')) == cdx
+
+
+def test_types_skip_payloads(tmp_path):
+    path, _ = write(tmp_path)
+    records = list(iter_records(path, types=('revisit',)))
+    assert [r.payload is None for r in records] == [True, True, False, False, True]
+
+
+def test_uncompressed_warc(tmp_path):
+    path, _ = write(tmp_path / 'gz')
+    plain = str(tmp_path / 'plain.warc')
+    with gzip.open(path) as f, open(plain, 'wb') as out:
+        out.write(f.read())
+    records = list(iter_records(plain))
+    assert [r.type for r in records] == ['warcinfo', 'response', 'revisit', 'revisit', 'response']
+    assert index_warc(plain) == 4
+    for fields in read_cdx(sidecar_path(plain)):
+        assert read_record(plain, int(fields[9])).timestamp == fields[1]
+
+
+def test_cut_short(tmp_path, capsys):
+    path, _ = write(tmp_path)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        f.truncate(size - 20)
+    assert [r.type for r in iter_records(path)] == ['warcinfo', 'response', 'revisit', 'revisit']
+    assert 'part way' in capsys.readouterr().err
+
+
+def test_resume_and_replay(tmp_path):
+    path, first = write(tmp_path)
+    with WarcWriter(str(tmp_path)) as writer:
+        assert writer.digest(URL, '20200102000000') == first
+        # a page from the earlier run gets a revisit, not a second copy
+        writer.put(URL, '20200105000000', '<html>two</html>')
+        writer.link_many(URL, [('20200101000000', first)])
+    assert [r.type for r in iter_records(writer.path)] == ['warcinfo', 'revisit']
+
+    transport = WarcTransport(str(tmp_path))
+    df = WaybackCDX(transport=transport).download_period(URL, None, None)
+    assert list(df['timestamp'].astype(str)) == ['20200101000000', '20200102000000', '20200103000000',
+                                                 '20200104000000', '20200105000000']
+    r = transport.get(f'https://web.archive.org/web/20200105000000id_/https://{URL}/')
+    assert r.content == b'<html>two</html>'
+    assert transport.record(URL, '20200102000000').payload == b'<html>one</html>'
+
+
+def test_one_gzip_member_for_the_whole_file(tmp_path):
+    path, _ = write(tmp_path / 'gz')
+    whole = str(tmp_path / 'whole.warc.gz')
+    with gzip.open(path) as f:
+        data = f.read()
+    with open(whole, 'wb') as out:
+        out.write(gzip.compress(data))
+    records = list(iter_records(whole))
+    assert [r.type for r in records] == ['warcinfo', 'response', 'revisit', 'revisit', 'response']
+    # only the first record starts the member, the rest have nowhere to seek to
+    assert records[0].offset == 0 and [r.offset for r in records[1:]] == [None] * 4
+    with pytest.raises(ValueError, match='gzip member'):
+        index_warc(whole)
+    assert not os.path.exists(sidecar_path(whole))
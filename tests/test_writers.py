@@ -0,0 +1,87 @@
+import json
+
+import pandas as pd
+import pytest
+
+from waybackscan.replay import synthetic_rows
+from waybackscan.schema import CDX_DTYPES, CDX_FIELDS, cdx_frame
+from waybackscan.writers import open_writer
+
+
+def batches():
+    rows = synthetic_rows(120, '2020-01-01', '2021-01-01', seed=3).tolist()
+    # Pages come with their own categories, the writers have to cope with them differing batch to batch.
+    return [cdx_frame(rows[i:i + 40], CDX_FIELDS, filt=False) for i in range(0, len(rows), 40)]
+
+
+def whole(frames):
+    return pd.concat(frames, ignore_index=True)
+
+
+def typed(df):
+    """Text formats don't carry types, cast back the way the rest of the package types CDX columns."""
+    df = df.astype({name: dtype for name, dtype in CDX_DTYPES.items() if name in df and name != 'datetime'})
+    return df.assign(datetime=pd.to_datetime(df['datetime'], utc=True).astype('datetime64[ns, UTC]'))
+
+
+def check(back, frames):
+    assert back['timestamp'].dtype == 'int64'
+    assert back['statuscode'].dtype == 'uint16'
+    assert back['length'].dtype == 'int64'
+    assert isinstance(back['digest'].dtype, pd.CategoricalDtype)
+    assert isinstance(back['mimetype'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(back, whole(frames), check_categorical=False, check_dtype=False)
+    assert back['datetime'].tolist() == whole(frames)['datetime'].tolist()
+
+
+def write(fmt, path, frames):
+    with open_writer(fmt, str(path)) as writer:
+        for df in frames:
+            writer.write(df)
+    assert writer.rows == sum(map(len, frames))
+
+
+def test_tsv_round_trip(tmp_path):
+    frames = batches()
+    write('tsv', tmp_path / 'out.tsv', frames)
+    back = pd.read_csv(tmp_path / 'out.tsv', sep='\t', dtype=str, keep_default_na=False)
+    assert list(back.columns) == list(frames[0].columns)
+    # The header only goes out once, however many batches there were.
+    assert len(back) == sum(map(len, frames))
+    check(typed(back), frames)
+
+
+def test_jsonl_round_trip(tmp_path):
+    frames = batches()
+    write('jsonl', tmp_path / 'out.jsonl', frames)
+    with open(tmp_path / 'out.jsonl') as f:
+        records = [json.loads(line) for line in f]
+    # Numbers stay numbers, a wayback timestamp doesn't come back as a float or a string.
+    assert all(isinstance(r['timestamp'], int) and isinstance(r['statuscode'], int) for r in records)
+    check(typed(pd.DataFrame.from_records(records)), frames)
+
+
+def test_arrow_round_trip(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    frames = batches()
+    write('arrow', tmp_path / 'out.arrow', frames)
+    with pa.ipc.open_stream(str(tmp_path / 'out.arrow')) as reader:
+        back = reader.read_all().to_pandas()
+    assert back['datetime'].dtype == 'datetime64[ns, UTC]'
+    check(back, frames)
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip('pyarrow')
+    frames = batches()
+    write('parquet', tmp_path / 'out.parquet', frames)
+    back = pd.read_parquet(tmp_path / 'out.parquet')
+    check(back, frames)
+
+
+@pytest.mark.parametrize('fmt', ['tsv', 'jsonl', 'arrow', 'parquet'])
+def test_empty_output(tmp_path, fmt):
+    if fmt in ('arrow', 'parquet'):
+        pytest.importorskip('pyarrow')
+    write(fmt, tmp_path / f'out.{fmt}', [cdx_frame([], CDX_FIELDS)])
@@ -0,0 +1,103 @@
+"""Run a whole file of scans (one per publisher/url) in one process, sharing the cache and the connection pool."""
+import csv
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    tomllib = None
+
+JOB_FIELDS = ('name', 'publisher', 'url', 'start', 'end', 'interval', 'at', 'cron', 'weekdays', 'policy', 'tolerance',
+              'output', 'format')
+
+
+def _load_toml(path):
+    global tomllib
+    if tomllib is None:
+        try:
+            import tomli as tomllib
+        except ImportError as e:
+            raise ImportError('toml job files need python 3.11+ or `pip install waybackscan[toml]`') from e
+    with open(path, 'rb') as f:
+        data = tomllib.load(f)
+    defaults = data.get('defaults', {})
+    return [{**defaults, **job} for job in data.get('job', [])]
+
+
+def _load_tsv(path):
+    with open(path, newline='') as f:
+        lines = (line for line in f if line.strip() and not line.startswith('#'))
+        jobs = []
+        for row in csv.DictReader(lines, delimiter='\t'):
+            job = {k.strip(): v.strip() for k, v in row.items() if k and v and v.strip()}
+            if 'at' in job:
+                job['at'] = [t.strip() for t in job['at'].split(';') if t.strip()]
+            jobs.append(job)
+    return jobs
+
+
+def load_jobs(path):
+    """
+    Raw job dicts from a .toml (`[defaults]` plus `[[job]]` tables) or a .tsv (header row, `at` times split
+    on `;`). Keys should be in JOB_FIELDS, values are left as the strings/numbers found in the file; a job that
+    doesn't make sense is still returned, see `check_job`.
+    """
+    return _load_toml(path) if path.endswith('.toml') else _load_tsv(path)
+
+
+def check_job(job):
+    """ValueError if a raw job has fields we don't know or nothing to scan."""
+    unknown = set(job) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError(f'unknown fields {", ".join(sorted(unknown))}')
+    if not job.get('publisher') and not job.get('url'):
+        raise ValueError('needs a publisher or a url')
+
+
+def failed_job(name, url, error):
+    """The summary of a job that never got to run."""
+    return {'job': name, 'url': url or '', 'rows': 0, 'seconds': 0.0, 'status': 'failed', 'error': error,
+            'output': ''}
+
+
+def _run_one(cdxer, job, writer_factory):
+    start = time.perf_counter()
+    result = {'job': job['name'], 'url': job['url'], 'rows': 0, 'seconds': 0.0, 'status': 'ok', 'error': '',
+              'output': job['output']}
+    try:
+        if job['output'] not in (None, '-') and os.path.dirname(job['output']):
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        with writer_factory(job['format'], job['output']) as writer:
+            output = getattr(cdxer, job['method'])(job['url'], period_start=job['start'], period_end=job['end'],
+                                                   filt=job.get('filt', True), **job['kwargs'])
+            if 'is_target' in output:
+                output = output[output['is_target']]
+            writer.write(output)
+            result['rows'] = writer.rows
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_jobs(cdxer, jobs, max_jobs=4, writer_factory=None, on_done=None):
+    """
+    Run resolved jobs (dicts with name, url, start, end, method, kwargs, output, format) on a thread pool
+    of `max_jobs`, all through the one `cdxer` so they share its cache and transport. A job that blows up
+    only fails itself. Returns one summary dict per job, in the order given; `on_done` gets each as it finishes.
+    """
+    if writer_factory is None:
+        from .writers import open_writer as writer_factory
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+        futures = {pool.submit(_run_one, cdxer, job, writer_factory): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_done is not None:
+                on_done(results[futures[future]])
+    return results
@@ -0,0 +1,150 @@
+"""On-disk CDX store so we don't download the same capture history over and over."""
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from .schema import CDX_FIELDS
+
+
+def default_cache_path():
+    root = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(root, 'waybackscan', 'cdx.sqlite')
+
+
+class CDXCache:
+    """
+    SQLite-backed store of raw CDX rows, keyed by the url they were queried with.
+
+    For every url we remember which window of timestamps we have already asked the server about
+    (`lo` to `hi`, wayback format), old captures don't change so anything inside that window can be
+    served locally. `ttl` is how many seconds an open-ended window counts as up to date before we go
+    back to the server for newer captures, None means always check. `max_bytes` caps the size of the
+    database, least recently used urls get evicted first.
+    """
+
+    def __init__(self, path=None, ttl=None, max_bytes=None):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # Reads straight out of the page cache instead of copying every page through sqlite's own buffers.
+            self._conn.execute(f'PRAGMA mmap_size={2**30}')
+            self._conn.execute(f'''CREATE TABLE IF NOT EXISTS captures (
+                url TEXT NOT NULL, {", ".join(f + " TEXT" for f in CDX_FIELDS)},
+                PRIMARY KEY (url, timestamp, original, digest, statuscode)) WITHOUT ROWID''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS coverage (
+                url TEXT PRIMARY KEY, lo TEXT, hi TEXT, fetched_at REAL, last_used REAL)''')
+
+    def coverage(self, url):
+        """(lo, hi, fetched_at) for a url, or None if we've never seen it."""
+        with self._lock:
+            return self._conn.execute('SELECT lo, hi, fetched_at FROM coverage WHERE url = ?', (url,)).fetchone()
+
+    def urls(self):
+        with self._lock:
+            return [url for url, in self._conn.execute('SELECT url FROM coverage ORDER BY url')]
+
+    def is_fresh(self, url):
+        cov = self.coverage(url)
+        return cov is not None and self.ttl is not None and time.time() - cov[2] < self.ttl
+
+    def newest(self, url):
+        with self._lock:
+            return self._conn.execute('SELECT MAX(timestamp) FROM captures WHERE url = ?', (url,)).fetchone()[0]
+
+    def read(self, url, start=None, end=None):
+        """Cached rows for url with start <= timestamp <= end, in timestamp order."""
+        query = f'SELECT {", ".join(CDX_FIELDS)} FROM captures WHERE url = ?'
+        params = [url]
+        if start:
+            query += ' AND timestamp >= ?'
+            params.append(start)
+        if end:
+            query += ' AND timestamp <= ?'
+            params.append(end)
+        query += ' ORDER BY timestamp'
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            with self._conn:
+                self._conn.execute('UPDATE coverage SET last_used = ? WHERE url = ?', (time.time(), url))
+        return rows
+
+    def read_timestamps(self, url, start=None, end=None, statuscode=None):
+        """
+        Just the timestamps out of `read`, as an int64 array, optionally only for one status code.
+        A lot quicker than `read` for big urls.
+        """
+        query = 'SELECT timestamp FROM captures WHERE url = ?'
+        params = [url]
+        for clause, value in (('timestamp >= ?', start), ('timestamp <= ?', end), ('statuscode = ?', statuscode)):
+            if value:
+                query += f' AND {clause}'
+                params.append(str(value))
+        query += ' ORDER BY timestamp'
+        with self._lock:
+            # One long string rather than a python object per row, that's most of the time otherwise.
+            joined = self._conn.execute(f"SELECT group_concat(timestamp, '') FROM ({query})", params).fetchone()[0]
+            if joined and len(joined) % 14:
+                # Somebody stored truncated timestamps, do it the slow way.
+                return np.array([int(ts.ljust(14, '0')) for ts, in self._conn.execute(query, params)], dtype='int64')
+        digits = np.frombuffer((joined or '').encode(), dtype='uint8').reshape(-1, 14) - ord('0')
+        return digits.astype('int64') @ 10 ** np.arange(13, -1, -1, dtype='int64')
+
+    def write(self, url, rows, lo, hi, fetched=True):
+        """Store raw CDX rows for url and widen its covered window to include lo..hi."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f'INSERT OR IGNORE INTO captures VALUES (?, {", ".join("?" * len(CDX_FIELDS))})',
+                ((url, *row) for row in rows))
+            cov = self._conn.execute('SELECT lo, hi, fetched_at FROM coverage WHERE url = ?', (url,)).fetchone()
+            if cov is not None:
+                lo = min(lo, cov[0])
+                hi = max(hi, cov[1])
+                if not fetched:
+                    now = cov[2]
+            self._conn.execute('INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?, ?)', (url, lo, hi, now, now))
+        self.evict()
+
+    def size(self):
+        with self._lock:
+            page_size = self._conn.execute('PRAGMA page_size').fetchone()[0]
+            pages = self._conn.execute('PRAGMA page_count').fetchone()[0]
+            free = self._conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (pages - free) * page_size
+
+    def evict(self):
+        if self.max_bytes is None or self.size() <= self.max_bytes:
+            return
+        with self._lock:
+            urls = [u for u, in self._conn.execute('SELECT url FROM coverage ORDER BY last_used')]
+        for url in urls:
+            # Always keep the url we touched last, otherwise a single huge url can never be cached.
+            if url == urls[-1] or self.size() <= self.max_bytes:
+                break
+            self.clear(url, vacuum=False)
+        with self._lock:
+            self._conn.execute('VACUUM')
+
+    def clear(self, url=None, vacuum=True):
+        with self._lock:
+            with self._conn:
+                if url is None:
+                    self._conn.execute('DELETE FROM captures')
+                    self._conn.execute('DELETE FROM coverage')
+                else:
+                    self._conn.execute('DELETE FROM captures WHERE url = ?', (url,))
+                    self._conn.execute('DELETE FROM coverage WHERE url = ?', (url,))
+            if vacuum:
+                self._conn.execute('VACUUM')
+
+    def close(self):
+        self._conn.close()
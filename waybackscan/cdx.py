@@ -1,132 +1,537 @@
+import numpy as np
 import pandas as pd
 import json
 import requests
 import datetime
+import sys
 import time
-from .utils import intervals, ref_times
-from pytz import  UTC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urlparse
+from .grid import daily_grid, interval_grid, schedule_grid
+from .match import (mark_targets, mark_digest_runs, match_at_or_after, match_nearest, target_captures,
+                    to_epoch_ns)
+from .cache import CDXCache
+from .coverage import Coverage, capture_counts, capture_gaps
+from .transport import Transport, default_transport
+from .schema import cdx_frame, parse_datetimes, CDX_FIELDS, WAYBACK_FORMAT
 from tzlocal import get_localzone
 
-WAYBACK_FORMAT = '%Y%m%d%H%M%S'
+DEFAULT_PAGE_SIZE = 50000
+UTC = datetime.timezone.utc
 HERE = get_localzone()
 
 
+def _stamp(d):
+    if isinstance(d, str):
+        return d
+    if d.tzinfo is not None:
+        # The archive's timestamps are all UTC
+        d = d.astimezone(UTC)
+    return d.strftime(WAYBACK_FORMAT)
+
+
+def collapse_digits(reference_times):
+    """
+    How many timestamp digits the CDX server can collapse on without losing any first-capture-after-target.
+
+    If every target sits on a bucket boundary (a whole day, hour or minute in UTC), the first capture at or
+    after a target is always the first capture of some bucket, which is exactly what collapse keeps.
+    """
+    ref = to_epoch_ns(reference_times)
+    for digits, width in ((8, 86400), (10, 3600), (12, 60)):
+        if len(ref) and not np.any(ref % (width * 10**9)):
+            return digits
+    return 14
+
+
+def shard_windows(start, end, shards='month'):
+    """Split the wayback stamps start..end into non-overlapping (from, to) stamps on month or year boundaries."""
+    lo, hi = (pd.Timestamp(t) for t in parse_datetimes([start, end]).tz_localize(None))
+    freq = {'month': 'MS', 'year': 'YS'}[shards]
+    cuts = [lo] + [edge for edge in pd.date_range(lo.normalize(), hi, freq=freq) if lo < edge <= hi]
+    ends = [cut - pd.Timedelta(seconds=1) for cut in cuts[1:]] + [hi]
+    return [(a.strftime(WAYBACK_FORMAT), b.strftime(WAYBACK_FORMAT)) for a, b in zip(cuts, ends)]
+
+
 class WaybackCDX:
-    def __init__(self):
+    def __init__(self, cache: CDXCache = None, max_workers=8, transport: Transport = None):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.transport = transport if transport is not None else default_transport()
         self.cdx_format = \
             'https://web.archive.org/cdx/search/cdx?url=$URL&output=json&from=$START&to=$END'
         self.closest_format = \
             'https://web.archive.org/cdx/search/cdx?url=$URL&limit=1&closest=$TIME&sort=closest&output=json&from=$TIME'
 
-    def download_all(self, url, filt=True):
-        raw_json = requests.get(
-            self.cdx_format.replace('$URL', url).replace('&from=$START&to=$END', ''))
-        listy_data = json.loads(raw_json.text)
-        first_line = listy_data.pop(0)
-        df = pd.DataFrame.from_records(listy_data,
-                                       columns=first_line)
-        df['datetime'] = df['timestamp'].apply(lambda s: datetime.datetime.strptime(s, WAYBACK_FORMAT).replace(tzinfo=UTC))
-        if filt:
-            df = df[df['statuscode'] == '200']
-        return df
+    def _get(self, url, **kwargs):
+        return self.transport.get(url, **kwargs)
 
-    def download_period(self, url, period_start: datetime.datetime, period_end: datetime.datetime, filt=True):
+    def _backoff(self):
+        """Slow down before trying again after a garbled or dropped response, which the transport can't see."""
+        limiter = getattr(self.transport, 'limiter', None)
+        if limiter is not None:
+            # a second's debt as well as the slower rate, or a full bucket would let the retry straight through
+            limiter.throttle(urlparse(self.cdx_format).netloc, retry_after=1)
+
+    def _period_url(self, url, period_start=None, period_end=None, params=None):
         cdx_req = self.cdx_format.replace('$URL', url)
+        for key, value in (params or {}).items():
+            cdx_req += f'&{key}=' + quote(str(value), safe=':,')
         if period_end is not None:
-            period_end_wbc = period_end.strftime(WAYBACK_FORMAT)
+            period_end_wbc = _stamp(period_end)
             cdx_req = cdx_req.replace('$END', period_end_wbc)
         else:
             cdx_req = cdx_req.replace('&to=$END', '')
         if period_start is not None:
-            period_start_wbc = period_start.strftime(WAYBACK_FORMAT)
+            period_start_wbc = _stamp(period_start)
             cdx_req = cdx_req.replace('$START', period_start_wbc)
         else:
             cdx_req = cdx_req.replace('&from=$START', '')
-        raw_json = requests.get(cdx_req)
+        return cdx_req
+
+    def download_all(self, url, filt=True, page_size=None, resume_key=None, use_cache=True, shards=None):
+        return self.download_period(url, None, None, filt=filt, page_size=page_size, resume_key=resume_key,
+                                    use_cache=use_cache, shards=shards)
+
+    def download_period(self, url, period_start: datetime.datetime, period_end: datetime.datetime, filt=True,
+                        page_size=None, resume_key=None, use_cache=True, shards=None, digests=False):
+        """
+        All the captures of url between period_start and period_end (either can be None for open-ended).
+
+        `shards` ('month' or 'year') splits the window up and downloads the pieces in parallel, a piece that
+        fails is retried on its own. `digests` marks captures with unchanged content, see `mark_digest_runs`.
+        """
+        if self.cache is not None and use_cache and resume_key is None:
+            df = self._cached_period(url, period_start, period_end, filt=filt, page_size=page_size, shards=shards)
+        else:
+            columns, rows = self._records(url, period_start, period_end, page_size=page_size,
+                                          resume_key=resume_key, shards=shards)
+            df = cdx_frame(rows, columns, filt=filt)
+        return mark_digest_runs(df) if digests else df
+
+    def _records(self, url, period_start, period_end, page_size=None, resume_key=None, params=None, shards=None):
+        """Raw (columns, rows) straight from the CDX server."""
+        if shards and not resume_key:
+            return self._sharded_records(url, period_start, period_end, shards, page_size=page_size, params=params)
+        if page_size or resume_key:
+            columns, rows = CDX_FIELDS, []
+            for columns, page, _ in self._iter_records(url, period_start, period_end,
+                                                       page_size=page_size or DEFAULT_PAGE_SIZE,
+                                                       resume_key=resume_key, params=params):
+                rows.extend(page)
+            return columns, rows
+        raw_json = self._get(self._period_url(url, period_start, period_end, params=params))
         listy_data = json.loads(raw_json.text)
+        if not listy_data:
+            return CDX_FIELDS, []
         first_line = listy_data.pop(0)
-        df = pd.DataFrame.from_records(listy_data, columns=first_line)
-        df['datetime'] = df['timestamp'].apply(lambda s: datetime.datetime.strptime(s, WAYBACK_FORMAT).replace(tzinfo=UTC))
-        if filt:
-            df = df[df['statuscode'] == '200']
-        return df
+        return first_line, listy_data
 
-    def get_closest(self, url, target: datetime.datetime, retries=0, max_retries=30):
-        # https://github.com/internetarchive/wayback/issues/237#issuecomment-1042577291
-        cdx_req = self.closest_format.replace('$URL', url)
-        cdx_req = cdx_req.replace("$TIME", target.strftime(WAYBACK_FORMAT))
-        try:
-            raw_json = requests.get(cdx_req)
-        except requests.exceptions.ConnectionError as e:
-            if retries >= max_retries:
-                raise e
-            else:
-                time.sleep(5)
-                return self.get_closest(url, target, retries=retries+1)
-        try:
-            listy_data = json.loads(raw_json.text)
-        except json.decoder.JSONDecodeError as e:
-            if retries >= max_retries:
-                raise e
-            else:
-                time.sleep(5)
-                return self.get_closest(url, target, retries=retries+1)
-        first_line = listy_data.pop(0)
-        df = pd.DataFrame.from_records(listy_data, columns=first_line)
-        df['datetime'] = df['timestamp'].apply(lambda s: datetime.datetime.strptime(s, WAYBACK_FORMAT))
-        return df.iloc[0]
-   
-   # def nearest_without_being_before(df: pd.DataFrame, dates: list[datetime.datetime], tol=1):
-       # delta = datetime.timedelta(hrs=tol)
-       # end = [d + delta for d in dates]
+    def _sharded_records(self, url, period_start, period_end, shards, page_size=None, params=None, retries=4):
+        if period_start is None or period_start == '':
+            first, _ = self._bounds(url, filt=False)
+            if first is None:
+                return CDX_FIELDS, []
+            period_start = first
+        if period_end is None:
+            period_end = datetime.datetime.now(UTC)
 
+        def fetch(window):
+            for attempt in range(retries + 1):
+                try:
+                    return self._records(url, *window, page_size=page_size, params=params)
+                except (requests.exceptions.RequestException, json.decoder.JSONDecodeError):
+                    if attempt == retries:
+                        raise
+                    self._backoff()
 
+        windows = shard_windows(_stamp(period_start), _stamp(period_end), shards)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(fetch, windows))
+        columns = next((cols for cols, rows in results if rows), results[0][0])
+        if 'timestamp' not in columns:
+            return columns, [row for _, rows in results for row in rows]
+        # The windows don't overlap and come back in order, so all there is to drop is a row the server gave
+        # to a window it's not in. Rows repeated inside a window stay, same as they would unsharded.
+        ts = columns.index('timestamp')
+        return columns, [row for (lo, hi), (_, rows) in zip(windows, results) for row in rows
+                         if lo <= row[ts].ljust(14, '0') <= hi]
 
+    def download_many(self, urls, period_start=None, period_end=None, filt=True, long=False, errors='warn',
+                      method='download_period', **kwargs):
+        """
+        Run `method` (download_period, get_intervals, get_at_time or get_schedule) for several urls at once on
+        a thread pool.
 
-    def get_intervals(self, url, hrs=1, period_start=None, period_end=None, filt=True):
-        if period_start and period_end:
-            df = self.download_period(url, period_start, period_end, filt=filt)
-        else:
-            df = self.download_all(url, filt=filt)
-        reference_times = intervals(period_start, period_end, hrs=hrs)
-        storage_collection = df['datetime'].copy(deep=True).sort_values()
-        # Trying to find a higher performing method
-        target_times = set()
-        for time in list(reference_times):
-            storage_collection = storage_collection[storage_collection >= time]
+        Returns {url: frame}, or with `long` one frame with a `url` column. A url that fails doesn't take the
+        others down with it: with errors='warn' it's reported on stderr and left out, with errors='raise' the
+        first failure is raised once everything else has finished.
+        """
+        fetch = getattr(self, method)
+        frames, failures = {}, {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(fetch, url, period_start=period_start, period_end=period_end, filt=filt,
+                                   **kwargs): url for url in dict.fromkeys(urls)}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    frames[url] = future.result()
+                except Exception as e:
+                    failures[url] = e
+                    if errors == 'warn':
+                        print(f'Failed to get CDX data for {url}: {e!r}', file=sys.stderr)
+        if failures and errors == 'raise':
+            raise next(iter(failures.values()))
+        # as_completed scrambles the order, put it back
+        frames = {url: frames[url] for url in dict.fromkeys(urls) if url in frames}
+        if long:
+            if not frames:
+                return cdx_frame([], CDX_FIELDS).assign(url=pd.Series(dtype=object))
+            return pd.concat([df.assign(url=url) for url, df in frames.items()], ignore_index=True)
+        return frames
+
+    def _cache_gaps(self, url, start, end):
+        """The (from, to, lo, hi, fetched) requests needed before the cache can answer start..end."""
+        now = datetime.datetime.now(UTC).strftime(WAYBACK_FORMAT)
+        hi_wanted = min(end, now) if end else now
+        coverage = self.cache.coverage(url)
+        if coverage is None:
+            return [(start, end, start, hi_wanted, True)]
+        gaps = []
+        lo, hi, _ = coverage
+        if start < lo:
+            gaps.append((start, lo, start, hi, False))
+        if hi_wanted > hi and not (hi_wanted == now and self.cache.is_fresh(url)):
+            newest = self.cache.newest(url) or hi
+            gaps.append((min(newest, hi), end, lo, hi_wanted, True))
+        return gaps
+
+    def _cached_period(self, url, period_start, period_end, filt=True, page_size=None, shards=None):
+        # Anything inside the window we've already asked about is served from the cache, we only go to the
+        # server for the parts of [period_start, period_end] that stick out of it.
+        start, end = self._fill_cache(url, period_start, period_end, page_size=page_size, shards=shards)
+        return cdx_frame(self.cache.read(url, start, end), CDX_FIELDS, filt=filt)
+
+    def _fill_cache(self, url, period_start, period_end, page_size=None, shards=None):
+        start = _stamp(period_start) if period_start is not None else ''
+        end = _stamp(period_end) if period_end is not None else None
+        for fetch_from, fetch_to, lo, hi, fetched in self._cache_gaps(url, start, end):
+            self.cache.write(url, self._fetch_raw(url, fetch_from, fetch_to, page_size, shards=shards), lo, hi,
+                             fetched=fetched)
+        return start, end
+
+    def _fetch_raw(self, url, start, end, page_size=None, shards=None):
+        _, rows = self._records(url, start or None, end, page_size=page_size, shards=shards)
+        return rows
+
+    def iter_pages(self, url, period_start=None, period_end=None, filt=True, page_size=DEFAULT_PAGE_SIZE,
+                   resume_key=None):
+        """
+        Stream the CDX records for a url `page_size` rows at a time, using the CDX server's resume keys.
+
+        Yields `(frame, resume_key)` pairs, where `resume_key` is what you pass back in as `resume_key` to
+        pick the download up after that page if it gets interrupted. It is None on the last page.
+        """
+        for columns, rows, resume_key in self._iter_records(url, period_start, period_end, page_size=page_size,
+                                                            resume_key=resume_key):
+            yield cdx_frame(rows, columns, filt=filt), resume_key
+
+    def _iter_records(self, url, period_start=None, period_end=None, page_size=DEFAULT_PAGE_SIZE, resume_key=None,
+                      params=None):
+        base_req = self._period_url(url, period_start, period_end, params) + f'&limit={page_size}&showResumeKey=true'
+        columns = None
+        while True:
+            cdx_req = base_req
+            if resume_key:
+                cdx_req += '&resumeKey=' + quote(resume_key, safe='')
+            with self._get(cdx_req) as raw_json:
+                raw_json.raise_for_status()
+                listy_data = json.loads(raw_json.content) if raw_json.content.strip() else []
+            if not listy_data:
+                return
+            if columns is None or listy_data[0] == columns:
+                columns = listy_data.pop(0)
+            # With showResumeKey the server tacks an empty row and then [resume_key] onto the end.
+            if len(listy_data) >= 2 and listy_data[-2] == []:
+                resume_key = listy_data[-1][0]
+                listy_data = listy_data[:-2]
+            else:
+                resume_key = None
+            yield columns, listy_data, resume_key
+            if resume_key is None:
+                return
+
+    def follow(self, url, since=None, every=3600, filt=True, polls=None):
+        """
+        Poll for captures of url newer than anything seen so far, yielding a frame of them whenever there are
+        some. Each poll is one request for `from=<newest seen + 1s>`, so it stays small however long it runs.
+
+        `since` is where to start (datetime or wayback stamp), by default the newest capture in the cache or
+        on the server, so only captures made from now on come out. `every` is the seconds (or timedelta)
+        between polls and `polls` stops it after that many, None keeps going. A poll that fails is reported
+        on stderr and tried again next time round. With a cache the new rows get added to it as well.
+        """
+        every = every.total_seconds() if isinstance(every, datetime.timedelta) else every
+        # Pin the starting point now rather than on the first next(), which could be a while later.
+        return self._follow(url, self._follow_start(url, since, filt), every, filt, polls)
+
+    def _follow(self, url, newest, every, filt, polls):
+        next_poll = time.monotonic()
+        done = 0
+        while polls is None or done < polls:
+            time.sleep(max(0.0, next_poll - time.monotonic()))
+            next_poll += every
+            done += 1
             try:
-                target_times.add(storage_collection.iloc[0])
-            except IndexError:
-                pass
-        new_df = df.copy(deep=True)
-                
-        new_df['is_target'] = df['datetime'].isin(target_times)
-        new_df = new_df.drop_duplicates(subset='timestamp', keep='first')
-        return new_df
-
-    def get_at_time(self, url, at=(datetime.time(hour=9, tzinfo=HERE)), period_start=None, period_end=None, filt=True):
-        if period_start or period_end:
-            df = self.download_period(url, period_start, period_end, filt=filt)
+                rows, newest = self._poll(url, newest, filt)
+            except (requests.exceptions.RequestException, json.decoder.JSONDecodeError) as e:
+                print(f'Polling {url} failed, trying again next time: {e!r}', file=sys.stderr)
+                continue
+            if rows:
+                df = cdx_frame(rows, CDX_FIELDS, filt=filt)
+                if len(df):
+                    yield df
+
+    def watch(self, url, callback, **kwargs):
+        """`follow` with every new frame handed to `callback` instead of yielded."""
+        for df in self.follow(url, **kwargs):
+            callback(df)
+
+    def _follow_start(self, url, since, filt):
+        if since is not None:
+            return _stamp(since)
+        if self.cache is not None and self.cache.newest(url):
+            return self.cache.newest(url)
+        _, last = self._bounds(url, filt=filt)
+        return _stamp(last) if last is not None else datetime.datetime.now(UTC).strftime(WAYBACK_FORMAT)
+
+    def _poll(self, url, newest, filt):
+        """Raw rows after the stamp `newest`, and the new newest."""
+        start = (parse_datetimes([newest])[0] + pd.Timedelta(seconds=1)).strftime(WAYBACK_FORMAT)
+        now = datetime.datetime.now(UTC).strftime(WAYBACK_FORMAT)
+        coverage = self.cache.coverage(url) if self.cache is not None else None
+        # The cache only keeps whole histories, so ask for the non-200s too if the rows are going in there.
+        keep = coverage is not None and coverage[1] >= newest
+        params = {'filter': 'statuscode:200'} if filt and not keep else {}
+        columns, rows = self._records(url, start, None, params=params)
+        if list(columns) != list(CDX_FIELDS):
+            rows = [[row[columns.index(f)] for f in CDX_FIELDS] for row in rows]
+        rows = [row for row in rows if row[1] >= start]
+        if keep:
+            self.cache.write(url, rows, start, max([now, *(row[1] for row in rows)]))
+        return rows, max([newest, *(row[1] for row in rows)])
+
+    def coverage(self, url, resolution='day', period_start=None, period_end=None, filt=True,
+                 min_gap=datetime.timedelta(days=1)) -> Coverage:
+        """
+        How densely url was captured: `counts` has the captures in every hour/day/week/month/year (UTC)
+        bin, empty ones included, and `gaps` every stretch longer than `min_gap` without one, longest first.
+
+        Only the timestamps get downloaded (or read out of the cache), so it's quick even for big histories.
+        """
+        if self.cache is not None:
+            start, end = self._fill_cache(url, period_start, period_end)
+            stamps = self.cache.read_timestamps(url, start, end, statuscode='200' if filt else None)
         else:
-            df = self.download_all(url, filt=filt)
-        if not period_start:
-            period_start = df.datetime.min()
-        if not period_end:
-            period_end = df.datetime.max()
-        reference_times = ref_times(period_start, period_end, at)
-        storage_collection = df['datetime'].copy(deep=True).sort_values()
-        target_times = set()
-        for time in list(reference_times):
-            storage_collection = storage_collection[storage_collection >= time]
+            params = {'fl': 'timestamp', **({'filter': 'statuscode:200'} if filt else {})}
+            _, rows = self._records(url, period_start, period_end, params=params)
+            stamps = [row[0] for row in rows]
+        times = parse_datetimes(stamps)
+        return Coverage(capture_counts(times, resolution, period_start, period_end),
+                        capture_gaps(times, min_gap, period_start, period_end))
+
+    def get_closest(self, url, target: datetime.datetime, max_retries=30):
+        """The first capture at or after target."""
+        return self.get_closest_many(url, [target], direction='after', max_retries=max_retries).iloc[0]
+
+    def get_closest_many(self, url, targets, direction='nearest', window=datetime.timedelta(days=1),
+                         max_gap=datetime.timedelta(days=7), filt=False, max_retries=30):
+        """
+        The capture closest to each of `targets` ('nearest' either side, or 'after' for at-or-after).
+
+        Targets within `max_gap` of each other share one range query padded by `window`, and get matched
+        locally. Only a target with nothing inside its window falls back to its own closest query.
+        Returns one row per target: the target, the matched capture and lag_seconds (capture - target).
+        """
+        ref = to_epoch_ns(targets)
+        if not len(ref):
+            return cdx_frame([], CDX_FIELDS, filt=False).assign(target=pd.Series(dtype='datetime64[ns, UTC]'),
+                                                               lag_seconds=pd.Series(dtype=float))
+        window_ns, gap_ns = int(window.total_seconds() * 1e9), int(max_gap.total_seconds() * 1e9)
+        ordered = np.sort(ref)
+        breaks = np.flatnonzero(np.diff(ordered) > gap_ns) + 1
+        frames = []
+        for cluster in np.split(ordered, breaks):
+            lo = cluster[0] - (window_ns if direction == 'nearest' else 0)
+            hi = cluster[-1] + window_ns
+            lo, hi = (pd.Timestamp(t, tz=UTC) for t in (lo, hi))
+            frames.append(self.download_period(url, lo, hi, filt=filt))
+        captures = pd.concat(frames, ignore_index=True).drop_duplicates(subset='timestamp', ignore_index=True)
+
+        matcher = match_nearest if direction == 'nearest' else match_at_or_after
+        matches = matcher(captures['datetime'], ref)
+        ok = (matches['position'] >= 0).to_numpy().copy()
+        # Anything further off than the window might have a closer capture outside the ranges we downloaded
+        # (either side for 'nearest', and for 'after' the match may come from a later cluster's range).
+        ok &= np.abs(matches['lag_seconds'].to_numpy()) <= window.total_seconds()
+        found = captures.iloc[matches['position'][ok].to_numpy()]
+        found.index = np.flatnonzero(ok)
+        rows = [found]
+        for i, t in zip(np.flatnonzero(~ok), matches['target'][~ok]):
+            closest = self._closest_request(url, t, direction, max_retries)
+            if len(closest):
+                rows.append(closest.set_axis([i]))
+        rows = [row for row in rows if len(row)]
+        result = pd.concat(rows) if rows else captures.iloc[:0]
+        result = result.reindex(range(len(ref)))
+        result['target'] = matches['target']
+        result['lag_seconds'] = (to_epoch_ns(result['datetime'].fillna(result['target'])) - ref) / 1e9
+        result.loc[result['datetime'].isna(), 'lag_seconds'] = np.nan
+        return result
+
+    def _closest_request(self, url, target, direction='nearest', max_retries=30):
+        """One capture closest to target straight from the server, empty if there isn't one."""
+        # https://github.com/internetarchive/wayback/issues/237#issuecomment-1042577291
+        cdx_req = self.closest_format.replace('$URL', url)
+        if direction == 'nearest':
+            cdx_req = cdx_req.replace('&from=$TIME', '')
+        cdx_req = cdx_req.replace("$TIME", _stamp(target))
+        for attempt in range(max_retries + 1):
             try:
-                target_times.add(storage_collection.iloc[0])
-            except IndexError:
-                pass
-        new_df = df.copy(deep=True)
-        new_df['is_target'] = df['datetime'].isin(target_times)
-        new_df = new_df.drop_duplicates(subset='timestamp', keep='first')
-        return new_df
+                listy_data = json.loads(self._get(cdx_req).text)
+                break
+            except (requests.exceptions.ConnectionError, json.decoder.JSONDecodeError):
+                if attempt >= max_retries:
+                    raise
+                self._backoff()
+        if not listy_data:
+            return cdx_frame([], CDX_FIELDS, filt=False)
+        first_line = listy_data.pop(0)
+        return cdx_frame(listy_data[:1], first_line, filt=False)
+
+    def plan(self, reference_times, filt=True, fields=None, policy='after'):
+        """
+        Extra CDX parameters for the narrowest query that still finds the first capture at or after each
+        reference time: the 200 filter and the collapse run server side, and `fields` limits the columns.
+        Collapsing keeps the first capture of each bucket, so only the 'after' policy gets it.
+        """
+        params = {}
+        if filt:
+            params['filter'] = 'statuscode:200'
+        digits = collapse_digits(reference_times) if policy == 'after' else 14
+        if digits < 14:
+            params['collapse'] = f'timestamp:{digits}'
+        if fields:
+            params['fl'] = ','.join(dict.fromkeys(['timestamp', *fields]))
+        return params
+
+    def _bounds(self, url, filt=True):
+        """Datetimes of the first and last capture of a url, two one-row requests."""
+        params = {'filter': 'statuscode:200'} if filt else {}
+        bounds = []
+        for limit in (1, -1):
+            columns, rows = self._records(url, None, None, params={**params, 'limit': limit, 'fl': 'timestamp'})
+            if not rows:
+                return None, None
+            bounds.append(cdx_frame(rows, columns, filt=False).datetime.iloc[0])
+        return tuple(bounds)
+
+    def download_targets(self, url, reference_times, period_end=None, filt=True, fields=None, plan=True,
+                         policy='after', tolerance=None):
+        """
+        Captures of url that `policy` could pick for `reference_times` (see `match.select_captures`).
+
+        For 'after' that's from the first reference time to `period_end`. 'before' and 'nearest' also look
+        back `tolerance` before the first one ('nearest' forward as much past the last), or one reference
+        time spacing without a tolerance, and 'latest' runs to the end of the last slot.
+        With `plan` the query is narrowed server side (see `plan`), unless the cache already holds the whole
+        window, in which case it's cheaper to read it locally.
+        """
+        if not hasattr(reference_times, '__len__'):
+            reference_times = list(reference_times)
+        if not len(reference_times):
+            return cdx_frame([], [*fields, 'timestamp'] if fields else CDX_FIELDS)
+        start, end = self._target_window(reference_times, period_end, policy, tolerance)
+        if not plan or (self.cache is not None and not self._cache_gaps(url, start, end)):
+            return self.download_period(url, start, end, filt=filt)
+        params = self.plan(reference_times, filt=filt, fields=fields, policy=policy)
+        columns, rows = self._records(url, start, end, params=params)
+        return cdx_frame(rows, columns, filt=filt)
+
+    @staticmethod
+    def _target_window(reference_times, period_end, policy, tolerance):
+        ref = to_epoch_ns(reference_times)
+        first, last = ref.min(), ref.max()
+        spacing = int(np.median(np.diff(np.unique(ref)))) if len(np.unique(ref)) > 1 else 86400 * 10**9
+        reach = int(pd.Timedelta(tolerance).value if isinstance(tolerance, datetime.timedelta)
+                    else tolerance * 10**9) if tolerance is not None else spacing
+        lo = first - reach if policy in ('before', 'nearest') else first
+        hi = {'nearest': last + reach, 'latest': last + spacing, 'before': last}.get(policy)
+        start = pd.Timestamp(lo, tz=UTC).strftime(WAYBACK_FORMAT)
+        if hi is not None:
+            return start, pd.Timestamp(hi, tz=UTC).strftime(WAYBACK_FORMAT)
+        return start, _stamp(period_end) if period_end is not None else None
+
+    def _select(self, url, reference_times, period_end, filt, fields, plan, digests, policy, tolerance,
+                per_target):
+        if digests and fields:
+            fields = [*fields, 'digest']
+        df = self.download_targets(url, reference_times, period_end, filt=filt, fields=fields, plan=plan,
+                                   policy=policy, tolerance=tolerance)
+        if digests:
+            df = mark_digest_runs(df.drop_duplicates(subset='timestamp', keep='first'))
+        if per_target:
+            return target_captures(df, reference_times, policy=policy, tolerance=tolerance)
+        return mark_targets(df, reference_times, policy=policy, tolerance=tolerance)
+
+    def _scheduled(self, url, grid, period_start, period_end, filt, fields, plan, options):
+        # grid(start, end) makes the reference times, start/end default to the first/last capture
+        if period_start is None or period_end is None:
+            first, last = self._bounds(url, filt=filt)
+            if first is None:
+                return self._select(url, [], None, filt, fields, plan, *options)
+            period_start = period_start if period_start is not None else first
+            period_end = period_end if period_end is not None else last
+        return self._select(url, grid(period_start, period_end), period_end, filt, fields, plan, *options)
+
+    def get_intervals(self, url, hrs=1, period_start=None, period_end=None, filt=True, fields=None, plan=True,
+                      digests=False, policy='after', tolerance=None, per_target=False, weekdays=None):
+        """
+        Captures of url flagged `is_target` for one capture every `hrs` hours, with `lag_seconds` from the
+        time it was picked for. `policy` is how it gets picked: 'after' (the first capture at or after the
+        time), 'before', 'nearest' or 'latest' (the last one before the next time), and `tolerance` (a
+        timedelta) is how far off it can be, see `match.select_captures`. `weekdays` (Monday=0, e.g.
+        `grid.WEEKDAYS`) skips the times on other days.
+
+        With `per_target` the result has one row per time instead, and times nothing qualified for are
+        there with `matched` False. With `digests` they also get `digest_run`/`content_timestamp` (see
+        `mark_digest_runs`), so a target whose page didn't change can reuse the content of the earlier capture
+        instead of downloading it again.
+        """
+        grid = lambda start, end: interval_grid(start, end, hrs=hrs, weekdays=weekdays)
+        return self._scheduled(url, grid, period_start, period_end, filt, fields, plan,
+                               (digests, policy, tolerance, per_target))
+
+    def get_at_time(self, url, at=(datetime.time(hour=9, tzinfo=HERE),), period_start=None, period_end=None,
+                    filt=True, fields=None, plan=True, digests=False, policy='after', tolerance=None,
+                    per_target=False, weekdays=None):
+        """
+        Same as `get_intervals` but the targets are the times of day in `at`, every day (or every day in
+        `weekdays`), each on the wall clock of its own timezone so they stay put across DST changes.
+        """
+        grid = lambda start, end: daily_grid(start, end, at, weekdays=weekdays)
+        return self._scheduled(url, grid, period_start, period_end, filt, fields, plan,
+                               (digests, policy, tolerance, per_target))
 
+    def get_schedule(self, url, spec, period_start=None, period_end=None, tz=None, filt=True, fields=None,
+                     plan=True, digests=False, policy='after', tolerance=None, per_target=False):
+        """
+        Same as `get_intervals` but the targets come from a cron line ("0 9 * * 1-5") or an rrule
+        ("FREQ=WEEKLY;BYDAY=MO;BYHOUR=9") read in `tz` (the local zone by default), see `grid.schedule_grid`.
+        """
+        grid = lambda start, end: schedule_grid(start, end, spec, tz=tz)
+        return self._scheduled(url, grid, period_start, period_end, filt, fields, plan,
+                               (digests, policy, tolerance, per_target))
 
 if __name__ == '__main__':
     scr = WaybackCDX()
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 import argparse
-from waybackscan.cdx import WaybackCDX
-from datetime import datetime
-from pytz import timezone
-from tzlocal import get_localzone
-import dateparser
+import functools
+import os
+import re
 import sys
+from datetime import datetime, time as dtime, timedelta, timezone
+import time
+# Only the light stuff up here, so --help and bad arguments come back straight away.
+# pandas, dateparser and the rest get imported once a command actually needs them.
+from waybackscan.writers import open_writer, FORMATS
 
 URL_EXCEPTIONS = {
         "abcnews": "www.abcnews.go.com",
@@ -14,7 +17,63 @@ URL_EXCEPTIONS = {
         "bbc": "www.bbc.com/news",
         "theguardian": "www.theguardian.com/us"
         }
-HERE = get_localzone()
+WAYBACK_DATE = re.compile(r'\d{4}(?:\d{2}){0,5}')
+CLOCK_TIME = re.compile(r'(\d{1,2}):(\d{2})(?::(\d{2}))?\s*([AaPp][Mm])?')
+# Monday to Friday, same as grid.WEEKDAYS but without pulling in pandas
+WEEKDAYS = (0, 1, 2, 3, 4)
+DATE_HELP = "local time unless it has a zone, wayback stamps (20200101) included"
+
+
+@functools.lru_cache(maxsize=None)
+def local_zone():
+    from tzlocal import get_localzone
+    return get_localzone()
+
+
+def _fast_date(value):
+    """Wayback stamps and ISO-8601 without going through dateparser."""
+    value = value.strip()
+    if WAYBACK_DATE.fullmatch(value):
+        # Naive, so it ends up in local time like any other date without a zone (and like dateparser had it).
+        return datetime.strptime(value + '00000101000000'[len(value):], '%Y%m%d%H%M%S')
+    try:
+        # 3.11 reads a trailing Z itself, older pythons don't
+        return datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith(('Z', 'z')) else value)
+    except ValueError:
+        return None
+
+
+def parse_date(value):
+    parsed_date = _fast_date(value)
+    if parsed_date is None:
+        import dateparser
+        parsed_date = dateparser.parse(value)
+    if parsed_date is None:
+        raise ValueError(f"can't make a date out of {value!r}")
+    if not parsed_date.tzinfo:
+        parsed_date = parsed_date.replace(tzinfo=local_zone())
+    return parsed_date
+
+
+def parse_time(value):
+    match = CLOCK_TIME.fullmatch(value.strip())
+    if match:
+        hour, minute, second, half = match.groups()
+        hour = int(hour) % 12 + (12 if half and half.lower() == 'pm' else 0) if half else int(hour)
+        return dtime(hour, int(minute), int(second or 0), tzinfo=local_zone())
+    return parse_date(value).timetz()
+
+
+def parse_interval(value):
+    tardate = parse_date(value)
+    tartz = tardate.tzinfo
+    return round((datetime.now().replace(tzinfo=tartz) - tardate).total_seconds() / 3600)
+
+
+def publisher_url(publisher):
+    if publisher in URL_EXCEPTIONS:
+        return URL_EXCEPTIONS[publisher]
+    return f'www.{publisher}.com'
 
 
 class DateParse(argparse.Action):
@@ -22,10 +81,7 @@ class DateParse(argparse.Action):
         super().__init__(option_strings, dest, nargs=nargs, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        parsed_date = dateparser.parse(values)
-        if not parsed_date.tzinfo:
-            parsed_date = parsed_date.replace(tzinfo=HERE)
-        setattr(namespace, self.dest, parsed_date)
+        setattr(namespace, self.dest, parse_date(values))
 
 
 class TimeParse(argparse.Action):
@@ -33,13 +89,7 @@ class TimeParse(argparse.Action):
         super().__init__(option_strings, dest, nargs=nargs, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        out = []
-        for value in values:
-            outdate = dateparser.parse(value)
-            if not outdate.tzinfo:
-                outdate = outdate.replace(tzinfo=HERE)
-            out.append(outdate.timetz())
-        setattr(namespace, self.dest, out)
+        setattr(namespace, self.dest, [parse_time(value) for value in values])
 
 
 class IntervalParse(argparse.Action):
@@ -47,54 +97,516 @@ class IntervalParse(argparse.Action):
         super().__init__(option_strings, dest, nargs=nargs, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        out = []
-        for value in values:
-            tardate = dateparser.parse(value)
-            if not tardate.tzinfo:
-                tardate = tardate.replace(tzinfo=HERE)
-            tartz = tardate.tzinfo
-            out.append(round((datetime.now().replace(tzinfo=tartz) - tardate).total_seconds() / 3600))
-        setattr(namespace, self.dest, out[0])
+        setattr(namespace, self.dest, parse_interval(values[0]))
 
 class PublisherParse(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        if values in URL_EXCEPTIONS:
-            setattr(namespace, 'url', URL_EXCEPTIONS[values])
-        else:
-            setattr(namespace, 'url', f'www.{values}.com')
+        urls = list(getattr(namespace, 'url', None) or [])
+        urls.append(publisher_url(values))
+        setattr(namespace, 'url', urls)
+        setattr(namespace, self.dest, values)
+
+
+def add_cache_args(parser):
+    cachegrp = parser.add_argument_group()
+    cachegrp.add_argument("--cache", type=str, default=None, help="defaults to ~/.cache/waybackscan/cdx.sqlite")
+    cachegrp.add_argument("--no-cache", dest='use_cache', action='store_false')
+    cachegrp.add_argument("--cache-ttl", type=float, default=None, help="hours before checking for new captures")
+    cachegrp.add_argument("--cache-size", type=float, default=None, help="max cache size in MB")
+
+
+def make_cdxer(args):
+    from waybackscan.cdx import WaybackCDX
+    from waybackscan.cache import CDXCache
+    cache = None
+    if args.use_cache:
+        cache = CDXCache(args.cache,
+                         ttl=args.cache_ttl * 3600 if args.cache_ttl is not None else None,
+                         max_bytes=int(args.cache_size * 2**20) if args.cache_size is not None else None)
+    return WaybackCDX(cache=cache, max_workers=args.jobs)
+
+
+def resolve_job(job, outdir='.', fmt='tsv'):
+    """Turn a raw job from the job file into what run_jobs wants, parsing dates/times the same way the flags do."""
+    url = job.get('url') or publisher_url(job['publisher'])
+    name = job.get('name') or job.get('publisher') or re.sub(r'[^\w.-]+', '_', url).strip('_')
+    fmt = job.get('format', fmt)
+    if job.get('interval'):
+        interval = job['interval']
+        # A bare number is hours, anything else means the same as -i.
+        hrs = interval if isinstance(interval, (int, float)) else parse_interval(interval)
+        method, kwargs = 'get_intervals', {'hrs': hrs}
+    elif job.get('at'):
+        at = job['at'] if isinstance(job['at'], list) else [job['at']]
+        method, kwargs = 'get_at_time', {'at': [parse_time(str(t)) for t in at]}
+    elif job.get('cron'):
+        method, kwargs = 'get_schedule', {'spec': job['cron']}
+    else:
+        method, kwargs = 'download_period', {}
+    if method in ('get_intervals', 'get_at_time') and str(job.get('weekdays', '')).lower() in ('true', '1', 'yes'):
+        kwargs['weekdays'] = WEEKDAYS
+    if method != 'download_period':
+        kwargs['policy'] = job.get('policy', 'after')
+        if job.get('tolerance') is not None:
+            kwargs['tolerance'] = timedelta(hours=float(job['tolerance']))
+    return {'name': name, 'url': url,
+            'start': parse_date(str(job['start'])) if job.get('start') else None,
+            'end': parse_date(str(job['end'])) if job.get('end') else None,
+            'method': method, 'kwargs': kwargs,
+            'format': fmt, 'output': job.get('output') or os.path.join(outdir, f'{name}.{fmt}')}
+
+
+def batch_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan batch',
+                                     description="run every job in a .toml or .tsv job file, one output per job")
+    parser.add_argument("jobfile", type=str)
+    parser.add_argument("-o", "--outdir", type=str, default='.', help="where outputs go unless a job names one")
+    parser.add_argument("--format", choices=FORMATS, default='tsv')
+    parser.add_argument("-P", "--parallel", type=int, default=4, help="how many jobs run at once")
+    parser.add_argument("--summary", type=str, default=None, help="also write the summary here as tsv")
+    parser.add_argument("-f", "--fail_ok", action='store_false')
+    add_cache_args(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="how many requests one job makes at once")
+    args = parser.parse_args(argv)
+
+    from waybackscan.batch import check_job, failed_job, load_jobs, run_jobs
+    try:
+        raw_jobs = load_jobs(args.jobfile)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    jobs, bad = [], []
+    for i, raw in enumerate(raw_jobs):
+        try:
+            check_job(raw)
+            jobs.append({**resolve_job(raw, args.outdir, args.format), 'filt': args.fail_ok})
+        except (KeyError, ValueError) as e:
+            # A typo in one job shouldn't stop the rest from running.
+            name = raw.get('name') or raw.get('publisher') or raw.get('url') or f'job {i + 1}'
+            bad.append(failed_job(name, raw.get('url'), f'{type(e).__name__}: {e}'))
+    names = [job['name'] for job in jobs]
+    dupes = {name for name in names if names.count(name) > 1}
+    # Jobs sharing a name would write over each other's output, so none of them run.
+    bad += [failed_job(job['name'], job['url'], 'ValueError: another job has the same name (and so output), '
+                       'give them a name') for job in jobs if job['name'] in dupes]
+    jobs = [job for job in jobs if job['name'] not in dupes]
+
+    def report(result):
+        print(f"{result['status']:6} {result['job']}: {result['rows']} rows in {result['seconds']:.1f}s"
+              + (f"  {result['error']}" if result['error'] else ''), file=sys.stderr)
+
+    for result in bad:
+        report(result)
+    start = time.perf_counter()
+    results = bad + run_jobs(make_cdxer(args), jobs, max_jobs=args.parallel, on_done=report)
+    failed = [r for r in results if r['status'] != 'ok']
+    print(f"{len(results) - len(failed)}/{len(results)} jobs ok, {sum(r['rows'] for r in results)} rows "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    if args.summary:
+        import pandas as pd
+        pd.DataFrame(results, columns=['job', 'url', 'status', 'rows', 'seconds', 'output', 'error']).to_csv(
+            args.summary, sep='\t', index=None)
+    return 1 if failed else 0
+
+
+def follow_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan follow',
+                                     description="keep polling for new captures and write them out as they turn up")
+    targetgrp = parser.add_argument_group()
+    targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
+    parser.add_argument("-s", "--since", type=str, action=DateParse,
+                        help="start from here instead of the newest capture there is now, " + DATE_HELP)
+    parser.add_argument("--every", type=float, default=60, help="minutes between polls")
+    parser.add_argument("--polls", type=int, default=None, help="stop after this many polls")
+    parser.add_argument("outfile", type=str, nargs="?", default='-')
+    parser.add_argument("--format", choices=FORMATS, default='tsv')
+    parser.add_argument("-f", "--fail_ok", action='store_false')
+    add_cache_args(parser)
+    args = parser.parse_args(argv)
+    if not args.url or len(set(args.url)) > 1:
+        parser.error("follow needs exactly one of -p/--publisher or -u/--url")
+    args.jobs = 1
+
+    cdxer = make_cdxer(args)
+    with open_writer(args.format, args.outfile) as writer:
+        try:
+            for df in cdxer.follow(args.url[0], since=args.since, every=args.every * 60, filt=args.fail_ok,
+                                   polls=args.polls):
+                writer.write(df)
+                writer.file.flush()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def coverage_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan coverage',
+                                     description="how many captures a url has per hour/day/week/month/year, "
+                                                 "and where the gaps are")
+    targetgrp = parser.add_argument_group()
+    targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
+    dategrp = parser.add_argument_group()
+    dategrp.add_argument("-s", "--start", type=str, action=DateParse, help=DATE_HELP)
+    dategrp.add_argument("-e", "--end", type=str, action=DateParse, help=DATE_HELP)
+    parser.add_argument("-r", "--resolution", choices=['hour', 'day', 'week', 'month', 'year'], default='day')
+    parser.add_argument("--gaps", action='store_true', help="list the gaps instead of the counts")
+    parser.add_argument("--min-gap", type=float, default=24, help="hours without a capture that count as a gap")
+    parser.add_argument("outfile", type=str, nargs="?", default='-')
+    parser.add_argument("--format", choices=FORMATS, default='tsv')
+    parser.add_argument("-f", "--fail_ok", action='store_false')
+    add_cache_args(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("one of the arguments -p/--publisher -u/--url is required")
+
+    cdxer = make_cdxer(args)
+    with open_writer(args.format, args.outfile) as writer:
+        for url in dict.fromkeys(args.url):
+            cov = cdxer.coverage(url, resolution=args.resolution, period_start=args.start, period_end=args.end,
+                                 filt=args.fail_ok, min_gap=timedelta(hours=args.min_gap))
+            out = cov.gaps if args.gaps else cov.counts
+            if len(args.url) > 1:
+                out = out.assign(url=url)
+            writer.write(out)
+            gap = cov.gaps['length'].iloc[0] if len(cov.gaps) else None
+            print(f"{url}: {cov.counts['captures'].sum()} captures, {(cov.counts['captures'] == 0).sum()} empty "
+                  f"{args.resolution}s, {len(cov.gaps)} gaps" + (f", longest {gap}" if gap is not None else ''),
+                  file=sys.stderr)
+    return 0
+
+
+def fetch_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan fetch',
+                                     description="download the archived pages for the target times, resuming "
+                                                 "wherever the last run stopped")
+    targetgrp = parser.add_argument_group()
+    targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
+    dategrp = parser.add_argument_group()
+    dategrp.add_argument("-s", "--start", type=str, action=DateParse, help=DATE_HELP)
+    dategrp.add_argument("-e", "--end", type=str, action=DateParse, help=DATE_HELP)
+    freqgrp = parser.add_mutually_exclusive_group()
+    freqgrp.add_argument("-i", "--interval", type=str, action=IntervalParse, nargs=1, help="defaults to hourly")
+    freqgrp.add_argument("-a", "--at", type=str, action=TimeParse, nargs='+')
+    freqgrp.add_argument("--cron", type=str, default=None)
+    parser.add_argument("--policy", choices=['after', 'before', 'nearest', 'latest'], default='after')
+    parser.add_argument("-o", "--outdir", type=str, default='.',
+                        help="pages go in OUTDIR/<publisher>/raw, the journal in OUTDIR/<publisher>/journal.sqlite")
+    parser.add_argument("--journal", type=str, default=None, help="somewhere else to keep the journal")
+    parser.add_argument("--store", type=str, nargs='?', const='', default=None,
+                        help="keep the pages in a snapshot store (zstd, one copy per digest) instead of pickles, "
+                             "defaults to ~/.local/share/waybackscan/snapshots")
+    parser.add_argument("--pack", type=str, default=None, help="append the pages to this packfile instead")
+    parser.add_argument("--warc", type=str, default=None,
+                        help="write the responses, headers and all, as gzipped WARC files in this directory instead")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="downloads in flight at once")
+    parser.add_argument("--retries", type=int, default=5, help="give up on a page after this many failures")
+    parser.add_argument("--report-every", type=float, default=10, help="seconds between progress lines")
+    parser.add_argument("--status", action='store_true', help="just say how far the journal has got")
+    parser.add_argument("-f", "--fail_ok", action='store_false')
+    add_cache_args(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=8)
+    args = parser.parse_args(argv)
+    if not args.url or len(set(args.url)) > 1:
+        parser.error("fetch needs exactly one of -p/--publisher or -u/--url")
+    url = args.url[0]
+    name = args.publisher if args.publisher else re.sub(r'[^\w.-]+', '_', url).strip('_')
+    outdir = os.path.join(args.outdir, name, 'raw')
+
+    from waybackscan.fetch import Journal, fetch_snapshots
+    journal = Journal(args.journal or os.path.join(args.outdir, name, 'journal.sqlite'))
+    if args.status:
+        counts = journal.counts(url)
+        print(', '.join(f'{n} {state}' for state, n in sorted(counts.items())) or 'nothing yet')
+        for _, timestamp, retries, error in journal.failures(url):
+            print(f'{timestamp}\t{retries}\t{error}')
+        return 0
+
+    cdxer = make_cdxer(args)
+    kwargs = {'period_start': args.start, 'period_end': args.end, 'filt': args.fail_ok, 'digests': True,
+              'policy': args.policy}
+    if args.at:
+        targets = cdxer.get_at_time(url, at=args.at, **kwargs)
+    elif args.cron:
+        targets = cdxer.get_schedule(url, args.cron, **kwargs)
+    else:
+        targets = cdxer.get_intervals(url, hrs=args.interval or 1, **kwargs)
+    if args.store is not None:
+        from waybackscan.store import SnapshotStore
+        outdir = SnapshotStore(args.store or None)
+    elif args.pack:
+        from waybackscan.pack import Pack
+        outdir = Pack(args.pack)
+    elif args.warc:
+        from waybackscan.warc import WarcWriter
+        outdir = WarcWriter(args.warc, prefix=name)
+    try:
+        counts = fetch_snapshots(url, targets, outdir, journal, workers=args.workers, max_retries=args.retries,
+                                 report_every=args.report_every)
+    except KeyboardInterrupt:
+        print('stopped, run the same command again to carry on', file=sys.stderr)
+        return 130
+    finally:
+        journal.close()
+        if hasattr(outdir, 'close'):
+            outdir.close()
+    return 1 if counts.get('failed') else 0
+
+
+def store_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan store', description="look after the snapshot store")
+    parser.add_argument("--store", type=str, default=None, help="defaults to ~/.local/share/waybackscan/snapshots")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help="move a raw/ directory of .pkl pages into the store")
+    migrate.add_argument("raw", type=str)
+    targetgrp = migrate.add_mutually_exclusive_group(required=True)
+    targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
+    migrate.add_argument("--delete", action='store_true', help="remove the pickles once they're in the store")
+    add_cache_args(migrate)
+    commands.add_parser('stats', help="how many pages, how many distinct ones and how well they compress")
+    get = commands.add_parser('get', help="print the html of one capture")
+    get.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    get.add_argument("-u", "--url", type=str, action='append')
+    get.add_argument("timestamp", type=str)
+    train = commands.add_parser('train', help="train zstd dictionaries for a url's pages, one per layout era")
+    targetgrp = train.add_mutually_exclusive_group(required=True)
+    targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
+    train.add_argument("eras", type=str, nargs='*', help="dates the layout changed on, each starts a new era")
+    train.add_argument("--samples", type=int, default=1000, help="pages to train each dictionary on")
+    train.add_argument("--recompress", action='store_true', help="also compress the pages already stored again")
+    commands.add_parser('dicts', help="list the dictionaries")
+    args = parser.parse_args(argv)
+
+    from waybackscan.store import SnapshotStore, migrate_pickles
+    store = SnapshotStore(args.store)
+    if args.command == 'stats':
+        for key, value in store.stats().items():
+            print(f'{key}\t{value:.2f}' if isinstance(value, float) else f'{key}\t{value}')
+    elif args.command == 'dicts':
+        for dict_id, url, since, size, samples in store.dictionaries():
+            print(f'{dict_id}\t{url}\t{since or "-"}\t{size}\t{samples}')
+    elif args.command == 'train':
+        url = args.url[0]
+        starts = sorted(parse_date(era).astimezone(timezone.utc).strftime('%Y%m%d%H%M%S') for era in args.eras)
+        for since, until in zip([None] + starts, starts + [None]):
+            try:
+                dict_id = store.train_dictionary(url, since, until, samples=args.samples)
+            except ValueError as e:
+                print(f'skipping the era from {since or "the start"}: {e}', file=sys.stderr)
+                continue
+            print(f'{dict_id}\t{url}\t{since or "-"}\t{until or "-"}')
+        if args.recompress:
+            before, after = store.recompress(url)
+            print(f'recompressed {before / 2**20:.1f}MB -> {after / 2**20:.1f}MB', file=sys.stderr)
+    elif args.command == 'get':
+        if not args.url:
+            parser.error("get needs -p/--publisher or -u/--url")
+        try:
+            sys.stdout.write(store.get(args.url[0], args.timestamp))
+        except KeyError:
+            print(f'{args.url[0]} {args.timestamp} is not in the store', file=sys.stderr)
+            return 1
+    else:
+        url = args.url[0]
+        digests = {}
+        if args.use_cache:
+            # The archive's digests, where we have them, so these pages dedupe against the ones fetched later.
+            from waybackscan.cache import CDXCache
+            digests = {row[1]: row[5] for row in CDXCache(args.cache).read(url)}
+        pages, links = migrate_pickles(args.raw, store, url, digests=digests, delete=args.delete)
+        stats = store.stats()
+        print(f'{pages} pages and {links} links from {args.raw}, the store now holds {stats["blobs"]} distinct '
+              f'pages for {stats["captures"]} captures', file=sys.stderr)
+    store.close()
+    return 0
+
+
+def pack_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan pack',
+                                     description="packfiles: every page in one append-only file plus an index")
+    parser.add_argument("pack", type=str)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="copy a snapshot store (or some urls of it) into the pack")
+    build.add_argument("--store", type=str, default=None, help="defaults to ~/.local/share/waybackscan/snapshots")
+    build.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    build.add_argument("-u", "--url", type=str, action='append')
+    build.add_argument("--compression", choices=['zstd', 'none'], default='zstd')
+    compact = commands.add_parser('compact', help="rewrite the pack without superseded pages, in url/time order")
+    compact.add_argument("--compression", choices=['zstd', 'none'], default=None)
+    commands.add_parser('stats')
+    get = commands.add_parser('get', help="print the html of one capture")
+    get.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    get.add_argument("-u", "--url", type=str, action='append')
+    get.add_argument("timestamp", type=str)
+    args = parser.parse_args(argv)
+
+    from waybackscan import pack
+    if args.command == 'build':
+        from waybackscan.store import SnapshotStore
+        with pack.pack_store(SnapshotStore(args.store), args.pack, urls=args.url,
+                             compression=args.compression) as packed:
+            print(', '.join(f'{v} {k}' for k, v in packed.stats().items()), file=sys.stderr)
+    elif args.command == 'compact':
+        before, after = pack.compact(args.pack, compression=args.compression)
+        print(f'{before / 2**20:.1f}MB -> {after / 2**20:.1f}MB', file=sys.stderr)
+    elif args.command == 'stats':
+        with pack.Pack(args.pack) as packed:
+            for key, value in packed.stats().items():
+                print(f'{key}\t{value}')
+    else:
+        if not args.url:
+            parser.error("get needs -p/--publisher or -u/--url")
+        with pack.Pack(args.pack) as packed:
+            try:
+                sys.stdout.write(packed.get(args.url[0], args.timestamp))
+            except KeyError:
+                print(f'{args.url[0]} {args.timestamp} is not in the pack', file=sys.stderr)
+                return 1
+    return 0
+
+
+def warc_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='waybackscan warc', description="index and look inside WARC files")
+    commands = parser.add_subparsers(dest='command', required=True)
+    index = commands.add_parser('index', help="(re)write the .cdx sidecar of each file")
+    index.add_argument("warcs", type=str, nargs='+', help="files, directories or globs")
+    ls = commands.add_parser('ls', help="list the records of each file")
+    ls.add_argument("warcs", type=str, nargs='+', help="files, directories or globs")
+    get = commands.add_parser('get', help="print the page of the capture nearest to a time")
+    get.add_argument("warcs", type=str, nargs='+', help="files, directories or globs")
+    get.add_argument("-p", "--publisher", type=str, action=PublisherParse)
+    get.add_argument("-u", "--url", type=str, action='append')
+    get.add_argument("-t", "--timestamp", type=str, required=True)
+    args = parser.parse_args(argv)
+
+    from waybackscan import warc
+    paths = warc.warc_paths(args.warcs)
+    if args.command == 'index':
+        failed = False
+        for path in paths:
+            try:
+                print(f'{path}\t{warc.index_warc(path)} captures', file=sys.stderr)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                failed = True
+        return 1 if failed else 0
+    elif args.command == 'ls':
+        for path in paths:
+            for record in warc.iter_records(path, types=()):
+                offset = '-' if record.offset is None else record.offset
+                print(f'{offset}\t{record.type}\t{record.timestamp}\t{record.uri or "-"}')
+    else:
+        if not args.url:
+            parser.error("get needs -p/--publisher or -u/--url")
+        record = warc.WarcTransport(paths).record(args.url[0], args.timestamp)
+        if record is None:
+            print(f'{args.url[0]} is not in {" ".join(args.warcs)}', file=sys.stderr)
+            return 1
+        sys.stdout.buffer.write(record.payload)
+    return 0
 
 
 def cli():
+    if len(sys.argv) > 1 and sys.argv[1] == 'coverage':
+        sys.exit(coverage_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'follow':
+        sys.exit(follow_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'fetch':
+        sys.exit(fetch_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'store':
+        sys.exit(store_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'pack':
+        sys.exit(pack_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'warc':
+        sys.exit(warc_cli(sys.argv[2:]))
     parser = argparse.ArgumentParser()
-    targetgrp = parser.add_mutually_exclusive_group(required=True)
+    # Both can be given more than once (and mixed), the targets get fetched concurrently.
+    targetgrp = parser.add_argument_group()
     targetgrp.add_argument("-p", "--publisher", type=str, action=PublisherParse)
-    targetgrp.add_argument("-u", "--url", type=str)
+    targetgrp.add_argument("-u", "--url", type=str, action='append')
     dategrp = parser.add_argument_group()
-    dategrp.add_argument("-s", "--start", type=str, action=DateParse)
-    dategrp.add_argument("-e", "--end", type=str, action=DateParse)
+    dategrp.add_argument("-s", "--start", type=str, action=DateParse, help=DATE_HELP)
+    dategrp.add_argument("-e", "--end", type=str, action=DateParse, help=DATE_HELP)
     freqgrp = parser.add_mutually_exclusive_group()
     freqgrp.add_argument("-i", "--interval", type=str, action=IntervalParse, nargs=1)
     freqgrp.add_argument("-a", "--at", type=str, action=TimeParse, nargs='+')
-    parser.add_argument("outfile", type=argparse.FileType("w"), nargs="?", default=sys.stdout)
+    freqgrp.add_argument("--cron", type=str, default=None,
+                         help='a cron line ("0 9 * * 1-5") or rrule ("FREQ=WEEKLY;BYDAY=MO;BYHOUR=9") in local time')
+    parser.add_argument("--weekdays", action='store_true', help="only the -i/-a times falling Monday to Friday")
+    parser.add_argument("outfile", type=str, nargs="?", default='-')
+    parser.add_argument("--format", choices=FORMATS, default='tsv',
+                        help="parquet and arrow keep the column types, so loading them back needs no parsing. "
+                             "Any format is written in one go once the download is done, only --page-size streams")
+    parser.add_argument("--page-size", type=int, default=None,
+                        help="stream plain downloads to the output a CDX page at a time (skips the cache). "
+                             "Only without -i/-a/--cron and --digests, everything else is still written "
+                             "out in one go at the end")
     parser.add_argument("-f", "--fail_ok", action='store_false')
+    parser.add_argument("--digests", action='store_true',
+                        help="add digest_run/content_timestamp columns marking captures whose content didn't change")
+    policygrp = parser.add_argument_group("picking captures for -i/-a/--cron")
+    policygrp.add_argument("--policy", choices=['after', 'before', 'nearest', 'latest'], default='after',
+                           help="first capture at/after each time (default), last at/before, nearest either "
+                                "side, or the last one before the next time")
+    policygrp.add_argument("--tolerance", type=float, default=None,
+                           help="hours a capture can be off by, times with nothing that close get no capture")
+    policygrp.add_argument("--per-target", action='store_true',
+                           help="one row per time instead of per capture, misses included with matched=False")
+    add_cache_args(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=8, help="how many targets to fetch at once")
+    parser.add_argument("--shards", choices=['month', 'year'], default=None,
+                        help="download the window in month/year pieces in parallel")
 
     args = parser.parse_args()
-    
-    url = args.url
-    cdxer = WaybackCDX()
+    if not args.url:
+        parser.error("one of the arguments -p/--publisher -u/--url is required")
+
+    urls = list(dict.fromkeys(args.url))
+    cdxer = make_cdxer(args)
 
     if args.interval:
-        output = cdxer.get_intervals(url, hrs=args.interval, period_start=args.start, period_end=args.end, filt=args.fail_ok)
+        method, kwargs = 'get_intervals', {'hrs': args.interval}
     elif args.at:
-        output = cdxer.get_at_time(url, at=args.at, period_start=args.start, period_end=args.end, filt=args.fail_ok)
-    else:
-        output = cdxer.download_period(url, period_start=args.start, period_end=args.end, filt=args.fail_ok)
-
-    if args.at or args.interval:
-        output[output['is_target']].to_csv(args.outfile, sep="\t", index=None)
+        method, kwargs = 'get_at_time', {'at': args.at}
+    elif args.cron:
+        method, kwargs = 'get_schedule', {'spec': args.cron}
     else:
-        output.to_csv(args.outfile, sep='\t', index=None)
+        method, kwargs = 'download_period', {'shards': args.shards}
+    if args.weekdays and method in ('get_intervals', 'get_at_time'):
+        kwargs['weekdays'] = WEEKDAYS
+    kwargs['digests'] = args.digests
+    if method != 'download_period':
+        kwargs.update(policy=args.policy, per_target=args.per_target,
+                      tolerance=timedelta(hours=args.tolerance) if args.tolerance is not None else None)
 
+    with open_writer(args.format, args.outfile) as writer:
+        if method == 'download_period' and args.page_size and not args.digests:
+            # Rows go out as the pages come in, rather than after the whole download.
+            # (Not with --digests, a run of unchanged captures can straddle two pages.)
+            for url in urls:
+                for page, _ in cdxer.iter_pages(url, args.start, args.end, filt=args.fail_ok,
+                                                page_size=args.page_size):
+                    writer.write(page.assign(url=url) if len(urls) > 1 else page)
+            return
+        if args.page_size:
+            print('--page-size only streams plain downloads, this one is written out when it finishes',
+                  file=sys.stderr)
+        if len(urls) == 1:
+            output = getattr(cdxer, method)(urls[0], period_start=args.start, period_end=args.end,
+                                             filt=args.fail_ok, **kwargs)
+        else:
+            output = cdxer.download_many(urls, period_start=args.start, period_end=args.end, filt=args.fail_ok,
+                                         long=True, method=method, **kwargs)
+        # (no is_target column if every url failed and download_many has nothing to show for it)
+        if (args.at or args.interval or args.cron) and not args.per_target and 'is_target' in output:
+            output = output[output['is_target']]
+        writer.write(output)
 
 if __name__ == "__main__":
     cli()
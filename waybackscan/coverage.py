@@ -0,0 +1,75 @@
+"""How densely a url was captured over time, and where the holes are, straight off the capture times."""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .match import to_epoch_ns
+
+RESOLUTIONS = ('hour', 'day', 'week', 'month', 'year')
+_NS = {'hour': 3600 * 10**9, 'day': 86400 * 10**9}
+_DAY = 86400 * 10**9
+
+Coverage = namedtuple('Coverage', ['counts', 'gaps'])
+
+
+def _bin(ns, resolution):
+    """Bin number of each epoch-ns time, and a function from bin numbers back to bin start (epoch ns)."""
+    if resolution in _NS:
+        width = _NS[resolution]
+        return ns // width, lambda b: b * width
+    if resolution == 'week':
+        # 1970-01-01 was a Thursday, shift by 3 days so weeks start on a Monday like ISO weeks do.
+        return (ns // _DAY + 3) // 7, lambda b: (b * 7 - 3) * _DAY
+    if resolution in ('month', 'year'):
+        unit = 'M' if resolution == 'month' else 'Y'
+        return ns.view('datetime64[ns]').astype(f'datetime64[{unit}]').view('int64'), \
+            lambda b: b.view(f'datetime64[{unit}]').astype('datetime64[ns]').view('int64')
+    raise ValueError(f'resolution should be one of {", ".join(RESOLUTIONS)}, not {resolution!r}')
+
+
+def capture_counts(times, resolution='day', start=None, end=None) -> pd.DataFrame:
+    """
+    Captures per hour/day/week/month/year (UTC), one row per bin from start to end (or the first to the
+    last capture) including the empty ones, so a run of zeros is a stretch nobody archived.
+    """
+    ns = to_epoch_ns(times)
+    ends = [to_epoch_ns([t])[0] if t is not None else None for t in (start, end)]
+    if ends[0] is not None:
+        ns = ns[ns >= ends[0]]
+    if ends[1] is not None:
+        ns = ns[ns <= ends[1]]
+    bins, bin_start = _bin(ns, resolution)
+    lo = _bin(np.array([ends[0]]), resolution)[0][0] if ends[0] is not None else (bins.min() if len(bins) else 0)
+    hi = _bin(np.array([ends[1]]), resolution)[0][0] if ends[1] is not None else (bins.max() if len(bins) else -1)
+    n = max(hi - lo + 1, 0)
+    counts = np.bincount(bins - lo, minlength=n)[:n] if len(bins) else np.zeros(n, dtype='int64')
+    return pd.DataFrame({
+        'start': pd.to_datetime(bin_start(np.arange(lo, hi + 1, dtype='int64')), utc=True),
+        'captures': counts,
+    })
+
+
+def capture_gaps(times, min_gap=pd.Timedelta(days=1), start=None, end=None) -> pd.DataFrame:
+    """
+    Stretches longer than `min_gap` without a capture, longest first. With start/end the stretches before
+    the first capture and after the last one count too.
+    """
+    ns = np.sort(to_epoch_ns(times))
+    edges = [to_epoch_ns([t])[0] if t is not None else None for t in (start, end)]
+    if edges[0] is not None:
+        ns = np.r_[edges[0], ns[ns >= edges[0]]]
+    if edges[1] is not None:
+        ns = np.r_[ns[ns <= edges[1]], edges[1]]
+    width = np.diff(ns)
+    big = np.flatnonzero(width > pd.Timedelta(min_gap).value)
+    gaps = pd.DataFrame({
+        'start': pd.to_datetime(ns[big], utc=True),
+        'end': pd.to_datetime(ns[big + 1], utc=True),
+        'length': pd.to_timedelta(width[big]),
+    })
+    return gaps.sort_values('length', ascending=False, kind='stable', ignore_index=True)
+
+
+def coverage(times, resolution='day', min_gap=pd.Timedelta(days=1), start=None, end=None) -> Coverage:
+    return Coverage(capture_counts(times, resolution, start, end), capture_gaps(times, min_gap, start, end))
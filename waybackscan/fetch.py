@@ -0,0 +1,283 @@
+"""
+Downloading the snapshots themselves (the archived html), concurrently and resumably, into a directory of
+pickles, a `store.SnapshotStore`, a `pack.Pack` or WARC files.
+
+Every target timestamp gets a row in a SQLite journal saying whether it's pending, ok or failed and how many
+tries it has had. A snapshot is written to a temp file and moved into place before its row is marked ok, so
+killing the process at any point loses at most the downloads that were in flight, and running the same job
+again picks up where it stopped.
+"""
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+from .transport import default_transport
+
+SNAPSHOT_URL = 'https://web.archive.org/web/{timestamp}id_/https://{url}'
+# How many later captures to try when one is stuck in a redirect loop.
+REDIRECT_HOPS = 3
+
+
+class Journal:
+    """
+    SQLite record of which snapshots of which urls are downloaded. One row per (url, timestamp), with the
+    `content_timestamp` it gets its content from (itself unless its digest matched an earlier capture), a
+    `state` of pending/ok/failed, the number of failed `retries`, the last error and when it last changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            # WAL + NORMAL survives the process dying, only a power cut can lose the last few commits.
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                url TEXT NOT NULL, timestamp TEXT NOT NULL, content_timestamp TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending', retries INTEGER NOT NULL DEFAULT 0, error TEXT,
+                fetched_from TEXT, bytes INTEGER, updated_at REAL,
+                PRIMARY KEY (url, timestamp)) WITHOUT ROWID''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS snapshots_content ON snapshots (url, content_timestamp)')
+
+    def add(self, url, timestamps, content_timestamps=None):
+        """Add targets as pending, the ones already there keep whatever state they're in."""
+        content_timestamps = timestamps if content_timestamps is None else content_timestamps
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO snapshots (url, timestamp, content_timestamp, updated_at) VALUES (?, ?, ?, ?)',
+                ((url, str(ts), str(cts), time.time()) for ts, cts in zip(timestamps, content_timestamps)))
+
+    def todo(self, url, max_retries=None):
+        """Content timestamps still to download, with how many times each has failed so far."""
+        query = '''SELECT content_timestamp, MAX(retries) FROM snapshots WHERE url = ? AND state != 'ok'
+                   AND content_timestamp NOT IN (SELECT content_timestamp FROM snapshots WHERE url = ? AND state = 'ok')
+                   GROUP BY content_timestamp'''
+        if max_retries is not None:
+            query += ' HAVING MAX(retries) < ?'
+        query += ' ORDER BY content_timestamp'
+        params = (url, url) if max_retries is None else (url, url, max_retries)
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def reusable(self, url):
+        """(timestamp, content_timestamp) of targets added after their content was already downloaded."""
+        with self._lock:
+            return self._conn.execute('''SELECT timestamp, content_timestamp FROM snapshots
+                WHERE url = ? AND state != 'ok'
+                AND content_timestamp IN (SELECT content_timestamp FROM snapshots WHERE url = ? AND state = 'ok')''',
+                                      (url, url)).fetchall()
+
+    def targets(self, url, content_timestamp):
+        with self._lock:
+            return [ts for ts, in self._conn.execute(
+                'SELECT timestamp FROM snapshots WHERE url = ? AND content_timestamp = ?', (url, content_timestamp))]
+
+    def done(self, url, content_timestamp, fetched_from=None, nbytes=None):
+        """Mark every target sharing `content_timestamp` as downloaded."""
+        with self._lock, self._conn:
+            self._conn.execute('''UPDATE snapshots SET state = 'ok', error = NULL, fetched_from = ?, bytes = ?,
+                updated_at = ? WHERE url = ? AND content_timestamp = ?''',
+                               (fetched_from or content_timestamp, nbytes, time.time(), url, content_timestamp))
+
+    def failed(self, url, content_timestamp, error):
+        with self._lock, self._conn:
+            self._conn.execute('''UPDATE snapshots SET state = 'failed', retries = retries + 1, error = ?,
+                updated_at = ? WHERE url = ? AND content_timestamp = ?''',
+                               (error, time.time(), url, content_timestamp))
+
+    def counts(self, url=None):
+        """Targets per state, e.g. {'ok': 812, 'pending': 40, 'failed': 3}."""
+        query = 'SELECT state, COUNT(*) FROM snapshots' + (' WHERE url = ?' if url else '') + ' GROUP BY state'
+        with self._lock:
+            return dict(self._conn.execute(query, (url,) if url else ()).fetchall())
+
+    def failures(self, url=None):
+        """(url, timestamp, retries, error) of everything that's failed and not since succeeded."""
+        query = "SELECT url, timestamp, retries, error FROM snapshots WHERE state = 'failed'"
+        with self._lock:
+            return self._conn.execute(query + (' AND url = ?' if url else '') + ' ORDER BY url, timestamp',
+                                      (url,) if url else ()).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Progress:
+    """Throughput and ETA on stderr (or `out`), at most one line every `every` seconds."""
+
+    def __init__(self, total, done=0, every=10.0, out=sys.stderr):
+        self.total = total
+        self.done = done
+        self.ok = 0
+        self.failed = 0
+        self.bytes = 0
+        self.every = every
+        self.out = out
+        self.start = self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, ok=0, failed=0, nbytes=0):
+        with self._lock:
+            self.ok += ok
+            self.failed += failed
+            self.done += ok
+            self.bytes += nbytes
+            now = time.monotonic()
+            if self.out is not None and now - self.last >= self.every:
+                self.last = now
+                print(self.line(), file=self.out)
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        rate = self.ok / elapsed
+        left = self.total - self.done
+        eta = time.strftime('%H:%M:%S', time.gmtime(left / rate)) if rate and left else '--:--:--'
+        if rate and left / rate >= 86400:
+            eta = f'{left / rate / 86400:.1f} days'
+        return (f'{self.done}/{self.total} snapshots, {self.failed} failed, {rate:.2f}/s, '
+                f'{self.bytes / elapsed / 2**20:.2f} MB/s, eta {eta}')
+
+
+def snapshot_path(outdir, timestamp):
+    return os.path.join(outdir, f'{timestamp}.pkl')
+
+
+def _save(path, html):
+    part = path + '.part'
+    with open(part, 'wb') as f:
+        pickle.dump(html, f)
+    os.replace(part, path)
+
+
+def _link(outdir, timestamp, content_timestamp):
+    # Same page as an earlier capture, point at that one instead of storing it twice.
+    path = snapshot_path(outdir, timestamp)
+    if timestamp != content_timestamp and not os.path.lexists(path):
+        os.symlink(os.path.basename(snapshot_path(outdir, content_timestamp)), path)
+
+
+def _download(transport, url, timestamp, later):
+    """The response for a snapshot and the timestamp it really came from (a later one if this one redirects forever)."""
+    for stamp in [timestamp, *later[:REDIRECT_HOPS]]:
+        try:
+            r = transport.get(SNAPSHOT_URL.format(timestamp=stamp, url=url))
+        except requests.exceptions.TooManyRedirects:
+            continue
+        r.raise_for_status()
+        return r, stamp
+    raise requests.exceptions.TooManyRedirects(f'{timestamp} and the {REDIRECT_HOPS} captures after it all loop')
+
+
+def _retryable(e):
+    """Whether a failed download is worth another go: not a 4xx (other than a 429), that'll only say the same."""
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        status = e.response.status_code
+        return not 400 <= status < 500 or status == 429
+    return True
+
+
+def fetch_snapshots(url, targets, outdir, journal, transport=None, workers=8, max_retries=5, report_every=10.0,
+                    out=sys.stderr):
+    """
+    Download the snapshot of url for every target into `outdir`: a directory gets `<timestamp>.pkl` files (the
+    pickled html), a `store.SnapshotStore` gets each page once under its CDX digest, a `warc.WarcWriter` gets
+    response records with the original headers and revisits for the repeats.
+
+    `targets` is what `get_intervals`/`get_at_time`/`get_schedule` return, ideally with `digests=True` so each
+    distinct page is downloaded once and the rest are linked to it; only rows flagged `is_target` count.
+    Everything goes through one `transport`, so the workers share its connection pool and rate limiter.
+    A snapshot that fails is retried at a slower pace, up to `max_retries` failures over this run and any earlier
+    ones, unless the archive said it's not there (a 4xx other than 429).
+
+    Returns the journal's counts for url once it's done.
+    """
+    transport = transport if transport is not None else default_transport()
+    store = outdir if hasattr(outdir, 'put') else None
+    if store is None:
+        os.makedirs(outdir, exist_ok=True)
+    chosen = targets[targets['is_target']] if 'is_target' in targets else targets
+    chosen = chosen[chosen['timestamp'].notna()] if 'matched' in chosen else chosen
+    timestamps = chosen['timestamp'].astype('int64').astype(str).to_numpy()
+    content = chosen['content_timestamp'] if 'content_timestamp' in chosen else chosen['timestamp']
+    content = content.astype('int64').astype(str).to_numpy()
+    journal.add(url, timestamps, content)
+    digests = dict(zip(content, chosen['digest'].astype(str))) if 'digest' in chosen else {}
+    # Every capture we know of, for stepping past one that's stuck in a redirect loop.
+    captures = np.unique(targets['timestamp'].dropna().astype('int64').to_numpy())
+
+    def link(timestamps, source):
+        # source is the timestamp the page went in under
+        if store is not None:
+            digest = store.digest(url, source)
+            store.link_many(url, [(timestamp, digest) for timestamp in timestamps if timestamp != source])
+        else:
+            for timestamp in timestamps:
+                _link(outdir, timestamp, source)
+
+    for timestamp, content_timestamp in journal.reusable(url):
+        link([timestamp], content_timestamp)
+        journal.done(url, content_timestamp)
+    todo = journal.todo(url, max_retries)
+    counts = journal.counts(url)
+    progress = Progress(sum(counts.values()), counts.get('ok', 0), every=report_every, out=out)
+
+    def fetch(content_timestamp):
+        later = captures[np.searchsorted(captures, int(content_timestamp), side='right'):].astype(str)
+        r, stamp = _download(transport, url, content_timestamp, later)
+        if hasattr(store, 'put_response'):
+            # a warc.WarcWriter, which keeps the headers too. The record is dated when the page was really
+            # captured, so after a redirect fallback the targets (content_timestamp too) are revisits of it.
+            store.put_response(url, stamp, r)
+            return stamp, stamp, len(r.content)
+        if store is not None:
+            # the digest is the archive's for this capture, not for a later one we fell back to
+            store.put(url, content_timestamp, r.text, digests.get(content_timestamp) if stamp == content_timestamp
+                      else None)
+        else:
+            _save(snapshot_path(outdir, content_timestamp), r.text)
+        return content_timestamp, stamp, len(r.content)
+
+    limiter = getattr(transport, 'limiter', None)
+    host = urlparse(SNAPSHOT_URL).netloc
+    queue = deque(todo)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while queue or running:
+            # Only a couple of rounds in flight, so ctrl-c doesn't have to wait for thousands of queued ones.
+            while queue and len(running) < 2 * workers:
+                content_timestamp, retries = queue.popleft()
+                running[pool.submit(fetch, content_timestamp)] = (content_timestamp, retries)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                content_timestamp, retries = running.pop(future)
+                try:
+                    source, stamp, nbytes = future.result()
+                except Exception as e:
+                    journal.failed(url, content_timestamp, f'{type(e).__name__}: {e}')
+                    progress.update(failed=1)
+                    if retries + 1 < max_retries and _retryable(e):
+                        if limiter is not None:
+                            # on top of whatever the transport did, so the retry doesn't go straight back out
+                            limiter.throttle(host, retry_after=1)
+                        queue.append((content_timestamp, retries + 1))
+                    continue
+                same = journal.targets(url, content_timestamp)
+                link(same, source)
+                journal.done(url, content_timestamp, stamp, nbytes)
+                progress.update(ok=len(same), nbytes=nbytes)
+    if out is not None:
+        print(progress.line(), file=out)
+    return journal.counts(url)
@@ -0,0 +1,159 @@
+"""
+Reference-time grids (every n hours, times of day, cron and rrule schedules) built as whole arrays.
+
+Everything comes back as a sorted UTC DatetimeIndex that goes straight into the matchers in `match`. Times of
+day are wall-clock times in their zone, so "9:00 America/New_York" is 14:00 UTC in winter and 13:00 UTC in
+summer. A time that doesn't exist on a spring-forward day moves to the first one that does, and one that
+happens twice on a fall-back day gets the first of the two.
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+WEEKDAYS = (0, 1, 2, 3, 4)
+_MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+_DAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+
+
+def _local_zone():
+    from tzlocal import get_localzone
+    return get_localzone()
+
+
+def _utc(t):
+    # naive is UTC, like the archive's timestamps
+    t = pd.Timestamp(t)
+    return t.tz_localize('UTC') if t.tzinfo is None else t.tz_convert('UTC')
+
+
+def _local_days(lo, hi, tz, weekdays=None):
+    """Naive midnights of every day lo..hi touches on the wall clock in `tz`, Monday=0 for `weekdays`."""
+    days = pd.date_range(lo.tz_convert(tz).tz_localize(None).normalize(),
+                         hi.tz_convert(tz).tz_localize(None).normalize(), freq='D')
+    if weekdays is not None:
+        days = days[np.isin(days.dayofweek, list(weekdays))]
+    return days
+
+
+def _localize(days, offsets, tz, lo, hi):
+    """Every day + every offset (ns after midnight) on the wall clock in `tz`, as UTC, clipped to lo..hi."""
+    wall = (np.asarray(days, dtype='datetime64[ns]')[:, None]
+            + np.asarray(offsets, dtype='int64').astype('timedelta64[ns]')[None, :]).ravel()
+    local = pd.DatetimeIndex(wall).tz_localize(tz, ambiguous=np.ones(len(wall), dtype=bool),
+                                               nonexistent='shift_forward')
+    utc = local.tz_convert('UTC')
+    return utc[(utc >= lo) & (utc <= hi)]
+
+
+def _finish(grid):
+    grid = grid.sort_values()
+    return grid[~grid.duplicated()]
+
+
+def interval_grid(start, end, hrs=1, weekdays=None, tz=None) -> pd.DatetimeIndex:
+    """
+    Every `hrs` hours of elapsed time from start (less its minutes, so it lands on the hour) to end.
+    `weekdays` (Monday=0) keeps only the times falling on those days in `tz`, the start's zone by default.
+    """
+    lo, hi = _utc(start), _utc(end)
+    lo -= pd.Timedelta(minutes=pd.Timestamp(start).minute)
+    grid = pd.date_range(lo, hi, freq=pd.Timedelta(hours=hrs))
+    if weekdays is not None:
+        tz = tz or pd.Timestamp(start).tzinfo or 'UTC'
+        grid = grid[np.isin(grid.tz_convert(tz).dayofweek, list(weekdays))]
+    return grid
+
+
+def daily_grid(start, end, at, weekdays=None) -> pd.DatetimeIndex:
+    """
+    The times of day in `at` on every day from start to end, each on the wall clock of its own tzinfo (the
+    local zone if it has none). `weekdays` (Monday=0) limits it to those days.
+    """
+    lo, hi = _utc(start), _utc(end)
+    by_zone = {}
+    for t in at:
+        offset = ((t.hour * 60 + t.minute) * 60 + t.second) * 10**9 + t.microsecond * 1000
+        by_zone.setdefault(t.tzinfo or _local_zone(), []).append(offset)
+    grids = [_localize(_local_days(lo, hi, tz, weekdays), sorted(offsets), tz, lo, hi)
+             for tz, offsets in by_zone.items()]
+    if not grids:
+        return pd.DatetimeIndex([], tz='UTC')
+    return _finish(grids[0].append(grids[1:]) if len(grids) > 1 else grids[0])
+
+
+def _cron_value(value, lo, names):
+    if value.isdigit():
+        return int(value)
+    if names and value[:3] in names:
+        return names.index(value[:3]) + lo
+    raise ValueError(f'bad cron value {value!r}')
+
+
+def _cron_field(field, lo, hi, names=None):
+    """Sorted values a cron field allows, and whether it's a plain `*`."""
+    values = set()
+    for part in field.lower().split(','):
+        part, _, step = part.partition('/')
+        if part == '*':
+            a, b = lo, hi
+        else:
+            a, _, b = part.partition('-')
+            a = _cron_value(a, lo, names)
+            b = _cron_value(b, lo, names) if b else (hi if step else a)
+        if not (step or '1').isdigit() or int(step or 1) < 1:
+            raise ValueError(f'bad cron step in {field!r}')
+        values.update(range(a, b + 1, int(step or 1)))
+    if not values or min(values) < lo or max(values) > hi:
+        raise ValueError(f'cron field {field!r} should be within {lo}-{hi}')
+    return np.array(sorted(values)), field == '*'
+
+
+def cron_grid(start, end, spec, tz=None) -> pd.DatetimeIndex:
+    """
+    Times from start to end matching a five-field cron `spec` ("minute hour day-of-month month day-of-week",
+    with *, lists, ranges, steps and jan/mon names) on the wall clock in `tz`, the local zone by default.
+    Like cron, a restricted day-of-month and day-of-week match either one.
+    """
+    fields = spec.split()
+    if len(fields) != 5:
+        raise ValueError(f'a cron spec has 5 fields, {spec!r} has {len(fields)}')
+    minutes, _ = _cron_field(fields[0], 0, 59)
+    hours, _ = _cron_field(fields[1], 0, 23)
+    doms, any_dom = _cron_field(fields[2], 1, 31)
+    months, _ = _cron_field(fields[3], 1, 12, _MONTHS)
+    dows, any_dow = _cron_field(fields[4], 0, 7, _DAYS)
+    tz = tz or _local_zone()
+    lo, hi = _utc(start), _utc(end)
+    days = _local_days(lo, hi, tz)
+    dom_ok = np.isin(days.day, doms)
+    # cron has Sunday as 0 (and 7), pandas has Monday as 0
+    dow_ok = np.isin((days.dayofweek + 1) % 7, dows % 7)
+    day_ok = dom_ok & dow_ok if any_dom or any_dow else dom_ok | dow_ok
+    days = days[day_ok & np.isin(days.month, months)]
+    offsets = ((hours[:, None] * 60 + minutes[None, :]) * 60 * 10**9).ravel()
+    return _finish(_localize(days, offsets, tz, lo, hi))
+
+
+def rrule_grid(start, end, spec, tz=None) -> pd.DatetimeIndex:
+    """
+    Times from start to end out of an RFC 5545 recurrence rule ("FREQ=WEEKLY;BYDAY=MO,WE;BYHOUR=9"), read
+    on the wall clock in `tz`. Without a DTSTART in the spec the rule starts at midnight on the start day.
+    """
+    from dateutil.rrule import rrulestr
+    tz = tz or _local_zone()
+    lo, hi = _utc(start), _utc(end)
+    wall_lo = lo.tz_convert(tz).tz_localize(None).normalize().to_pydatetime()
+    wall_hi = hi.tz_convert(tz).tz_localize(None).to_pydatetime() + datetime.timedelta(days=1)
+    rule = rrulestr(spec, dtstart=None if 'DTSTART' in spec.upper() else wall_lo, ignoretz=True)
+    wall = pd.DatetimeIndex(rule.between(wall_lo, wall_hi, inc=True))
+    if not len(wall):
+        return pd.DatetimeIndex([], tz='UTC')
+    return _finish(_localize(wall, [0], tz, lo, hi))
+
+
+def schedule_grid(start, end, spec, tz=None) -> pd.DatetimeIndex:
+    """`rrule_grid` for specs with a FREQ= in them, `cron_grid` otherwise."""
+    if 'FREQ=' in spec.upper():
+        return rrule_grid(start, end, spec, tz)
+    return cron_grid(start, end, spec, tz)
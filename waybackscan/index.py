@@ -0,0 +1,183 @@
+"""
+On-disk index of capture times for answering "which capture of url X is closest to T" without the CDX api.
+
+An index is a directory of plain .npy arrays that get memory-mapped read-only, so opening one is instant,
+lookups only page in the bits of the file they touch, and any number of worker processes can share it
+through the OS page cache without copying it.
+
+    keys.npy   int64, url id << 34 | capture time in epoch seconds, sorted
+    rows.npy   int64, where each capture sits in `CDXCache.read(url)`
+    meta.json  url -> url id, plus how the index was built
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from .match import to_epoch_ns
+from .schema import parse_datetimes, _integers
+
+# Seconds take the low 34 bits (good until the year 2514), the url id the rest.
+TIME_BITS = 34
+_TIME_MASK = (1 << TIME_BITS) - 1
+INDEX_VERSION = 1
+
+
+def _datetimes(seconds):
+    # ns like the rest of the package, newer pandas would keep unit='s' as seconds
+    return pd.to_datetime(np.asarray(seconds, dtype='int64') * 10**9, utc=True)
+
+
+def _write(path, urls, keys, rows, **meta):
+    # Build next to the destination and swap it in, so readers never see half an index.
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.index-')
+    np.save(os.path.join(tmp, 'keys.npy'), keys)
+    np.save(os.path.join(tmp, 'rows.npy'), rows)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'urls': urls, 'built_at': time.time(), **meta}, f)
+    if os.path.exists(path):
+        old = tempfile.mkdtemp(dir=parent, prefix='.index-old-')
+        os.replace(path, os.path.join(old, 'index'))
+        os.replace(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.replace(tmp, path)
+
+
+def build_index(path, captures, filt=True):
+    """
+    Write an index for `captures`, a mapping of url -> CDX rows (or frames) in `CDXCache.read` order.
+    With `filt` only the 200s go in, but `rows` still counts every row so it lines up with the cache.
+    """
+    urls, keys, rows = {}, [], []
+    for url_id, (url, data) in enumerate(captures.items()):
+        if url_id >= 1 << (63 - TIME_BITS):
+            raise ValueError('too many urls for one index')
+        urls[url] = url_id
+        if isinstance(data, pd.DataFrame):
+            stamps, codes = data['timestamp'].to_numpy(), data['statuscode'].to_numpy()
+        else:
+            stamps = [row[1] for row in data]
+            codes = [row[4] for row in data]
+        seconds = to_epoch_ns(parse_datetimes(stamps)) // 10**9 if len(stamps) else np.zeros(0, dtype='int64')
+        if len(seconds) and (seconds.min() < 0 or seconds.max() > _TIME_MASK):
+            # Anything else would spill into the url id bits and end up filed under another url.
+            raise ValueError(f'{url} has captures from outside 1970..2514, which the index has no room for')
+        offsets = np.arange(len(seconds), dtype='int64')
+        if filt:
+            keep = _integers(codes, 'int64') == 200
+            seconds, offsets = seconds[keep], offsets[keep]
+        order = np.argsort(seconds, kind='stable')
+        keys.append((url_id << TIME_BITS) | seconds[order])
+        rows.append(offsets[order])
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype='int64')
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype='int64')
+    _write(path, urls, keys, rows, filt=filt)
+    return CaptureIndex(path)
+
+
+def build_index_from_cache(path, cache, urls=None, filt=True):
+    """Index every url in a `CDXCache` (or just `urls`), one url's rows in memory at a time."""
+    return build_index(path, _LazyCache(cache, urls if urls is not None else cache.urls()), filt=filt)
+
+
+class _LazyCache:
+    # Looks enough like a dict for build_index, without reading the whole cache up front.
+    def __init__(self, cache, urls):
+        self.cache = cache
+        self.urls = list(urls)
+
+    def items(self):
+        return ((url, self.cache.read(url)) for url in self.urls)
+
+
+class CaptureIndex:
+    """
+    Read-only, memory-mapped view of an index made by `build_index`. Pickles as just its path, so handing
+    one to a process pool has every worker map the same file rather than copying the arrays.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"{path} is a version {self.meta.get('version')} index, rebuild it")
+        self.urls = self.meta['urls']
+        self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(path, 'rows.npy'), mmap_mode='r')
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def captures(self, url):
+        """All the indexed capture times of a url, as a datetime index."""
+        url_id = self.urls[url]
+        lo, hi = np.searchsorted(self.keys, [url_id << TIME_BITS, (url_id + 1) << TIME_BITS])
+        return _datetimes(np.asarray(self.keys[lo:hi]) & _TIME_MASK)
+
+    def lookup(self, urls, times, direction='nearest') -> pd.DataFrame:
+        """
+        The capture of each urls[i] closest to times[i]: 'nearest' either side (a tie goes to the later
+        one), 'after' for at-or-after, 'before' for at-or-before. `urls` can also be a single url.
+
+        Returns a row per query with the target, the capture's datetime, its row in the cache and
+        lag_seconds (capture - target). Queries with nothing on that side, or for urls the index doesn't
+        have, get row -1 and NaN/NaT.
+        """
+        target = to_epoch_ns(times) // 10**9
+        if isinstance(urls, str):
+            ids = np.full(len(target), self.urls.get(urls, -1), dtype='int64')
+        else:
+            ids = np.array([self.urls.get(url, -1) for url in urls], dtype='int64')
+        if len(ids) != len(target):
+            raise ValueError('need one url per time')
+        known = ids >= 0
+        # Times outside what a key can hold search from the nearest end, without spilling into the url id.
+        key = (np.where(known, ids, 0) << TIME_BITS) | np.clip(target, 0, _TIME_MASK)
+        # One binary search over the whole file answers every query at once, whatever url it's for.
+        after = np.searchsorted(self.keys, key, side='left')
+        if direction == 'before':
+            after = np.searchsorted(self.keys, key, side='right')
+        pos_after = np.minimum(after, len(self.keys) - 1)
+        pos_before = np.maximum(after - 1, 0)
+        key_after = self.keys[pos_after] if len(self.keys) else np.zeros(len(key), dtype='int64')
+        key_before = self.keys[pos_before] if len(self.keys) else np.zeros(len(key), dtype='int64')
+        has_after = known & (after < len(self.keys)) & (key_after >> TIME_BITS == ids) & (target <= _TIME_MASK)
+        has_before = known & (after > 0) & (key_before >> TIME_BITS == ids) & (target >= 0)
+        if direction == 'after':
+            use_before = np.zeros(len(key), dtype=bool)
+        elif direction == 'before':
+            use_before = np.ones(len(key), dtype=bool)
+        elif direction == 'nearest':
+            use_before = has_before & (~has_after | (target - (key_before & _TIME_MASK) <
+                                                     (key_after & _TIME_MASK) - target))
+        else:
+            raise ValueError(f"direction should be 'nearest', 'after' or 'before', not {direction!r}")
+        found = np.where(use_before, has_before, has_after)
+        pos = np.where(use_before, pos_before, pos_after)
+        seconds = np.where(use_before, key_before, key_after) & _TIME_MASK
+        row = np.where(found, self.rows[pos] if len(self.rows) else -1, -1)
+        capture = _datetimes(np.where(found, seconds, 0))
+        return pd.DataFrame({
+            'url': urls,
+            'target': _datetimes(target),
+            'datetime': capture.where(found),
+            'row': row,
+            'lag_seconds': np.where(found, seconds - target, np.nan),
+        })
@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 import configparser
-import time
 from waybackscan.cdx import WaybackCDX
+from waybackscan.fetch import Journal, fetch_snapshots
+from waybackscan.store import SnapshotStore
 import datetime
-import pickle
 import os
-from tqdm import tqdm
+import sys
 import requests
 
 HERE = os.path.dirname(__file__)
@@ -13,47 +13,26 @@ config = configparser.ConfigParser()
 config.read(os.path.join(HERE, 'config.ini'))
 URL = "www.breitbart.com"
 PUBCODE = "breitbart"
+ROOT = config.get('GENERAL', 'Root', fallback='/home/coen/Public/Wayback')
 
-def get_request(timestamp, intervals):
-    try:
-        r = requests.get(f'https://web.archive.org/web/{timestamp}id_/https://{URL}')
-    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectTimeout):
-        time.sleep(60)
-        return get_request(timestamp, intervals)
-    except requests.exceptions.TooManyRedirects:
-        time.sleep(60)
-        new_timestamp_i = int(intervals.set_index('timestamp').index.get_loc(timestamp)) + 1
-        new_timestamp = intervals['timestamp'].iloc[new_timestamp_i]
-        return get_request(new_timestamp, intervals)
-    return r
-
-
+# Same as `waybackscan fetch -p breitbart -s 2015-01-01 -e yesterday -o ROOT --store ROOT/store`, which also
+# takes other publishers, intervals and worker counts. Old raw/ pickle trees go into the store with
+# `waybackscan store --store ROOT/store migrate ROOT/breitbart/raw -p breitbart`.
 if __name__ == '__main__':
     cdxer = WaybackCDX()
-    tqdm.write('Acquiring CDX data')
+    print('Acquiring CDX data', file=sys.stderr)
     yesterday = datetime.datetime.now() - datetime.timedelta(days=1)
     intervals = cdxer.get_intervals(URL, hrs=1, period_start=datetime.datetime(2015, 1, 1),
-                                    period_end=yesterday)
-
-    if not os.path.exists('/home/coen/Public/Wayback'):
-        os.mkdir('/home/coen/Public/Wayback')
-    if not os.path.exists(f'/home/coen/Public/Wayback/{PUBCODE}'):
-        os.mkdir(f'/home/coen/Public/Wayback/{PUBCODE}')
-    if not os.path.exists(f'/home/coen/Public/Wayback/{PUBCODE}/raw'):
-        os.mkdir(f'/home/coen/Public/Wayback/{PUBCODE}/raw')
-    if not os.path.exists(f'/home/coen/Public/Wayback/{PUBCODE}/articles'):
-        os.mkdir(f'/home/coen/Public/Wayback/{PUBCODE}/articles')
-    if not os.path.exists(f'/home/coen/Public/Wayback/{PUBCODE}/parsed'):
-        os.mkdir(f'/home/coen/Public/Wayback/{PUBCODE}/parsed')
+                                    period_end=yesterday, digests=True)
 
-    tqdm.write('Downloading data...')
+    for sub in ('articles', 'parsed'):
+        os.makedirs(f'{ROOT}/{PUBCODE}/{sub}', exist_ok=True)
 
-    for timestamp in tqdm(intervals['timestamp'][intervals['is_target']]):
-        if os.path.exists(f'/home/coen/Public/Wayback/{PUBCODE}/raw/{timestamp}.pkl'):
-            continue
-        r = get_request(timestamp, intervals)
-        html = r.text
-        with open(f'/home/coen/Public/Wayback/{PUBCODE}/raw/{timestamp}.pkl', 'wb') as f:
-            pickle.dump(html, f)
-    requests.post("http://ntfy.sh/soybison-manifolds", 
-            headers={"Tags": "newspaper"}, data=f"Publisher {pubcode} has been retrieved from the Internet Archive.")
+    print('Downloading data...', file=sys.stderr)
+    # Front pages often sit unchanged for hours, each distinct page is fetched and stored once under its digest.
+    # The journal remembers what's done, so a rerun only picks up what's left.
+    journal = Journal(f'{ROOT}/{PUBCODE}/journal.sqlite')
+    counts = fetch_snapshots(URL, intervals, SnapshotStore(f'{ROOT}/store'), journal)
+    requests.post("http://ntfy.sh/soybison-manifolds", headers={"Tags": "newspaper"},
+                  data=f"Publisher {PUBCODE} has been retrieved from the Internet Archive "
+                       f"({counts.get('failed', 0)} failed).")
@@ -0,0 +1,194 @@
+"""Matching reference times against capture times with sorted arrays instead of python loops."""
+import numpy as np
+import pandas as pd
+
+
+def to_epoch_ns(times):
+    """Int64 nanoseconds since the epoch (UTC). Naive datetimes are taken to be UTC, same as the CDX urls."""
+    if not isinstance(times, (pd.Series, pd.Index, np.ndarray, list, pd.api.extensions.ExtensionArray)):
+        times = list(times)
+    stamps = pd.DatetimeIndex(pd.to_datetime(times, utc=True)).tz_localize(None)
+    return np.asarray(stamps, dtype='datetime64[ns]').view('int64')
+
+
+def _sorted_captures(captures):
+    cap = to_epoch_ns(captures)
+    # CDX output is already in timestamp order, so most of the time we can skip the sort.
+    if len(cap) > 1 and not np.all(cap[1:] >= cap[:-1]):
+        order = np.argsort(cap, kind='stable')
+    else:
+        order = np.arange(len(cap))
+    return order, cap[order]
+
+
+def _matches(ref, order, sorted_cap, pos, found):
+    # pos indexes sorted_cap, found says which reference times got anything at all
+    position = np.full(len(ref), -1, dtype='int64')
+    position[found] = order[pos[found]]
+    matched_ns = np.full(len(ref), np.iinfo('int64').min, dtype='int64')
+    matched_ns[found] = sorted_cap[pos[found]]
+    lag = np.full(len(ref), np.nan)
+    lag[found] = (matched_ns[found] - ref[found]) / 1e9
+    return pd.DataFrame({
+        'target': pd.to_datetime(ref.view('datetime64[ns]'), utc=True),
+        'position': position,
+        'datetime': pd.to_datetime(matched_ns.view('datetime64[ns]'), utc=True),
+        'lag_seconds': lag,
+    })
+
+
+def match_at_or_after(captures: pd.Series, reference_times) -> pd.DataFrame:
+    """
+    For every reference time find the first capture not before it.
+
+    Returns one row per reference time with the positional index of the matched capture in `captures`
+    (-1 if there is none), its datetime, and how long after the reference time it was taken.
+    """
+    order, sorted_cap = _sorted_captures(captures)
+    ref = to_epoch_ns(reference_times)
+    pos = np.searchsorted(sorted_cap, ref, side='left')
+    return _matches(ref, order, sorted_cap, pos, pos < len(sorted_cap))
+
+
+def match_nearest(captures: pd.Series, reference_times) -> pd.DataFrame:
+    """Like `match_at_or_after` but the closest capture either side, lag_seconds is negative for earlier ones."""
+    order, sorted_cap = _sorted_captures(captures)
+    ref = to_epoch_ns(reference_times)
+    n = len(sorted_cap)
+    after = np.searchsorted(sorted_cap, ref, side='left')
+    if not n:
+        return _matches(ref, order, sorted_cap, after, np.zeros(len(ref), dtype=bool))
+    before = np.clip(after - 1, 0, n - 1)
+    after_c = np.clip(after, 0, n - 1)
+    # A tie goes to the later capture, same as everywhere else in here.
+    take_before = (after == n) | ((after > 0) & (ref - sorted_cap[before] < sorted_cap[after_c] - ref))
+    pos = np.where(take_before, before, after_c)
+    return _matches(ref, order, sorted_cap, pos, np.ones(len(ref), dtype=bool))
+
+
+def match_at_or_before(captures: pd.Series, reference_times) -> pd.DataFrame:
+    """Like `match_at_or_after` but the last capture not after each reference time, lag_seconds <= 0."""
+    order, sorted_cap = _sorted_captures(captures)
+    ref = to_epoch_ns(reference_times)
+    pos = np.searchsorted(sorted_cap, ref, side='right') - 1
+    return _matches(ref, order, sorted_cap, np.maximum(pos, 0), pos >= 0)
+
+
+def match_latest_in_bucket(captures: pd.Series, reference_times) -> pd.DataFrame:
+    """
+    The last capture from each reference time up to (not including) the next one, i.e. the page as it
+    stood at the end of that slot. The last reference time's slot is as long as the one before it.
+    """
+    order, sorted_cap = _sorted_captures(captures)
+    ref = to_epoch_ns(reference_times)
+    slots = np.unique(ref)
+    nxt = np.searchsorted(slots, ref, side='right')
+    last = slots[-1] + (slots[-1] - slots[-2]) if len(slots) > 1 else np.iinfo('int64').max
+    ends = np.where(nxt < len(slots), slots[np.minimum(nxt, len(slots) - 1)] if len(slots) else 0, last)
+    pos = np.searchsorted(sorted_cap, ends, side='left') - 1
+    found = pos >= 0
+    found[found] = sorted_cap[pos[found]] >= ref[found]
+    return _matches(ref, order, sorted_cap, np.maximum(pos, 0), found)
+
+
+POLICIES = {
+    'after': match_at_or_after,
+    'before': match_at_or_before,
+    'nearest': match_nearest,
+    'latest': match_latest_in_bucket,
+}
+
+
+def select_captures(captures: pd.Series, reference_times, policy='after', tolerance=None) -> pd.DataFrame:
+    """
+    Match reference times to captures with one of POLICIES (same output as the match_* functions).
+
+    `tolerance` (a timedelta, or seconds) is how far off a capture can be and still count. A reference time
+    with nothing inside it gets position -1 rather than whatever capture happens to be days away.
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"policy should be one of {', '.join(POLICIES)}, not {policy!r}")
+    matches = POLICIES[policy](captures, reference_times)
+    if tolerance is not None:
+        tol = tolerance.total_seconds() if hasattr(tolerance, 'total_seconds') else float(tolerance)
+        lag = matches['lag_seconds'].to_numpy()
+        miss = ~(np.abs(lag) <= tol)
+        if miss.any():
+            matches.loc[miss, 'position'] = -1
+            matches.loc[miss, 'datetime'] = pd.NaT
+            matches.loc[miss, 'lag_seconds'] = np.nan
+    return matches
+
+
+def mark_targets(df: pd.DataFrame, reference_times, column='datetime', policy='after',
+                 tolerance=None) -> pd.DataFrame:
+    """
+    Drop repeated timestamps and flag the captures matched by `reference_times` in an `is_target` column,
+    with `lag_seconds` (capture - reference time) next to it, NaN for everything that isn't a target.
+    See `select_captures` for `policy` and `tolerance`.
+    """
+    df = df.drop_duplicates(subset='timestamp', keep='first')
+    matches = select_captures(df[column], reference_times, policy, tolerance)
+    pos = matches['position'].to_numpy()
+    lag = matches['lag_seconds'].to_numpy()
+    ok = pos >= 0
+    is_target = np.zeros(len(df), dtype=bool)
+    is_target[pos[ok]] = True
+    # A capture picked by several reference times keeps the smallest lag, so write the biggest ones first.
+    by_lag = np.argsort(-np.abs(lag[ok]), kind='stable')
+    lags = np.full(len(df), np.nan)
+    lags[pos[ok][by_lag]] = lag[ok][by_lag]
+    # insert rather than setitem, the frame out of drop_duplicates can still look like a view to pandas
+    df.insert(len(df.columns), 'is_target', is_target)
+    df.insert(len(df.columns), 'lag_seconds', lags)
+    return df
+
+
+def target_captures(df: pd.DataFrame, reference_times, column='datetime', policy='after',
+                    tolerance=None) -> pd.DataFrame:
+    """
+    One row per reference time instead of per capture: the `target`, the capture picked for it, its
+    `lag_seconds`, and `matched`, which is False (with the capture columns empty) when nothing qualified.
+    """
+    df = df.drop_duplicates(subset='timestamp', keep='first')
+    matches = select_captures(df[column], reference_times, policy, tolerance)
+    ok = (matches['position'] >= 0).to_numpy()
+    found = df.iloc[matches['position'].to_numpy()[ok]]
+    found.index = np.flatnonzero(ok)
+    result = found.reindex(range(len(matches)))
+    for col in found.columns:
+        if found[col].dtype.kind in 'iu' and result[col].dtype != found[col].dtype:
+            # the gaps turned the integer columns to floats, nullable ints print the way they came in
+            result[col] = result[col].astype(str(found[col].dtype).replace('uint', 'UInt').replace('int', 'Int'))
+    result.insert(0, 'target', matches['target'])
+    result['lag_seconds'] = matches['lag_seconds']
+    result['matched'] = ok
+    return result
+
+
+def mark_digest_runs(df: pd.DataFrame, column='datetime') -> pd.DataFrame:
+    """
+    Tag captures whose content is byte-identical to an earlier one, going by the CDX digest.
+
+    `digest_run` numbers the runs of consecutive captures with the same digest, and `content_timestamp` is
+    the timestamp of the first capture with that digest, i.e. the one to download in place of this one.
+    Captures with no digest ('-') never share content with anything.
+    """
+    order, _ = _sorted_captures(df[column])
+    codes, uniques = pd.factorize(df['digest'].astype(str).to_numpy()[order])
+    missing = np.flatnonzero(np.asarray(uniques) == '-')
+    if len(missing):
+        lonely = codes == missing[0]
+        codes[lonely] = len(uniques) + np.arange(lonely.sum())
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = codes[1:] != codes[:-1]
+    _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+    timestamps = df['timestamp'].to_numpy()[order]
+    digest_run = np.empty(len(df), dtype='int64')
+    digest_run[order] = np.cumsum(new_run) - 1
+    content = np.empty(len(df), dtype=timestamps.dtype)
+    content[order] = timestamps[first[inverse.ravel()]]
+    df = df.copy()
+    df['digest_run'] = digest_run
+    df['content_timestamp'] = content
+    return df
@@ -0,0 +1,398 @@
+"""
+Append-only packfiles for downloaded pages, for when a directory with a file per capture gets too big to list,
+back up or seek around in.
+
+    data.pack            records back to back: a fixed header, the url, then the (zstd-compressed) page
+    index/entries.npy    one row per (url, timestamp), sorted: key (url id << 34 | epoch seconds, same as
+                         index.CaptureIndex), where the page sits in data.pack, how long it is, its digest
+    index/meta.json      url -> url id, the compression, and how much of data.pack the index covers
+
+Reading a page is a binary search in the memory-mapped index and a slice of the memory-mapped data, there's no
+open() per page. Captures with the same digest point at one record. A pack pickles as its path, so a process
+pool of parse workers all map the same files through the page cache instead of copying them.
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from .index import TIME_BITS, _TIME_MASK
+from .schema import wayback_seconds
+from .store import content_digest
+
+PACK_VERSION = 1
+# magic, kind (page or link), 14 digit timestamp, payload length, digest, url length
+HEADER = struct.Struct('<4sBQI32sH')
+MAGIC = b'WBPK'
+PAGE, LINK = 0, 1
+ENTRY = np.dtype([('key', '<i8'), ('offset', '<i8'), ('length', '<i8'), ('digest', 'S32')])
+
+
+def _stamp(seconds):
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(int(seconds)))
+
+
+def _walk(data, start, end):
+    """(offset, kind, url, timestamp, digest, payload offset, payload length) of every whole record in there."""
+    offset = start
+    while offset + HEADER.size <= end:
+        magic, kind, stamp, length, digest, url_len = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError(f'pack data is damaged at byte {offset}')
+        body = offset + HEADER.size + url_len
+        if body + length > end:
+            return
+        url = bytes(data[offset + HEADER.size:body]).decode('utf-8')
+        yield offset, kind, url, str(stamp), digest.rstrip(b'\0').decode(), body, length
+        offset = body + length
+
+
+def _codec(compression, level):
+    if compression == 'none':
+        return (lambda data: data), (lambda data: bytes(data))
+    if compression != 'zstd':
+        raise ValueError(f"compression should be 'zstd' or 'none', not {compression!r}")
+    from .store import _zstd
+    zstd = _zstd()
+    local = threading.local()
+
+    # zstd objects aren't thread safe, one of each per thread
+    def compress(data):
+        if getattr(local, 'c', None) is None:
+            local.c = zstd.ZstdCompressor(level=level)
+        return local.c.compress(data)
+
+    def decompress(data):
+        if getattr(local, 'd', None) is None:
+            local.d = zstd.ZstdDecompressor()
+        return local.d.decompress(data)
+    return compress, decompress
+
+
+class Pack:
+    """
+    A packfile at `path` (a directory, made if need be). New pages are appended and show up in the index on
+    `flush`, which also happens every `flush_every` puts and on `close`. If the process dies before that,
+    the next `Pack(path)` reads the unindexed tail back in, and cuts off a half-written last record.
+
+    Has the same put/get/exists/digest/link_many as `store.SnapshotStore`, so `fetch.fetch_snapshots` can
+    write straight into one.
+    """
+
+    def __init__(self, path, compression='zstd', level=10, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, 'index', 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+            if self.meta.get('version') != PACK_VERSION:
+                raise ValueError(f"{path} is a version {self.meta.get('version')} pack")
+        else:
+            self.meta = {'version': PACK_VERSION, 'urls': {}, 'compression': compression, 'size': 0}
+        self._compress, self._decompress = _codec(self.meta['compression'], level)
+        self._data_path = os.path.join(path, 'data.pack')
+        self._file = open(self._data_path, 'ab')
+        self._pending = {}
+        self._digests = None
+        self._map()
+        if os.path.getsize(self._data_path) > self.meta['size']:
+            self._recover()
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def _map(self):
+        entries = os.path.join(self.path, 'index', 'entries.npy')
+        self.entries = np.load(entries, mmap_mode='r') if os.path.exists(entries) else np.zeros(0, dtype=ENTRY)
+        self.keys = self.entries['key']
+        with open(self._data_path, 'rb') as f:
+            size = self.meta['size']
+            self.data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+
+    def _url_id(self, url, create=False):
+        url_id = self.meta['urls'].get(url)
+        if url_id is None and create:
+            url_id = self.meta['urls'][url] = len(self.meta['urls'])
+            if url_id >= 1 << (63 - TIME_BITS):
+                raise ValueError('too many urls for one pack')
+        return url_id
+
+    def _key(self, url, timestamp, create=False):
+        url_id = self._url_id(url, create)
+        return None if url_id is None else (url_id << TIME_BITS) | wayback_seconds(timestamp)
+
+    def _find(self, key):
+        """(offset, length, digest) of a key, from what's waiting to be flushed first."""
+        if key in self._pending:
+            return self._pending[key]
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            entry = self.entries[i]
+            return int(entry['offset']), int(entry['length']), entry['digest'].decode()
+        return None
+
+    def _by_digest(self):
+        # digest -> (offset, length), built the first time something is put
+        if self._digests is None:
+            self._digests = {d.decode(): (int(o), int(n)) for d, o, n in
+                             zip(self.entries['digest'], self.entries['offset'], self.entries['length'])}
+        return self._digests
+
+    # reading
+
+    def __len__(self):
+        pending = np.fromiter(self._pending, dtype='int64', count=len(self._pending))
+        return len(self.keys) + int((~np.isin(pending, self.keys)).sum())
+
+    def __contains__(self, key):
+        return self.exists(*key)
+
+    def exists(self, url, timestamp):
+        return self.digest(url, timestamp) is not None
+
+    def digest(self, url, timestamp):
+        with self._lock:
+            key = self._key(url, timestamp)
+            found = self._find(key) if key is not None else None
+        return found[2] if found else None
+
+    def _payload(self, offset, length):
+        if offset + length <= len(self.data):
+            return memoryview(self.data)[offset:offset + length]
+        # appended since the last flush, not in the map yet
+        with open(self._data_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def raw(self, url, timestamp):
+        """The stored (compressed) bytes of a capture as a slice of the map, nothing copied."""
+        with self._lock:
+            key = self._key(url, timestamp)
+            found = self._find(key) if key is not None else None
+        if found is None:
+            raise KeyError((url, str(timestamp)))
+        return self._payload(found[0], found[1])
+
+    def get(self, url, timestamp, raw=False):
+        """The html of a capture (bytes with `raw`), KeyError if it isn't in the pack."""
+        data = self._decompress(self.raw(url, timestamp))
+        return data if raw else data.decode('utf-8')
+
+    def urls(self):
+        return list(self.meta['urls'])
+
+    def timestamps(self, url):
+        url_id = self._url_id(url)
+        if url_id is None:
+            return []
+        lo, hi = np.searchsorted(self.keys, [url_id << TIME_BITS, (url_id + 1) << TIME_BITS])
+        return [_stamp(s) for s in np.asarray(self.keys[lo:hi]) & _TIME_MASK]
+
+    def items(self, url=None, raw=False):
+        """
+        (url, timestamp, html) for everything indexed, in url then time order, which after `compact` is also
+        the order it sits in on disk. A run of captures sharing a page only decompresses it once.
+        """
+        names = {v: k for k, v in self.meta['urls'].items()}
+        lo, hi = 0, len(self.keys)
+        if url is not None:
+            url_id = self._url_id(url)
+            if url_id is None:
+                return
+            lo, hi = np.searchsorted(self.keys, [url_id << TIME_BITS, (url_id + 1) << TIME_BITS])
+        last, page = None, None
+        for entry in self.entries[lo:hi]:
+            where = (int(entry['offset']), int(entry['length']))
+            if where != last:
+                page = self._decompress(self._payload(*where))
+                page = page if raw else page.decode('utf-8')
+                last = where
+            key = int(entry['key'])
+            yield names[key >> TIME_BITS], _stamp(key & _TIME_MASK), page
+
+    def records(self):
+        """
+        Walk data.pack front to back without the index: (url, timestamp, digest, payload) for every page
+        record, payload being the stored bytes as a slice of the map. Each distinct page comes up once.
+        """
+        for _, kind, url, stamp, digest, body, length in _walk(self.data, 0, len(self.data)):
+            if kind == PAGE:
+                yield url, stamp, digest, memoryview(self.data)[body:body + length]
+
+    # writing
+
+    def _append(self, kind, url, timestamp, digest, payload=b''):
+        """Write a record, returns where its payload starts. Flushed to the OS straight away so pread sees it."""
+        record = HEADER.pack(MAGIC, kind, int(str(timestamp).ljust(14, '0')), len(payload),
+                             digest.encode().ljust(32, b'\0'), len(url.encode('utf-8'))) + url.encode('utf-8')
+        offset = self._file.tell()
+        self._file.write(record + payload)
+        self._file.flush()
+        return offset + len(record)
+
+    def put(self, url, timestamp, html, digest=None):
+        """Append the page of a capture, returns its digest. A digest already in the pack isn't written again."""
+        data = html.encode('utf-8') if isinstance(html, str) else html
+        if not digest or digest == '-':
+            digest = content_digest(data)
+        compressed = None
+        with self._lock:
+            known = digest in self._by_digest()
+        if not known:
+            compressed = self._compress(data)
+        with self._lock:
+            key = self._key(url, timestamp, create=True)
+            where = self._by_digest().get(digest)
+            if where is None:
+                offset = self._append(PAGE, url, timestamp, digest, compressed)
+                where = self._digests[digest] = (offset, len(compressed))
+            else:
+                self._append(LINK, url, timestamp, digest)
+            self._pending[key] = (*where, digest)
+            self._maybe_flush()
+        return digest
+
+    def link_many(self, url, pairs):
+        """Say that captures (timestamp, digest) have the content of pages already in the pack."""
+        with self._lock:
+            for timestamp, digest in pairs:
+                where = self._by_digest().get(digest)
+                if where is None:
+                    raise KeyError(digest)
+                self._append(LINK, url, timestamp, digest)
+                self._pending[self._key(url, timestamp, create=True)] = (*where, digest)
+            self._maybe_flush()
+
+    def link(self, url, timestamp, digest):
+        self.link_many(url, [(timestamp, digest)])
+
+    def _maybe_flush(self):
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Merge what's been appended into the index and remap."""
+        with self._lock:
+            size = os.path.getsize(self._data_path)
+            if not self._pending and size == self.meta['size']:
+                return
+            new = np.array([(k, o, n, d.encode()) for k, (o, n, d) in self._pending.items()], dtype=ENTRY)
+            merged = np.concatenate([np.asarray(self.entries), new])
+            # stable, and newer entries come after, so the last of each key is the one to keep
+            merged = merged[np.argsort(merged['key'], kind='stable')]
+            keep = np.ones(len(merged), dtype=bool)
+            keep[:-1] = merged['key'][1:] != merged['key'][:-1]
+            self.meta['size'] = size
+            _write_index(self.path, merged[keep], self.meta)
+            self._pending = {}
+            self._map()
+
+    def _recover(self):
+        """Index whatever got appended after the last flush, and drop a record cut off halfway."""
+        size = os.path.getsize(self._data_path)
+        end = self.meta['size']
+        with open(self._data_path, 'rb') as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+            for offset, kind, url, stamp, digest, body, length in _walk(data, self.meta['size'], size):
+                if kind == PAGE:
+                    self._by_digest()[digest] = (body, length)
+                if digest in self._by_digest():
+                    self._pending[self._key(url, stamp, create=True)] = (*self._by_digest()[digest], digest)
+                end = body + length
+        if end < size:
+            self._file.truncate(end)
+            self._file.seek(end)
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        # not closed outright, slices handed out by `raw` may still be looking at it
+        self.data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self):
+        unique = len(np.unique(np.asarray(self.entries['offset']))) if len(self.entries) else 0
+        return {'urls': len(self.meta['urls']), 'captures': len(self), 'pages': unique,
+                'bytes': os.path.getsize(self._data_path), 'indexed_bytes': self.meta['size']}
+
+
+def _write_index(path, entries, meta):
+    # Build next to the old one and swap it in, so a reader never opens half an index.
+    tmp = tempfile.mkdtemp(dir=path, prefix='.index-')
+    np.save(os.path.join(tmp, 'entries.npy'), entries)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    _swap(tmp, os.path.join(path, 'index'))
+
+
+def _swap(new, dest):
+    if os.path.exists(dest):
+        old = tempfile.mkdtemp(dir=os.path.dirname(dest), prefix='.old-')
+        os.replace(dest, os.path.join(old, 'x'))
+        os.replace(new, dest)
+        shutil.rmtree(old)
+    else:
+        os.replace(new, dest)
+
+
+def compact(path, compression=None, level=10):
+    """
+    Rewrite a pack with only what its index points at, each page once, in url then time order, so a scan is
+    one sequential read. Old versions of re-put captures and half-written tails go away.
+    Readers that already have the pack open keep their old maps. Returns (bytes before, bytes after).
+    """
+    old = Pack(path)
+    old.flush()
+    before = os.path.getsize(old._data_path)
+    names = {v: k for k, v in old.meta['urls'].items()}
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.pack-')
+    recompress = compression is not None and compression != old.meta['compression']
+    new = Pack(tmp, compression=compression or old.meta['compression'], level=level, flush_every=1 << 62)
+    for entry in old.entries:
+        key = int(entry['key'])
+        url, stamp, digest = names[key >> TIME_BITS], _stamp(key & _TIME_MASK), entry['digest'].decode()
+        if digest in new._by_digest():
+            new.link(url, stamp, digest)
+            continue
+        stored = bytes(old._payload(int(entry['offset']), int(entry['length'])))
+        with new._lock:
+            payload = new._compress(old._decompress(stored)) if recompress else bytes(stored)
+            new_key = new._key(url, stamp, create=True)
+            offset = new._append(PAGE, url, stamp, digest, payload)
+            new._digests[digest] = (offset, len(payload))
+            new._pending[new_key] = (offset, len(payload), digest)
+    new.close()
+    old.close()
+    _swap(tmp, path)
+    return before, os.path.getsize(os.path.join(path, 'data.pack'))
+
+
+def pack_store(store, path, urls=None, **kwargs):
+    """Copy a `store.SnapshotStore` (or just `urls`) into a pack. Returns the pack, flushed."""
+    pack = Pack(path, **kwargs)
+    for url in urls if urls is not None else store.urls():
+        for timestamp in store.timestamps(url):
+            digest = store.digest(url, timestamp)
+            if digest in pack._by_digest():
+                pack.link(url, timestamp, digest)
+            else:
+                pack.put(url, timestamp, store.get_blob(digest, raw=True), digest)
+    pack.flush()
+    return pack
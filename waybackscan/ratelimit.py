@@ -0,0 +1,93 @@
+"""Per-host token bucket that speeds up while the archive is happy and backs off when it isn't."""
+import asyncio
+import threading
+import time
+
+# What the archive sends back when it wants us to slow down.
+THROTTLE_STATUSES = {429, 503}
+
+
+class _Bucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+
+class RateLimiter:
+    """
+    Token bucket per host with AIMD rate adaptation.
+
+    Every request takes a token, tokens refill at `rate` per second up to `burst`. A fast successful response
+    adds `increase` to the rate (up to `max_rate`), a throttle (429/503, a reset connection, a timeout)
+    multiplies it by `decrease` (down to `min_rate`) and honours any Retry-After. Safe to share between
+    threads, and `acquire_async` does the same thing without blocking an event loop. `clock` and `sleep` are
+    only there so tests can drive it without waiting.
+    """
+
+    def __init__(self, rate=2.0, burst=4, min_rate=0.1, max_rate=20.0, increase=0.1, decrease=0.5, slow=5.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.slow = slow
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.waited = 0.0
+        self.throttled = 0
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = _Bucket(self.rate, self.burst, self.clock())
+        return bucket
+
+    def _reserve(self, host):
+        """Take a token (going into debt if need be) and return how long to wait before using it."""
+        with self._lock:
+            bucket = self._bucket(host)
+            now = self.clock()
+            bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.last) * bucket.rate)
+            bucket.last = now
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+            self.waited += wait
+            return wait
+
+    def acquire(self, host):
+        wait = self._reserve(host)
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    async def acquire_async(self, host):
+        wait = self._reserve(host)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def success(self, host, elapsed):
+        with self._lock:
+            bucket = self._bucket(host)
+            if elapsed < self.slow:
+                bucket.rate = min(self.max_rate, bucket.rate + self.increase)
+
+    def throttle(self, host, retry_after=None):
+        with self._lock:
+            bucket = self._bucket(host)
+            bucket.rate = max(self.min_rate, bucket.rate * self.decrease)
+            self.throttled += 1
+            if retry_after:
+                # Push the bucket into debt so nobody goes again before the server said so.
+                bucket.tokens = min(bucket.tokens, -retry_after * bucket.rate)
+
+    def stats(self):
+        with self._lock:
+            return {'throttle_wait': self.waited, 'throttled': self.throttled,
+                    'rates': {host: bucket.rate for host, bucket in self._buckets.items()}}
@@ -0,0 +1,221 @@
+"""
+A stand-in for web.archive.org that answers CDX queries from captures held in memory.
+
+Pass a `ReplayTransport` as `transport=` to `WaybackCDX` (or anything else that takes one) and nothing goes
+over the network. The captures are either generated (`synthetic_rows`) or recorded from the real thing
+(`record`), and `latency`/`bandwidth` make responses take about as long as the real server would.
+"""
+import json
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+import requests
+
+from .match import to_epoch_ns
+from .schema import CDX_FIELDS, TIMESTAMP_COLUMN, WAYBACK_FORMAT, parse_datetimes
+
+
+def synthetic_rows(rows, start='2010-01-01', end='2022-01-01', url='www.nytimes.com', seed=0, run=6):
+    """
+    `rows` made up CDX rows for url, in timestamp order and spread at random over start..end.
+    Roughly 85% are 200s, and the digest only changes every `run` captures or so, like a real front page.
+    """
+    rng = np.random.default_rng(seed)
+    lo = pd.Timestamp(start, tz='UTC').value // 10**9
+    hi = pd.Timestamp(end, tz='UTC').value // 10**9
+    seconds = np.unique(rng.integers(lo, hi, rows))
+    while len(seconds) < rows:
+        seconds = np.unique(np.r_[seconds, rng.integers(lo, hi, rows - len(seconds))])
+    stamps = pd.to_datetime(seconds, unit='s').strftime(WAYBACK_FORMAT)
+    codes = rng.choice(np.array(['200'] * 17 + ['301', '404', '503'], dtype=object), rows)
+    changes = np.cumsum(rng.random(rows) < 1 / run)
+    digests = np.char.mod('%032X', changes)
+    lengths = rng.integers(1000, 200000, rows).astype(str)
+    host, _, path = url.partition('/')
+    host = host[len('www.'):] if host.startswith('www.') else host
+    urlkey = ','.join(reversed(host.split('.'))) + ')/' + path
+    table = np.empty((rows, len(CDX_FIELDS)), dtype=object)
+    table[:, 0] = urlkey
+    table[:, 1] = np.asarray(stamps, dtype=object)
+    table[:, 2] = f'https://{url}/'
+    table[:, 3] = 'text/html'
+    table[:, 4] = codes
+    table[:, 5] = digests.astype(object)
+    table[:, 6] = lengths.astype(object)
+    return table
+
+
+class _Response:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {'Content-Length': str(len(content))}
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} from replay', response=self)
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _Captures:
+    def __init__(self, rows):
+        table = np.asarray(rows, dtype=object).reshape(-1, len(CDX_FIELDS))
+        stamps = np.array([s.ljust(14, '0') for s in table[:, TIMESTAMP_COLUMN]], dtype='int64') \
+            if len(table) else np.zeros(0, dtype='int64')
+        if len(stamps) > 1 and not np.all(stamps[1:] >= stamps[:-1]):
+            order = np.argsort(stamps, kind='stable')
+            table, stamps = table[order], stamps[order]
+        self.table = table
+        self.stamps = stamps
+
+
+class ReplayTransport:
+    """
+    Drop-in for `Transport` that serves the CDX API (from/to, filter, collapse, closest, limit, fl and
+    resume keys) out of captures added with `add`. Queries for a url it doesn't know come back empty, and
+    filters are exact matches rather than the regexes the real server takes.
+
+    Every response waits `latency` seconds plus its size over `bandwidth` (bytes/s, None for instant).
+    Snapshot urls (`/web/<timestamp>id_/<url>`) get a small page that is the same for the same digest.
+    """
+
+    def __init__(self, captures=None, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._captures = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        for url, rows in (captures or {}).items():
+            self.add(url, rows)
+
+    def add(self, url, rows):
+        self._captures[url] = _Captures(rows)
+        return self
+
+    def load(self, url, path):
+        """Captures for url from a file of CDX json (what `record` writes, or a saved `output=json` response)."""
+        with open(path) as f:
+            data = json.load(f)
+        if data and data[0] != list(CDX_FIELDS):
+            raise ValueError(f'{path} needs all the CDX fields, in the usual order')
+        return self.add(url, data[1:])
+
+    def get(self, url, **kwargs):
+        start = time.perf_counter()
+        parsed = urlparse(url)
+        if parsed.path.startswith('/cdx/'):
+            content = self._cdx({k: v[0] for k, v in parse_qs(parsed.query).items()})
+        elif parsed.path.startswith('/web/'):
+            content = self._snapshot(parsed.path)
+        else:
+            content = b''
+        wait = self.latency + (len(content) / self.bandwidth if self.bandwidth else 0.0)
+        if wait:
+            time.sleep(wait)
+        with self._lock:
+            self.requests += 1
+            self.bytes += len(content)
+            self.seconds += time.perf_counter() - start
+        return _Response(content, 200 if content or parsed.path.startswith('/cdx/') else 404)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.requests, 'errors': 0, 'bytes': self.bytes, 'seconds': self.seconds}
+
+    def close(self):
+        pass
+
+    def _select(self, query):
+        captures = self._captures.get(query.get('url'))
+        if captures is None:
+            return np.empty((0, len(CDX_FIELDS)), dtype=object), np.zeros(0, dtype='int64')
+        lo = int(query['from'].ljust(14, '0')) if 'from' in query else None
+        hi = int(query['to'].ljust(14, '9')) if 'to' in query else None
+        a = np.searchsorted(captures.stamps, lo, side='left') if lo is not None else 0
+        b = np.searchsorted(captures.stamps, hi, side='right') if hi is not None else len(captures.stamps)
+        table, stamps = captures.table[a:b], captures.stamps[a:b]
+        if 'filter' in query:
+            field, value = query['filter'].split(':', 1)
+            negate = field.startswith('!')
+            keep = table[:, CDX_FIELDS.index(field.lstrip('!'))] == value
+            table, stamps = table[keep != negate], stamps[keep != negate]
+        if 'collapse' in query:
+            field, _, digits = query['collapse'].partition(':')
+            if field == 'timestamp' and digits:
+                key = stamps // 10 ** (14 - int(digits))
+            else:
+                key = table[:, CDX_FIELDS.index(field)]
+            keep = np.ones(len(key), dtype=bool)
+            keep[1:] = key[1:] != key[:-1]
+            table, stamps = table[keep], stamps[keep]
+        if 'closest' in query:
+            # by actual time apart, the 14 digit numbers aren't evenly spaced
+            seconds = to_epoch_ns(parse_datetimes(table[:, TIMESTAMP_COLUMN])) // 10**9
+            target = to_epoch_ns(parse_datetimes([query['closest']]))[0] // 10**9
+            order = np.argsort(np.abs(seconds - target), kind='stable')
+            table, stamps = table[order], stamps[order]
+        return table, stamps
+
+    def _cdx(self, query):
+        table, _ = self._select(query)
+        offset = int(query.get('resumeKey', 0) or 0)
+        limit = int(query['limit']) if 'limit' in query else None
+        if limit is not None and limit < 0:
+            table = table[limit:]
+            limit = None
+        page = table[offset:offset + limit] if limit is not None else table[offset:]
+        columns = list(CDX_FIELDS)
+        if 'fl' in query:
+            columns = query['fl'].split(',')
+            page = page[:, [CDX_FIELDS.index(c) for c in columns]]
+        if not len(page) and not offset:
+            return b'[]'
+        out = [columns] + page.tolist()
+        if query.get('showResumeKey') == 'true' and limit is not None and offset + limit < len(table):
+            out += [[], [str(offset + limit)]]
+        return json.dumps(out).encode()
+
+    def _snapshot(self, path):
+        stamp, _, original = path[len('/web/'):].partition('/')
+        stamp = stamp[:-len('id_')] if stamp.endswith('id_') else stamp
+        for url, captures in self._captures.items():
+            if original.split('://')[-1].rstrip('/') == url.rstrip('/'):
+                i = np.searchsorted(captures.stamps, int(stamp.ljust(14, '0')))
+                if i < len(captures.stamps):
+                    digest = captures.table[i, CDX_FIELDS.index('digest')]
+                    return f'<html><body><h1>{url}</h1><p>{digest}</p></body></html>'.encode()
+        return b''
+
+
+def record(url, path, period_start=None, period_end=None, transport=None):
+    """Download every capture of url from the real archive and save it where `ReplayTransport.load` can read it."""
+    from .cdx import WaybackCDX
+    cdxer = WaybackCDX(transport=transport)
+    _, rows = cdxer._records(url, period_start, period_end)
+    with open(path, 'w') as f:
+        json.dump([list(CDX_FIELDS)] + rows, f)
+    return len(rows)
@@ -0,0 +1,85 @@
+"""Typed columns for CDX frames, the server hands everything back as strings."""
+import calendar
+
+import numpy as np
+import pandas as pd
+
+WAYBACK_FORMAT = '%Y%m%d%H%M%S'
+CDX_FIELDS = ['urlkey', 'timestamp', 'original', 'mimetype', 'statuscode', 'digest', 'length']
+# Where the timestamp sits in a raw CDX row.
+TIMESTAMP_COLUMN = CDX_FIELDS.index('timestamp')
+
+# timestamp stays in wayback digits so it still prints (and sorts) like the url form, datetime is the real time.
+# pandas boxes fixed-width bytes back into python objects, so digest is categorical instead, which also means
+# runs of identical captures share one code.
+CDX_DTYPES = {
+    'urlkey': object,
+    'timestamp': 'int64',
+    'original': object,
+    'mimetype': 'category',
+    'statuscode': 'uint16',
+    'digest': 'category',
+    'length': 'int64',
+    'datetime': 'datetime64[ns, UTC]',
+}
+
+
+def _integers(values, dtype):
+    # CDX uses '-' for "not recorded" (revisits, warc records without a status), those become 0.
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'iu':
+        return values.astype(dtype)
+    strings = np.asarray(values, dtype=str)
+    if not len(strings):
+        return np.zeros(0, dtype=dtype)
+    strings[~np.char.isdigit(strings)] = '0'
+    return strings.astype('int64').astype(dtype)
+
+
+def _categorical(values):
+    # factorize keeps first-seen order and skips the sort pd.Categorical would do
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def wayback_seconds(stamp):
+    """Epoch seconds of a single wayback stamp, a short one meaning the start of whatever it stops at."""
+    t = str(stamp).ljust(14, '0')
+    return calendar.timegm((int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:10]), int(t[10:12]), int(t[12:14])))
+
+
+def parse_datetimes(timestamps):
+    """Vectorized wayback timestamps (strings or digits) -> datetime64[ns, UTC] array."""
+    ts = _integers(timestamps, 'int64')
+    if len(ts) and ts.min() < 10**13:
+        # Truncated timestamps mean the start of whatever they stop at, e.g. 2020 is 20200101000000.
+        ts = _integers([str(s) + '00000101000000'[len(str(s)):] for s in timestamps], 'int64')
+    # Split the digits up and do the calendar arithmetic in numpy, strptime is the slow part otherwise.
+    months = (ts // 10**10 - 1970) * 12 + ts // 10**8 % 100 - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (ts // 10**6 % 100 - 1)
+    seconds = ts // 10**4 % 100 * 3600 + ts // 100 % 100 * 60 + ts % 100
+    stamps = days.astype('datetime64[ns]') + seconds.astype('timedelta64[s]')
+    return pd.DatetimeIndex(stamps).tz_localize('UTC').array
+
+
+def cdx_frame(rows, columns, filt=True) -> pd.DataFrame:
+    """Build a typed frame out of the row lists the CDX api returns. `filt` drops anything that isn't a 200."""
+    cols = list(zip(*rows)) if rows else [()] * len(columns)
+    data = {}
+    for name, values in zip(columns, cols):
+        dtype = CDX_DTYPES.get(name, object)
+        if dtype in ('int64', 'uint16'):
+            data[name] = _integers(values, dtype)
+        elif dtype == 'category':
+            data[name] = _categorical(values)
+        else:
+            data[name] = np.array(values, dtype=object)
+    if 'timestamp' in data:
+        data['datetime'] = parse_datetimes(cols[list(columns).index('timestamp')])
+    df = pd.DataFrame(data)
+    if filt and 'statuscode' in df:
+        df = df[df['statuscode'] == 200]
+    return df
+
+
+def empty_cdx_frame(columns=CDX_FIELDS) -> pd.DataFrame:
+    return cdx_frame([], columns, filt=False)
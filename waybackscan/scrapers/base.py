@@ -1,25 +1,30 @@
 import json
 import pickle
-import random
 import re
 import requests
-import waybackpy
 
 import datetime as dt
+import pandas as pd
 
 from bs4 import BeautifulSoup
-from collections import OrderedDict
-from time import sleep
+from collections import OrderedDict, namedtuple
 from urllib.parse import urljoin, urlparse
 from waybackpy.exceptions import WaybackError
+from waybackscan.cdx import WaybackCDX
+from waybackscan.transport import default_transport
 
+# Same two fields waybackpy's near() used to hand back, so the scrapers didn't have to change.
+Archive = namedtuple('Archive', ['archive_url', 'timestamp'])
 
 
 class PublisherScraper:
 
-    def __init__(self, verbose = False):
+    def __init__(self, verbose = False, transport = None):
         self.user_agent = "Mozilla/5.0 (Windows NT 5.1; rv:40.0) Gecko/20100101 Firefox/40.0"
         self.verbose = verbose
+        # Share the pooled session with everything else instead of waybackpy opening its own connections.
+        self.transport = transport if transport is not None else default_transport()
+        self.cdx = WaybackCDX(transport=self.transport)
 
     @property
     def front_page_url(self):
@@ -58,40 +63,43 @@ class PublisherScraper:
 
         return href_url
 
-    def get_wayback_url(
-        self, url, timestamp,
-        max_retries = 10, max_backoff = 32, # seconds
-        date_retry=0
-    ):
-        wb = waybackpy.Url(url, self.user_agent)
-
+    def find_archive(self, url, timestamp, max_retries = 10):
+        """Return the Archive of the capture of url nearest to timestamp, None if there isn't one"""
+        # Pacing and backoff happen in the transport's rate limiter, this just decides when to give up.
         num_retries = 1
         while True:
             try:
-                archive_near = wb.near(unix_timestamp = timestamp.timestamp())
+                closest = self.cdx.get_closest_many(url, [timestamp], max_retries=0).iloc[0]
                 break
-            except WaybackError as e:
+            except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
                 print(
                     'Failed retry %d / %d with timestamp' % (num_retries, max_retries),
                     timestamp,
                     timestamp.timestamp()
                 )
                 if num_retries < max_retries:
-                    # print(e)
-                    random_number_milliseconds = random.random()
-                    wait_time = min(
-                        (2 ** num_retries) + random_number_milliseconds,
-                        max_backoff
-                    )
-                    print('Waiting %d seconds...' % wait_time)
-                    sleep(wait_time)
                     num_retries += 1
                 else:
-                    print(f'Could Not Find article {url}. ERR01')
-                    return None, None
+                    raise WaybackError(f'Could not reach the archive for {url}') from e
+
+        if pd.isna(closest['datetime']):
+            return None
+        return Archive(
+            f"https://web.archive.org/web/{closest['timestamp']}/{closest['original']}",
+            closest['datetime'].to_pydatetime()
+        )
 
+    def get_wayback_url(self, url, timestamp, max_retries=10):
         try:
-            front_page = requests.get(archive_near.archive_url).text
+            archive_near = self.find_archive(url, timestamp, max_retries)
+        except WaybackError:
+            archive_near = None
+        if archive_near is None:
+            print(f'Could Not Find article {url}. ERR01')
+            return None, None
+
+        try:
+            front_page = self.transport.get(archive_near.archive_url, headers={'User-Agent': self.user_agent}).text
 
         except UnicodeDecodeError:  # Our web parser throws this if the wayback machine doesn't have that webpage.
             return None, None
@@ -116,6 +124,43 @@ class PublisherScraper:
         if self.verbose:
             print('Frontpage Archive url:', front_archive.archive_url)
 
+        return self.extract_page(front_page, front_archive.timestamp)
+
+    def front_pages(self, warcs):
+        """Yield (datetime, html) for every capture of the front page in some WARC files, read straight off disk"""
+        from waybackscan import warc
+        key = warc.surt(self.front_page_url)
+        # Where each page was first seen, for the revisits that repeat it later on. The page itself if it was
+        # in a file with no offsets to go back to.
+        pages = {}
+        for path in warc.warc_paths(warcs):
+            for record in warc.iter_records(path, types=('response', 'revisit')):
+                if record.type not in ('response', 'revisit') or not record.uri or warc.surt(record.uri) != key:
+                    continue
+                digest = record.headers.get('WARC-Payload-Digest', '')
+                if record.type == 'revisit':
+                    if digest not in pages:
+                        continue
+                    where = pages[digest]
+                    payload = where if isinstance(where, bytes) else warc.read_record(*where).payload
+                elif record.status != 200:
+                    continue
+                else:
+                    pages.setdefault(digest, (path, record.offset) if record.offset is not None else record.payload)
+                    payload = record.payload
+                timestamp = dt.datetime.strptime(record.timestamp, '%Y%m%d%H%M%S').replace(tzinfo=dt.timezone.utc)
+                yield timestamp, payload.decode('utf-8', errors='replace')
+
+    def extract_warc(self, warcs):
+        """
+        Yield (datetime, articles) for every front page in some WARC files. Articles still come through
+        self.transport, so build the scraper with transport=WarcTransport(warcs) to stay off the network.
+        """
+        for timestamp, front_page in self.front_pages(warcs):
+            yield timestamp, self.extract_page(front_page, timestamp)
+
+    def extract_page(self, front_page, timestamp):
+        """Return the top articles of a front page we already have, scraped as of timestamp"""
         articles = self.get_top_article_metadata(front_page)
         a = 0
 
@@ -125,7 +170,7 @@ class PublisherScraper:
 
             article_scrape = self.scrape_article(
                 article_url,
-                front_archive.timestamp
+                timestamp
             )
             if article_scrape is None:
                 continue
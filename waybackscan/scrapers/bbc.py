@@ -7,8 +7,8 @@ from .utils import has_substr
 
 class BBCScraper(PublisherScraper):
 
-    def __init__(self, verbose = False):
-        super().__init__(verbose)
+    def __init__(self, verbose = False, transport = None):
+        super().__init__(verbose, transport)
 
     @property
     def front_page_url(self):
@@ -4,8 +4,8 @@ from collections import OrderedDict
 
 class BreitbartScraper(PublisherScraper):
 
-    def __init__(self, verbose = False):
-        super().__init__(verbose)
+    def __init__(self, verbose = False, transport = None):
+        super().__init__(verbose, transport)
 
     @property
     def front_page_url(self):
@@ -3,7 +3,6 @@ CNN scraper is in a weird case because it has to be actually loaded by a web bro
 We will use a (by default) headless selenium for this, so it may be a RAM-eater, but headless firefox
 has some clever tricks that prevent if from getting too out of hand.
 """
-import waybackpy
 from waybackpy.exceptions import WaybackError
 from base import PublisherScraper
 from bs4 import BeautifulSoup
@@ -13,14 +12,13 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.common.exceptions import WebDriverException
 from collections import OrderedDict
-import random
-from time import sleep
 import datetime
+from urllib.parse import urlparse
 
 class CNNScraper(PublisherScraper):
 
-    def __init__(self, verbose=False, headless=True):
-        super(CNNScraper, self).__init__(verbose)
+    def __init__(self, verbose=False, headless=True, transport=None):
+        super(CNNScraper, self).__init__(verbose, transport)
         self.headless = headless
 
     @property
@@ -128,7 +126,8 @@ class CNNScraper(PublisherScraper):
                     return None
                 if self.verbose:
                     print("Didn't find any text, reloading the page...")
-                sleep(5 + random.random())
+                # Probably a half loaded page, slow down before asking for it again.
+                self.transport.limiter.throttle(urlparse(url).netloc)
                 return self.scrape_article(url, timestamp, retry=retry+1, max_retry=max_retry)
             if self.verbose:
                 print("Headline: " + headline)
@@ -155,12 +154,15 @@ class CNNScraper(PublisherScraper):
             foxoptions.headless = True
 
         seldriver = webdriver.Firefox(options=foxoptions)
+        # Selenium doesn't go through the transport, but it should still wait its turn with the archive.
+        host = urlparse(url).netloc
         while True:
+            self.transport.limiter.acquire(host)
             try:
                 seldriver.get(url)
                 break
             except WebDriverException:
-                sleep(32)
+                self.transport.limiter.throttle(host)
         wait = WebDriverWait(seldriver, 60)  # Boosting this again since I had a timeout that didn't reproduce.
         # This is a terrible solution, but the selenium driver needs to behave differently on articles
         # and the front page...
@@ -176,9 +178,7 @@ class CNNScraper(PublisherScraper):
 
     # We have to overload the get_wayback_url() function because CNN has some crazy long-loading BS that means that
     # simple requests just return a blank page.
-    def get_wayback_url(self, url, timestamp,
-                        max_retries=10, max_backoff=32, date_retry=0 # seconds
-                        ):
+    def get_wayback_url(self, url, timestamp, max_retries=10):
 
         # I'm trying out something to reduce the load on Archive.org by scraping CNN's archived version of the
         # article first.
@@ -186,31 +186,9 @@ class CNNScraper(PublisherScraper):
             return self.get_page(url), None
 
         # First part is yanked directly from Jared's base code.
-        wb = waybackpy.Url(url, self.user_agent)
-
-        num_retries = 1
-        while True:
-            try:
-                archive_near = wb.near(unix_timestamp=timestamp.timestamp())
-                break
-            except WaybackError as e:
-                print(
-                    'Failed retry %d / %d with timestamp' % (num_retries, max_retries),
-                    timestamp,
-                    timestamp.timestamp()
-                )
-                if num_retries < max_retries:
-                    # print(e)
-                    random_number_milliseconds = random.random()
-                    wait_time = min(
-                        (2 ** num_retries) + random_number_milliseconds,
-                        max_backoff
-                    )
-                    print('Waiting %d seconds...' % wait_time)
-                    sleep(wait_time)
-                    num_retries += 1
-                else:
-                    raise e
+        archive_near = self.find_archive(url, timestamp, max_retries)
+        if archive_near is None:
+            raise WaybackError(f'No captures of {url}')
 
         # Okay, now instead of relying on waybackpy's api, we're going to open up a selenium window.
         # Normally best practice is to boot up the driver in the __init__ function, but I think since we
@@ -237,7 +215,6 @@ if __name__ == '__main__':
     # %%
 
     init_scrape_hour = 18
-    respect = 30
     est_timezone = pytz.timezone("US/Eastern")
 
     start_idx = 10
@@ -252,5 +229,4 @@ if __name__ == '__main__':
 
         publisher = scraper.front_page_url
         article_dataset[publisher][date] = articles
-        print(f"Day {idx} successfully scraped, waiting {respect} (-ish) seconds before continuing...")
-        sleep(respect - 3 + random.random()*6)
\ No newline at end of file
+        print(f"Day {idx} successfully scraped.")
\ No newline at end of file
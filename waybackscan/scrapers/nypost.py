@@ -6,8 +6,8 @@ from waybackpy.exceptions import WaybackError
 
 class NYPostScraper(PublisherScraper):
 
-    def __init__(self, verbose = False):
-        super().__init__(verbose)
+    def __init__(self, verbose = False, transport = None):
+        super().__init__(verbose, transport)
 
     @property
     def front_page_url(self):
@@ -0,0 +1,319 @@
+"""
+Content-addressed store for downloaded pages: each distinct page is kept once, zstd-compressed, under its digest.
+
+    ROOT/index.sqlite             which (url, timestamp) has which digest, and what's stored per digest
+    ROOT/blobs/AB/ABCDEF....zst   the page as zstd-compressed UTF-8
+    ROOT/dicts/<dict id>.zdict    zstd dictionaries trained on one url's pages, each from some date on
+
+Digests are the CDX ones (base32 SHA-1) when we know them, so every capture the archive says is identical ends
+up as one blob. Anything looked up goes through the index, never a probe of the blob directory.
+
+Captures of one front page share most of their markup (nav, css, scripts), which compressing each page on its own
+can't make use of. `train_dictionary` learns that from a sample of a url's stored pages, and new pages of that url
+from then on are compressed against it. A layout change is a new era: train another dictionary starting there.
+"""
+import base64
+import glob
+import hashlib
+import bisect
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('the snapshot store needs zstandard, `pip install waybackscan[store]`') from e
+    return zstandard
+
+
+def default_store_path():
+    root = os.environ.get('XDG_DATA_HOME', os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(root, 'waybackscan', 'snapshots')
+
+
+def content_digest(data):
+    """The CDX-style digest (base32 of the SHA-1) of a page, for when the archive didn't give us one."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return base64.b32encode(hashlib.sha1(data).digest()).decode()
+
+
+# zstd's advice is around 100KB of dictionary, trained on about a hundred times that.
+DICT_SIZE = 112640
+DICT_SAMPLES = 1000
+
+
+class SnapshotStore:
+    """
+    Pages by (url, timestamp) on top of blobs by digest. `root` defaults to ~/.local/share/waybackscan/snapshots,
+    `level` is the zstd level new blobs get. Safe to share between threads; compression happens outside the
+    index lock, so a pool of downloaders can all be writing at once.
+    """
+
+    def __init__(self, root=None, level=10):
+        self.root = root or default_store_path()
+        self.level = level
+        self._zstd = _zstd()
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'dicts'), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), check_same_thread=False)
+        with self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY, size INTEGER, stored INTEGER, added_at REAL, dict_id INTEGER) WITHOUT ROWID''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS captures (
+                url TEXT NOT NULL, timestamp TEXT NOT NULL, digest TEXT NOT NULL,
+                PRIMARY KEY (url, timestamp)) WITHOUT ROWID''')
+            # dict_id is zstd's own, which every frame compressed with it carries in its header
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS dictionaries (
+                dict_id INTEGER PRIMARY KEY, url TEXT NOT NULL, since TEXT NOT NULL, size INTEGER, samples INTEGER,
+                added_at REAL)''')
+            if 'dict_id' not in [row[1] for row in self._conn.execute('PRAGMA table_info(blobs)')]:
+                self._conn.execute('ALTER TABLE blobs ADD COLUMN dict_id INTEGER')
+            # url -> sorted [(since, dict_id)], so picking one for a new page doesn't need a query
+            self._eras = {}
+            for dict_id, url, since in self._conn.execute('SELECT dict_id, url, since FROM dictionaries'):
+                bisect.insort(self._eras.setdefault(url, []), (since, dict_id))
+        self._dicts = {}
+
+    def _dict(self, dict_id):
+        if dict_id not in self._dicts:
+            with open(os.path.join(self.root, 'dicts', f'{dict_id}.zdict'), 'rb') as f:
+                self._dicts[dict_id] = self._zstd.ZstdCompressionDict(f.read())
+        return self._dicts[dict_id]
+
+    # zstd (de)compressor objects aren't thread safe, one of each (per dictionary) per thread.
+    def _compressor(self, dict_id=None):
+        compressors = self._local.__dict__.setdefault('compressors', {})
+        if dict_id not in compressors:
+            compressors[dict_id] = self._zstd.ZstdCompressor(
+                level=self.level, dict_data=self._dict(dict_id) if dict_id else None)
+        return compressors[dict_id]
+
+    def _decompressor(self, dict_id=None):
+        decompressors = self._local.__dict__.setdefault('decompressors', {})
+        if dict_id not in decompressors:
+            decompressors[dict_id] = self._zstd.ZstdDecompressor(dict_data=self._dict(dict_id) if dict_id else None)
+        return decompressors[dict_id]
+
+    def dictionary_for(self, url, timestamp):
+        """The id of the dictionary for url's era at timestamp, None if it hasn't got one."""
+        with self._lock:
+            eras = self._eras.get(url)
+        if not eras:
+            return None
+        i = bisect.bisect_right(eras, (str(timestamp), float('inf'))) - 1
+        return eras[i][1] if i >= 0 else None
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], f'{digest}.zst')
+
+    def has_blob(self, digest):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone() is not None
+
+    def digest(self, url, timestamp):
+        """The digest stored for a capture, None if we don't have it."""
+        with self._lock:
+            row = self._conn.execute('SELECT digest FROM captures WHERE url = ? AND timestamp = ?',
+                                     (url, str(timestamp))).fetchone()
+        return row[0] if row else None
+
+    def exists(self, url, timestamp):
+        return self.digest(url, timestamp) is not None
+
+    def __contains__(self, key):
+        return self.exists(*key)
+
+    def put_blob(self, html, digest=None, dict_id=None):
+        """Store a page under `digest` (its content digest if None or '-') unless it's there already."""
+        data = html.encode('utf-8') if isinstance(html, str) else html
+        if not digest or digest == '-':
+            digest = content_digest(data)
+        if self.has_blob(digest):
+            return digest
+        compressed = self._compressor(dict_id).compress(data)
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique part file per thread, two workers can race to store the same page.
+        part = f'{path}.{threading.get_ident()}.part'
+        with open(part, 'wb') as f:
+            f.write(compressed)
+        os.replace(part, path)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?)',
+                               (digest, len(data), len(compressed), time.time(), dict_id))
+        return digest
+
+    def link(self, url, timestamp, digest):
+        """Say that a capture has the content of an already stored blob."""
+        self.link_many(url, [(timestamp, digest)])
+
+    def link_many(self, url, pairs):
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO captures VALUES (?, ?, ?)',
+                                   ((url, str(ts), digest) for ts, digest in pairs))
+
+    def put(self, url, timestamp, html, digest=None):
+        """Store the page of a capture, returns its digest. A page already stored under `digest` isn't written again."""
+        digest = self.put_blob(html, digest, self.dictionary_for(url, timestamp))
+        self.link(url, timestamp, digest)
+        return digest
+
+    def get_blob(self, digest, raw=False):
+        with open(self.blob_path(digest), 'rb') as f:
+            compressed = f.read()
+        # the frame says which dictionary it needs (0 for none), so there's nothing to look up
+        dict_id = self._zstd.get_frame_parameters(compressed).dict_id
+        data = self._decompressor(dict_id or None).decompress(compressed)
+        return data if raw else data.decode('utf-8')
+
+    def get(self, url, timestamp, raw=False):
+        """The html of a capture (bytes with `raw`), KeyError if it isn't stored."""
+        digest = self.digest(url, timestamp)
+        if digest is None:
+            raise KeyError((url, str(timestamp)))
+        return self.get_blob(digest, raw=raw)
+
+    def urls(self):
+        with self._lock:
+            return [url for url, in self._conn.execute('SELECT DISTINCT url FROM captures ORDER BY url')]
+
+    def timestamps(self, url):
+        with self._lock:
+            return [ts for ts, in self._conn.execute(
+                'SELECT timestamp FROM captures WHERE url = ? ORDER BY timestamp', (url,))]
+
+    def train_dictionary(self, url, since=None, until=None, samples=DICT_SAMPLES, size=DICT_SIZE):
+        """
+        Train a zstd dictionary on up to `samples` of url's distinct stored pages from since up to until (14 digit
+        timestamps, None for open ended) and compress url's pages from `since` on with it, until the next era.
+        Pages already stored keep what they have until `recompress`. Returns the dictionary's id.
+        """
+        since, until = str(since or ''), str(until or '')
+        query = 'SELECT DISTINCT digest FROM captures WHERE url = ? AND timestamp >= ?'
+        params = (url, since)
+        if until:
+            query += ' AND timestamp < ?'
+            params += (until,)
+        with self._lock:
+            digests = sorted(digest for digest, in self._conn.execute(query, params))
+        # a fixed seed, so training the same era again picks the same pages
+        digests = random.Random(0).sample(digests, min(samples, len(digests)))
+        if len(digests) < 10:
+            raise ValueError(f'{len(digests)} distinct pages of {url} stored for that era, too few to train on')
+        pages = [self.get_blob(digest, raw=True) for digest in digests]
+        trained = self._zstd.train_dictionary(size, pages, level=self.level)
+        dict_id = trained.dict_id()
+        path = os.path.join(self.root, 'dicts', f'{dict_id}.zdict')
+        with open(path + '.part', 'wb') as f:
+            f.write(trained.as_bytes())
+        os.replace(path + '.part', path)
+        with self._lock, self._conn:
+            # the era's old dictionary stays on disk for the blobs compressed with it, but isn't picked any more
+            self._conn.execute('DELETE FROM dictionaries WHERE url = ? AND since = ?', (url, since))
+            self._conn.execute('INSERT OR REPLACE INTO dictionaries VALUES (?, ?, ?, ?, ?, ?)',
+                               (dict_id, url, since, len(trained.as_bytes()), len(pages), time.time()))
+            eras = [era for era in self._eras.get(url, []) if era[0] != since]
+            bisect.insort(eras, (since, dict_id))
+            self._eras[url] = eras
+        return dict_id
+
+    def dictionaries(self, url=None):
+        """(dict_id, url, since, size, samples) of the dictionaries, by url and era."""
+        query = 'SELECT dict_id, url, since, size, samples FROM dictionaries'
+        with self._lock:
+            return self._conn.execute(query + (' WHERE url = ?' if url else '') + ' ORDER BY url, since',
+                                      (url,) if url else ()).fetchall()
+
+    def recompress(self, url, on_progress=None):
+        """
+        Compress url's stored pages again with the dictionary of their era (a page stored for several captures goes
+        by its first one). Returns the bytes stored (before, after) for the pages that changed.
+        """
+        with self._lock:
+            rows = self._conn.execute('''SELECT c.digest, MIN(c.timestamp), b.dict_id FROM captures c
+                JOIN blobs b ON b.digest = c.digest WHERE c.url = ? GROUP BY c.digest''', (url,)).fetchall()
+        before = after = 0
+        for digest, timestamp, current in rows:
+            dict_id = self.dictionary_for(url, timestamp)
+            if dict_id == current:
+                continue
+            path = self.blob_path(digest)
+            before += os.path.getsize(path)
+            data = self.get_blob(digest, raw=True)
+            compressed = self._compressor(dict_id).compress(data)
+            part = f'{path}.{threading.get_ident()}.part'
+            with open(part, 'wb') as f:
+                f.write(compressed)
+            os.replace(part, path)
+            after += len(compressed)
+            with self._lock, self._conn:
+                self._conn.execute('UPDATE blobs SET stored = ?, dict_id = ? WHERE digest = ?',
+                                   (len(compressed), dict_id, digest))
+            if on_progress is not None:
+                on_progress(before, after)
+        return before, after
+
+    def stats(self):
+        with self._lock:
+            blobs, size, stored = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored), 0) FROM blobs').fetchone()
+            captures, urls = self._conn.execute('SELECT COUNT(*), COUNT(DISTINCT url) FROM captures').fetchone()
+            dictionaries, = self._conn.execute('SELECT COUNT(*) FROM dictionaries').fetchone()
+        return {'urls': urls, 'captures': captures, 'blobs': blobs, 'bytes': size, 'stored_bytes': stored,
+                'ratio': size / stored if stored else None, 'dictionaries': dictionaries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def migrate_pickles(raw, store, url, digests=None, delete=False, on_progress=None):
+    """
+    Move a `raw/` tree of `<timestamp>.pkl` pickled html (what main.py and `fetch` wrote) into `store`.
+
+    `digests` maps timestamps to CDX digests (e.g. from the CDX cache), anything not in it is keyed by its
+    content digest. Symlinked timestamps become links to the blob of the file they point at, without
+    reading anything. Only run this on trees you made yourself, it unpickles them.
+    With `delete` every file is removed once its content is in the store. Returns (pages, links) migrated.
+    """
+    digests = {str(k): v for k, v in (digests or {}).items()}
+    paths = sorted(glob.glob(os.path.join(raw, '*.pkl')))
+    pages, links = 0, []
+    by_name = {}
+    for path in paths:
+        if os.path.islink(path):
+            continue
+        timestamp = os.path.basename(path)[:-len('.pkl')]
+        if store.exists(url, timestamp):
+            by_name[os.path.basename(path)] = store.digest(url, timestamp)
+        else:
+            with open(path, 'rb') as f:
+                html = pickle.load(f)
+            by_name[os.path.basename(path)] = store.put(url, timestamp, html, digests.get(timestamp))
+            pages += 1
+        if on_progress is not None:
+            on_progress(pages)
+    for path in paths:
+        if os.path.islink(path):
+            target = os.path.basename(os.readlink(path))
+            if target in by_name:
+                links.append((os.path.basename(path)[:-len('.pkl')], by_name[target]))
+    store.link_many(url, links)
+    if delete:
+        linked = {ts for ts, _ in links}
+        for path in paths:
+            name = os.path.basename(path)
+            if name in by_name or name[:-len('.pkl')] in linked:
+                os.remove(path)
+    return pages, len(links)
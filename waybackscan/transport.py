@@ -0,0 +1,111 @@
+"""One pooled HTTP session for everything that talks to web.archive.org."""
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .ratelimit import RateLimiter, THROTTLE_STATUSES
+
+USER_AGENT = 'waybackscan (+https://github.com/Watts-Lab/wayback_manager)'
+
+
+class Transport:
+    """
+    Thin wrapper around a `requests.Session` with keep-alive pooling, compression, timeouts and counters.
+
+    `pool_size` is how many connections per host get kept alive, `max_per_host` how many requests can be in
+    flight to one host at a time. `timeout` is (connect, read) seconds. Every request waits on `limiter`
+    first, and throttles or dropped connections get retried up to `retries` times at whatever pace the
+    limiter has backed off to.
+    """
+
+    def __init__(self, pool_size=16, max_per_host=4, timeout=(10, 120), user_agent=USER_AGENT,
+                 limiter: RateLimiter = None, retries=3):
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # ACCEPT_ENCODING only lists br if brotli is installed, so we never ask for something we can't decode.
+        self.session.headers.update({'Accept-Encoding': ACCEPT_ENCODING, 'User-Agent': user_agent})
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def _slot(self, host):
+        with self._lock:
+            return self._host_slots.setdefault(host, threading.BoundedSemaphore(self.max_per_host))
+
+    def _count(self, size=0, seconds=0.0, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += error
+            self.bytes += size
+            self.seconds += seconds
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire(host)
+            start = time.perf_counter()
+            try:
+                with self._slot(host):
+                    r = self.session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._count(error=True)
+                self.limiter.throttle(host)
+                if attempt == self.retries:
+                    raise
+                continue
+            except requests.exceptions.RequestException:
+                self._count(error=True)
+                raise
+            elapsed = time.perf_counter() - start
+            size = int(r.headers.get('Content-Length', 0)) if kwargs.get('stream') else len(r.content)
+            if r.status_code in THROTTLE_STATUSES:
+                self._count(size, elapsed, error=True)
+                self.limiter.throttle(host, _retry_after(r))
+                if attempt < self.retries:
+                    continue
+            else:
+                self._count(size, elapsed)
+                self.limiter.success(host, elapsed)
+            return r
+
+    def stats(self):
+        with self._lock:
+            stats = {'requests': self.requests, 'errors': self.errors, 'bytes': self.bytes, 'seconds': self.seconds}
+        return {**stats, **self.limiter.stats()}
+
+    def close(self):
+        self.session.close()
+
+
+def _retry_after(r):
+    try:
+        return float(r.headers.get('Retry-After', ''))
+    except ValueError:
+        # Could be an http date, not worth parsing, the backoff covers it.
+        return None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_transport() -> Transport:
+    """The process-wide transport, shared by WaybackCDX, the downloader and the scrapers unless they get their own."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Transport()
+        return _default
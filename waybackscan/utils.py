@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 import re
 from dateutil import rrule
 from pytz import UTC
@@ -46,13 +46,9 @@ def clean_text(text):
     return " ".join(out_text)
 
 def intervals(start: datetime, end: datetime, hrs=1):
-    leap = timedelta(hours=hrs)
-    if start.minute != 0:
-        start = start - timedelta(minutes=start.minute)
-    time = start
-    while time <= end:
-        yield time
-        time += leap
+    # kept for old callers, waybackscan.grid.interval_grid builds the whole thing as one array
+    from .grid import interval_grid
+    yield from interval_grid(start, end, hrs=hrs).to_pydatetime()
 
 WAYBACK_FORMAT = '%Y%m%d%H%M%S'
 
@@ -87,13 +83,7 @@ def bins(start: datetime, end: datetime, resolution: str):
     return corr_delta
 
 def ref_times(start: datetime, end: datetime, at):
-    for i in range((end - start).days + 1):
-        for subtime in at:
-            timei = start + timedelta(days=i)
-            if not subtime.tzinfo:
-                tz_at = HERE
-            else:
-                tz_at = subtime.tzinfo
-            timei = timei.replace(hour=subtime.hour, minute=subtime.minute, second=subtime.second, microsecond=subtime.microsecond, tzinfo=tz_at)
-            yield timei
+    # replace(tzinfo=pytz zone) got the offsets wrong, this goes through waybackscan.grid.daily_grid now
+    from .grid import daily_grid
+    yield from daily_grid(start, end, at).to_pydatetime()
 
@@ -0,0 +1,557 @@
+"""
+WARC files of downloaded captures: written as `fetch` goes, and read back (ours or anyone's) without the network.
+
+    DIR/<prefix>-<YYYYmmddHHMMSS>-<serial>.warc.gz   one gzip member per record, so any record can be seeked to
+    DIR/<prefix>-<YYYYmmddHHMMSS>-<serial>.cdx       its CDX index: urlkey timestamp original mimetype status
+                                                     digest redirect meta length offset filename, sorted
+
+Each capture is a `response` record dated when the archive captured it, with the original http headers where
+the archive hands them back (as x-archive-orig-*). A capture whose page is the same as one already written is a
+`revisit` record pointing at it, like crawlers write for pages that haven't changed.
+"""
+import glob
+import gzip
+import http.client
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from .replay import ReplayTransport
+from .schema import TIMESTAMP_COLUMN, wayback_seconds
+from .store import content_digest
+
+WARC_VERSION = 'WARC/1.0'
+REVISIT_PROFILE = 'http://netpreserve.org/warc/1.0/revisit/identical-payload-digest'
+CDX_HEADER = ' CDX N b a m s k r M S V g\n'
+# New file once the current one gets this big.
+MAX_SIZE = 2**30
+CHUNK = 2**16
+# What the archive adds to a response itself rather than passing on from the site.
+_ORIG = 'x-archive-orig-'
+_DROP = {'content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive'}
+
+WarcRecord = namedtuple('WarcRecord', ['type', 'uri', 'timestamp', 'status', 'headers', 'http_headers', 'payload',
+                                       'offset'])
+WarcRecord.__doc__ = """
+One record. `timestamp` is the WARC-Date as 14 wayback digits, `headers` the WARC headers, `http_headers` the
+(name, value) pairs of the http response in it. `payload` is the body as the site sent it, with any chunking
+and gzip undone (None for records `iter_records` was told to skip). `offset` is where it starts in the file
+(None if it shares a gzip member with other records).
+"""
+
+
+def surt(uri):
+    """The CDX urlkey of a uri, e.g. https://www.breitbart.com/politics -> com,breitbart)/politics."""
+    scheme, sep, rest = uri.partition('://')
+    rest = rest if sep else scheme
+    host, slash, path = rest.partition('/')
+    host = re.sub(r'^www\d*\.', '', host.split('@')[-1].split(':')[0].lower())
+    return (','.join(reversed(host.split('.'))) + ')/' + path).lower()
+
+
+def _warc_date(timestamp):
+    t = str(timestamp).ljust(14, '0')
+    return f'{t[:4]}-{t[4:6]}-{t[6:8]}T{t[8:10]}:{t[10:12]}:{t[12:14]}Z'
+
+
+def _timestamp(warc_date):
+    return re.sub(r'\D', '', warc_date)[:14].ljust(14, '0')
+
+
+def _original(response, url):
+    # wayback's url for the capture ends in the original one, after whatever redirects it did on the way
+    _, sep, original = (getattr(response, 'url', None) or '').partition('id_/')
+    return original if sep else (url if '://' in url else f'https://{url}')
+
+
+def _http_head(status, reason, headers, length):
+    lines = [f'HTTP/1.1 {status} {reason or http.client.responses.get(status, "")}']
+    lines += [f'{name}: {value}' for name, value in headers if name.lower() not in _DROP]
+    lines.append(f'Content-Length: {length}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8', 'replace')
+
+
+def _response_headers(response):
+    """The site's own headers for a response from the archive, or all of them if it didn't keep any."""
+    items = list(response.headers.items())
+    original = [(name[len(_ORIG):], value) for name, value in items if name.lower().startswith(_ORIG)]
+    if not original:
+        return items
+    # the archive passes Content-Type through as is rather than as x-archive-orig-content-type
+    if not any(name.lower() == 'content-type' for name, _ in original):
+        original += [(name, value) for name, value in items if name.lower() == 'content-type']
+    return original
+
+
+def _record(warc_type, uri, timestamp, block, fields=()):
+    head = [WARC_VERSION, f'WARC-Type: {warc_type}', f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+            f'WARC-Date: {_warc_date(timestamp)}']
+    if uri:
+        head.append(f'WARC-Target-URI: {uri}')
+    head += [f'{name}: {value}' for name, value in fields]
+    head.append(f'Content-Length: {len(block)}')
+    return gzip.compress(('\r\n'.join(head) + '\r\n\r\n').encode() + block + b'\r\n\r\n', mtime=0)
+
+
+def sidecar_path(path):
+    return re.sub(r'\.warc(\.gz)?$', '', path) + '.cdx'
+
+
+class WarcWriter:
+    """
+    Captures into gzipped WARC files in `directory`, starting a new one every `max_size` bytes, each with its CDX
+    sidecar. It has the put/digest/link_many of `store.SnapshotStore`, so `fetch_snapshots` can write into it,
+    and `put_response` to keep the headers too. Every record is flushed before put returns, so nothing the
+    journal has as done is still sitting in a buffer. Safe to share between threads.
+
+    What's already in the directory's sidecars counts as written, so a resumed fetch adds revisits to pages
+    from earlier runs instead of writing them again.
+    """
+
+    def __init__(self, directory, prefix='waybackscan', max_size=MAX_SIZE):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = self._cdx = self.path = None
+        # (urlkey, timestamp) -> digest, and digest -> (uri, timestamp) of the response record holding it
+        self._captures = {}
+        self._responses = {}
+        for cdx in sorted(glob.glob(os.path.join(directory, '*.cdx'))):
+            for urlkey, timestamp, original, mimetype, _, digest, *_ in read_cdx(cdx):
+                self._captures[urlkey, timestamp] = digest
+                if mimetype != 'warc/revisit':
+                    self._responses.setdefault(digest, (original, timestamp))
+
+    def _open(self):
+        serial = len(glob.glob(os.path.join(self.directory, '*.warc.gz')))
+        name = f'{self.prefix}-{time.strftime("%Y%m%d%H%M%S", time.gmtime())}-{serial:05d}.warc.gz'
+        self.path = os.path.join(self.directory, name)
+        self._file = open(self.path, 'xb')
+        self._cdx = open(sidecar_path(self.path), 'w')
+        self._cdx.write(CDX_HEADER)
+        info = 'software: waybackscan\r\nformat: WARC File Format 1.0\r\n'.encode()
+        self._file.write(_record('warcinfo', None, time.strftime('%Y%m%d%H%M%S', time.gmtime()), info,
+                                 [('WARC-Filename', name), ('Content-Type', 'application/warc-fields')]))
+
+    def _finish(self):
+        # the sidecar is in write order until now, a crash before this leaves it complete but unsorted
+        self._file.close()
+        self._cdx.close()
+        sort_cdx(sidecar_path(self.path))
+        self._file = self._cdx = None
+
+    def _append(self, record, line):
+        if self._file is not None and self._file.tell() >= self.max_size:
+            self._finish()
+        if self._file is None:
+            self._open()
+        offset = self._file.tell()
+        self._file.write(record)
+        self._file.flush()
+        self._cdx.write(f'{line} {len(record)} {offset} {os.path.basename(self.path)}\n')
+        self._cdx.flush()
+
+    def _revisit(self, urlkey, uri, timestamp, digest):
+        refers_uri, refers_timestamp = self._responses[digest]
+        record = _record('revisit', uri, timestamp, b'', [
+            ('WARC-Profile', REVISIT_PROFILE), ('WARC-Refers-To-Target-URI', refers_uri),
+            ('WARC-Refers-To-Date', _warc_date(refers_timestamp)), ('WARC-Payload-Digest', f'sha1:{digest}')])
+        self._append(record, f'{urlkey} {timestamp} {uri} warc/revisit - {digest} - -')
+        self._captures[urlkey, timestamp] = digest
+
+    def _put(self, url, uri, timestamp, status, reason, headers, body):
+        timestamp = str(timestamp)
+        digest = content_digest(body)
+        head = _http_head(status, reason, headers, len(body))
+        mimetype = next((value for name, value in headers if name.lower() == 'content-type'), '-')
+        mimetype = mimetype.split(';')[0].strip().lower() or '-'
+        record = _record('response', uri, timestamp, head + body, [
+            ('Content-Type', 'application/http; msgtype=response'), ('WARC-Payload-Digest', f'sha1:{digest}'),
+            ('WARC-Block-Digest', f'sha1:{content_digest(head + body)}')])
+        urlkey = surt(url)
+        with self._lock:
+            if digest in self._responses:
+                self._revisit(urlkey, uri, timestamp, digest)
+            else:
+                self._append(record, f'{urlkey} {timestamp} {uri} {mimetype} {status} {digest} - -')
+                self._responses[digest] = (uri, timestamp)
+                self._captures[urlkey, timestamp] = digest
+        return digest
+
+    def put_response(self, url, timestamp, response):
+        """Write the capture of url at timestamp out of the archive's `response`, returns the page's digest."""
+        return self._put(url, _original(response, url), timestamp, response.status_code,
+                         getattr(response, 'reason', None), _response_headers(response), response.content)
+
+    def put(self, url, timestamp, html, digest=None):
+        """Same as `SnapshotStore.put`, for when there's only the html. Records carry their own sha1 digest."""
+        body = html.encode('utf-8') if isinstance(html, str) else html
+        return self._put(url, _original(None, url), timestamp, 200, 'OK',
+                         [('Content-Type', 'text/html; charset=utf-8')], body)
+
+    def digest(self, url, timestamp):
+        with self._lock:
+            return self._captures.get((surt(url), str(timestamp)))
+
+    def exists(self, url, timestamp):
+        return self.digest(url, timestamp) is not None
+
+    def link(self, url, timestamp, digest):
+        self.link_many(url, [(timestamp, digest)])
+
+    def link_many(self, url, pairs):
+        """Revisit records for captures with the same page as one already written."""
+        urlkey = surt(url)
+        with self._lock:
+            for timestamp, digest in pairs:
+                if self._captures.get((urlkey, str(timestamp))) != digest:
+                    self._revisit(urlkey, self._responses[digest][0], str(timestamp), digest)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Stream:
+    """The bytes of a WARC file a chunk at a time, through gzip (any number of members) if it's compressed."""
+
+    def __init__(self, f, gzipped):
+        self.f = f
+        self.gzipped = gzipped
+        self.buf = bytearray()
+        # file offset of the next byte not read yet, and of the gzip member the buffer came out of
+        self.pos = self.start = f.tell()
+        # bytes that have gone into the buffer so far, and how many of them had when that member started
+        self.out = self.member_out = 0
+        self._raw = b''
+        self._d = None
+
+    def _fill(self):
+        """Some more bytes into the buffer, False at the end of the file."""
+        while True:
+            if not self._raw:
+                self._raw = self.f.read(CHUNK)
+                if not self._raw:
+                    if self._d is not None and not self._d.eof:
+                        raise EOFError('the file stops part way through a gzip member')
+                    return False
+            if not self.gzipped:
+                self.buf += self._raw
+                self.pos += len(self._raw)
+                self._raw = b''
+                return True
+            if self._d is None or self._d.eof:
+                self._d = zlib.decompressobj(31)
+                self.start = self.pos
+                self.member_out = self.out
+            out = self._d.decompress(self._raw, CHUNK)
+            rest = self._d.unused_data if self._d.eof else self._d.unconsumed_tail
+            self.pos += len(self._raw) - len(rest)
+            self._raw = rest
+            if out:
+                self.buf += out
+                self.out += len(out)
+                return True
+
+    def offset(self):
+        """Where the next record starts: its gzip member for compressed files, None at the end."""
+        if not self.buf and not self._fill():
+            return None
+        return self.start if self.gzipped else self.pos - len(self.buf)
+
+    def seekable(self):
+        """
+        Whether `offset` is somewhere the next record can be read from on its own. Not when it's part way
+        through a gzip member, i.e. a file compressed as a whole or with several records to a member.
+        """
+        return not self.gzipped or self.out - len(self.buf) == self.member_out
+
+    def readline(self):
+        start = 0
+        while True:
+            i = self.buf.find(b'\n', start)
+            if i >= 0:
+                line = bytes(self.buf[:i + 1])
+                del self.buf[:i + 1]
+                return line
+            start = len(self.buf)
+            if not self._fill():
+                line = bytes(self.buf)
+                self.buf.clear()
+                return line
+
+    def read(self, n):
+        while len(self.buf) < n and self._fill():
+            pass
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        return data
+
+    def skip(self, n):
+        """Like read without keeping anything, so skipping a huge record doesn't hold it in memory."""
+        while n:
+            if not self.buf and not self._fill():
+                return False
+            step = min(n, len(self.buf))
+            del self.buf[:step]
+            n -= step
+        return True
+
+
+def _dechunk(body):
+    out, i = bytearray(), 0
+    while True:
+        j = body.find(b'\r\n', i)
+        if j < 0:
+            return bytes(body)
+        size = int(body[i:j].split(b';')[0] or b'0', 16)
+        if not size:
+            return bytes(out)
+        out += body[j + 2:j + 2 + size]
+        i = j + 2 + size + 2
+
+
+def _http(block):
+    """Status, header pairs and decoded body of an http response block."""
+    head, sep, body = block.partition(b'\r\n\r\n')
+    if not sep:
+        head, sep, body = block.partition(b'\n\n')
+    lines = head.decode('iso-8859-1').splitlines()
+    parts = lines[0].split(' ', 2) if lines else []
+    status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+    headers = [tuple(part.strip() for part in line.split(':', 1)) for line in lines[1:] if ':' in line]
+    encodings = {name.lower(): value.lower() for name, value in headers}
+    try:
+        if 'chunked' in encodings.get('transfer-encoding', ''):
+            body = _dechunk(body)
+        if encodings.get('content-encoding') in ('gzip', 'x-gzip'):
+            body = zlib.decompress(body, 31)
+        elif encodings.get('content-encoding') == 'deflate':
+            body = zlib.decompress(body)
+    except (ValueError, zlib.error):
+        # not what the headers say it is, the raw bytes are the best there is
+        pass
+    return status, headers, body
+
+
+def _read_record(stream, offset, types=None):
+    line = stream.readline()
+    if not line:
+        return None
+    if not line.startswith(b'WARC/'):
+        raise ValueError(f'no WARC record at {offset}')
+    headers = {}
+    for line in iter(stream.readline, b''):
+        if not line.strip():
+            break
+        name, _, value = line.decode('utf-8', 'replace').partition(':')
+        headers[name.strip()] = value.strip()
+    length = int(headers.get('Content-Length', 0))
+    kind = headers.get('WARC-Type')
+    block = None
+    if types is None or kind in types:
+        block = stream.read(length)
+        if len(block) < length:
+            raise EOFError(f'the record at {offset} is cut short')
+    elif not stream.skip(length):
+        raise EOFError(f'the record at {offset} is cut short')
+    # every record ends in a blank line (two line ends)
+    stream.readline()
+    stream.readline()
+    status, http_headers, payload = None, [], block
+    if block is not None and headers.get('Content-Type', '').startswith('application/http') \
+            and kind in ('response', 'revisit'):
+        status, http_headers, payload = _http(block)
+    return WarcRecord(kind, headers.get('WARC-Target-URI'), _timestamp(headers.get('WARC-Date', '')), status,
+                      headers, http_headers, payload, offset)
+
+
+def _gzipped(f):
+    magic = f.read(2)
+    f.seek(-len(magic), os.SEEK_CUR)
+    return magic == b'\x1f\x8b'
+
+
+def iter_records(path, types=None):
+    """
+    The records of a .warc or .warc.gz file one at a time, as `WarcRecord`s. Only the record being looked at is
+    in memory, so a file of any size goes through in the same few MB. With `types` ('response', 'revisit', ...)
+    everything else comes back without its payload. A file that stops part way through its last record (the
+    writer got killed) just ends there, with a note on stderr. A record that doesn't start a gzip member of
+    its own has no offset (None), there's nowhere to seek to for it.
+    """
+    with open(path, 'rb') as f:
+        stream = _Stream(f, _gzipped(f))
+        while True:
+            offset = None
+            try:
+                offset = stream.offset()
+                if offset is None:
+                    return
+                record = _read_record(stream, offset if stream.seekable() else None, types)
+            except EOFError:
+                print(f'{path} stops part way through the record at {offset}, skipping it', file=sys.stderr)
+                return
+            if record is None:
+                return
+            yield record
+
+
+def read_record(path, offset):
+    """The record at `offset` of a WARC file, e.g. from a CDX line, without reading anything before it."""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return _read_record(_Stream(f, _gzipped(f)), offset)
+
+
+def read_cdx(path):
+    """The lines of a CDX sidecar, split into their fields."""
+    with open(path) as f:
+        return [line.split() for line in f if line.strip() and not line.startswith(' CDX')]
+
+
+def sort_cdx(path):
+    with open(path) as f:
+        lines = [line for line in f if line.strip() and not line.startswith(' CDX')]
+    part = path + '.part'
+    with open(part, 'w') as f:
+        f.write(CDX_HEADER)
+        f.writelines(sorted(lines))
+    os.replace(part, path)
+
+
+def index_warc(path, cdx_path=None):
+    """
+    Write the CDX sidecar of a WARC file (ours or anyone's) by reading it through once, returns how many
+    captures it lists. Only response, revisit and resource records count as captures. ValueError for a
+    .warc.gz that isn't one gzip member per record, which has no offsets to put in one.
+    """
+    cdx_path = cdx_path or sidecar_path(path)
+    name = os.path.basename(path)
+    lines, pending = [], None
+
+    def finish(end):
+        line, offset = pending
+        lines.append(f'{line} {end - offset} {offset} {name}\n')
+
+    for record in iter_records(path, types=('response', 'revisit', 'resource')):
+        if record.offset is None:
+            raise ValueError(f"{path} has more than one record to a gzip member, so they can't be looked up "
+                             "by offset. Compress it again one record per member (or gunzip it) to index it")
+        if pending is not None:
+            finish(record.offset)
+            pending = None
+        if record.type not in ('response', 'revisit', 'resource') or not record.uri:
+            continue
+        digest = record.headers.get('WARC-Payload-Digest', '').partition(':')[2] or content_digest(record.payload)
+        if record.type == 'revisit':
+            mimetype, status = 'warc/revisit', '-'
+        else:
+            headers = record.http_headers or [('Content-Type', record.headers.get('Content-Type', '-'))]
+            mimetype = next((value for key, value in headers if key.lower() == 'content-type'), '-')
+            mimetype = mimetype.split(';')[0].strip().lower() or '-'
+            status = record.status or '-'
+        pending = f'{surt(record.uri)} {record.timestamp} {record.uri} {mimetype} {status} {digest} - -', record.offset
+    if pending is not None:
+        # the last one runs to the end of the file
+        finish(os.path.getsize(path))
+    part = cdx_path + '.part'
+    with open(part, 'w') as f:
+        f.write(CDX_HEADER)
+        f.writelines(sorted(lines))
+    os.replace(part, cdx_path)
+    return len(lines)
+
+
+def warc_paths(warcs):
+    """WARC files out of a path, a directory of them, a glob or a list of any of those."""
+    paths = []
+    for warc in [warcs] if isinstance(warcs, (str, os.PathLike)) else warcs:
+        warc = os.fspath(warc)
+        if os.path.isdir(warc):
+            paths += glob.glob(os.path.join(warc, '*.warc.gz')) + glob.glob(os.path.join(warc, '*.warc'))
+        else:
+            paths += glob.glob(warc) if glob.has_magic(warc) else [warc]
+    return sorted(paths)
+
+
+class WarcTransport(ReplayTransport):
+    """
+    `ReplayTransport` over WARC files, so anything that takes a transport (`WaybackCDX`, `fetch_snapshots`, a
+    `PublisherScraper`) runs off them with no network at all. CDX queries are answered from the sidecars,
+    which get made with `index_warc` for files without an up to date one, and snapshot urls come out of the
+    records, a revisit from the record it points at. Urls match on their urlkey, so with or without https://
+    and www. doesn't matter.
+
+    Revisits are listed with the status and mimetype of the page they repeat rather than the '-' and
+    warc/revisit the archive's CDX server gives them, so a statuscode:200 filter keeps them.
+    """
+
+    def __init__(self, warcs, latency=0.0, bandwidth=None):
+        super().__init__(latency=latency, bandwidth=bandwidth)
+        # (urlkey, timestamp) -> (path, offset), and digest -> (path, offset) of a response holding that page
+        self._where = {}
+        self._pages = {}
+        lines = []
+        for path in warc_paths(warcs):
+            cdx = sidecar_path(path)
+            if not os.path.exists(cdx) or os.path.getmtime(cdx) < os.path.getmtime(path):
+                index_warc(path, cdx)
+            lines += [(path, fields) for fields in read_cdx(cdx)]
+        kinds = {}
+        for path, (urlkey, timestamp, original, mimetype, status, digest, _, _, length, offset, _) in lines:
+            self._where[urlkey, timestamp] = (path, int(offset))
+            if mimetype != 'warc/revisit':
+                self._pages.setdefault(digest, (path, int(offset)))
+                kinds.setdefault(digest, (mimetype, status))
+        rows = {}
+        for path, (urlkey, timestamp, original, mimetype, status, digest, _, _, length, _, _) in lines:
+            if mimetype == 'warc/revisit':
+                mimetype, status = kinds.get(digest, (mimetype, status))
+            rows.setdefault(urlkey, []).append([urlkey, timestamp, original, mimetype, status, digest, length])
+        for urlkey, captures in rows.items():
+            self.add(urlkey, captures)
+
+    def _select(self, query):
+        return super()._select({**query, 'url': surt(query.get('url', ''))})
+
+    def record(self, url, timestamp):
+        """The record of url's capture nearest to timestamp (the one it points at for a revisit), None if none."""
+        captures = self._captures.get(surt(url))
+        if captures is None or not len(captures.stamps):
+            return None
+        want = int(re.sub(r'\D', '', str(timestamp)).ljust(14, '0')[:14])
+        i = np.searchsorted(captures.stamps, want)
+        # the nearer of the two either side, the way the archive picks one
+        if i == len(captures.stamps) or (
+                i and wayback_seconds(want) - wayback_seconds(captures.stamps[i - 1])
+                < wayback_seconds(captures.stamps[i]) - wayback_seconds(want)):
+            i -= 1
+        record = read_record(*self._where[surt(url), captures.table[i, TIMESTAMP_COLUMN]])
+        if record.type == 'revisit':
+            digest = record.headers.get('WARC-Payload-Digest', '').partition(':')[2]
+            if digest not in self._pages:
+                return None
+            record = read_record(*self._pages[digest])
+        return record
+
+    def _snapshot(self, path):
+        stamp, _, original = path[len('/web/'):].partition('/')
+        record = self.record(original, stamp)
+        return record.payload if record is not None and record.payload is not None else b''
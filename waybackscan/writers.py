@@ -0,0 +1,122 @@
+"""Writers that take CDX frames a batch at a time, so output can start before the download finishes."""
+import sys
+
+FORMATS = ('tsv', 'parquet', 'arrow', 'jsonl')
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('parquet and arrow output need pyarrow, `pip install waybackscan[arrow]`') from e
+    return pyarrow
+
+
+class BatchWriter:
+    binary = False
+
+    def __init__(self, path='-'):
+        self.path = path
+        self.rows = 0
+        if path in (None, '-'):
+            self.file = sys.stdout.buffer if self.binary else sys.stdout
+            self._owns_file = False
+        else:
+            self.file = open(path, 'wb' if self.binary else 'w', newline=None if self.binary else '')
+            self._owns_file = True
+
+    def write(self, df):
+        self._write(df)
+        self.rows += len(df)
+
+    def _write(self, df):
+        raise NotImplementedError()
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TSVWriter(BatchWriter):
+    def __init__(self, path='-'):
+        super().__init__(path)
+        self._header = True
+
+    def _write(self, df):
+        df.to_csv(self.file, sep='\t', index=None, header=self._header)
+        self._header = False
+
+
+class JSONLWriter(BatchWriter):
+    def _write(self, df):
+        if len(df):
+            # Older pandas leaves off the trailing newline, newer pandas doesn't.
+            lines = df.to_json(orient='records', lines=True, date_format='iso', date_unit='s')
+            self.file.write(lines if lines.endswith('\n') else lines + '\n')
+
+
+class ArrowWriter(BatchWriter):
+    """
+    Arrow IPC stream, types come through as-is so reading it back (`pyarrow.ipc.open_stream`) is zero-parse.
+    A stream rather than a file because every batch brings its own categorical dictionary.
+    """
+    binary = True
+
+    def __init__(self, path='-'):
+        super().__init__(path)
+        self.pa = _pyarrow()
+        self.schema = None
+        self._writer = None
+        self._empty = None
+
+    def _table(self, df):
+        if self.schema is None:
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            # pandas picks the smallest index type for each batch's categories, fix it at int32 for all of them.
+            self.schema = self.pa.schema(
+                [field.with_type(self.pa.dictionary(self.pa.int32(), field.type.value_type))
+                 if self.pa.types.is_dictionary(field.type) else field for field in table.schema],
+                metadata=table.schema.metadata)
+            self._writer = self._open()
+            return table.cast(self.schema)
+        return self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+
+    def _open(self):
+        return self.pa.ipc.new_stream(self.file, self.schema)
+
+    def _write(self, df):
+        if self.schema is None and not len(df):
+            # Empty object columns have no type yet, hold off unless it's all we ever get.
+            self._empty = df
+            return
+        table = self._table(df)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is None and self._empty is not None:
+            self._table(self._empty)
+        if self._writer is not None:
+            self._writer.close()
+        super().close()
+
+
+class ParquetWriter(ArrowWriter):
+    def _open(self):
+        return self.pa.parquet.ParquetWriter(self.file, self.schema)
+
+
+WRITERS = {'tsv': TSVWriter, 'jsonl': JSONLWriter, 'arrow': ArrowWriter, 'parquet': ParquetWriter}
+
+
+def open_writer(fmt='tsv', path='-') -> BatchWriter:
+    return WRITERS[fmt](path)